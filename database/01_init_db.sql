@@ -92,15 +92,21 @@ CREATE TRIGGER upd_seobs_modified
 -- must exist, and it must contain the sensor observations
 -- with `tfrom` timestamps and `statid` station ids.
 -- The function does basicly the following:
--- 1) select relevant sensor value records and order them by time
--- 2) find their validity ranges, and whenever the range
+-- 1) select relevant sensor value records, order them by time
+--    and compare each condition value to that of the previous row
+-- 2) number the runs of rows ("islands") with the same condition value
+--    by counting the changes so far; NULL values form runs of their own
+-- 3) find the validity ranges of the rows, and whenever the range
 --    is longer than `p_maxminutes`, truncate it to last
---    for `p_maxminutes`
--- 3) compare adjacent rows;
---    merge them as long as they form a continuous time range
---    AND the condition value remains the same
--- 4) return a table with "compressed" time ranges
+--    for `p_maxminutes`; the last row has no range and is left out
+-- 4) return a table with one "compressed" time range per run,
+--    from the start of its first row until the end of its last row,
 --    and corresponding condition truth values
+-- Note that consecutive rows with the same condition value are merged
+-- also over gaps longer than `p_maxminutes`.
+-- Only the first step needs to sort the rows.
+-- database/benchmark_pack_ranges.sql compares this to the earlier version
+-- that found run boundaries with LEAD/LAG and several sorts.
 --
 -- Example usage:
 --
@@ -133,61 +139,33 @@ BEGIN
 RETURN QUERY
 EXECUTE format(
 'WITH
-	nottruncated AS (
+	ordered AS (
 		SELECT
 			tfrom,
-			lead(tfrom) OVER (ORDER BY tfrom) AS tuntil,
-			(seval %s %s) AS istrue
-		FROM %I
+			lead(tfrom) OVER w AS tuntil,
+			COALESCE((seval %1$s %2$s)::int, -1) AS istrue,
+			lag(COALESCE((seval %1$s %2$s)::int, -1)) OVER w AS previous
+		FROM %3$I
 		WHERE
 			statid = $1
 			AND seid = $2
-		ORDER BY tfrom),
-	truncated AS (
+		WINDOW w AS (ORDER BY tfrom)),
+	islands AS (
 		SELECT
-			tstzrange(tfrom,
-			(CASE WHEN (tuntil-tfrom) > make_interval(mins := $3) THEN
-				tfrom + make_interval(mins := $3)
-			 ELSE
-				tuntil
-			 END)) AS valid_r,
-			istrue
-		FROM nottruncated
-		WHERE tuntil IS NOT NULL),
-istrue_tb AS
-	(SELECT valid_r, COALESCE(istrue::int, -1) AS istrue
-	 FROM truncated
-	 ORDER BY valid_r),
-ll_tb AS
-	(SELECT valid_r,
-	 istrue,
-	 LEAD(istrue, 1) OVER (ORDER BY valid_r),
-	 LAG(istrue, 1) OVER (ORDER BY valid_r)
-	 FROM istrue_tb),
-isfl_tb AS
-	(SELECT valid_r,
-	 istrue,
-	 (istrue <> lag OR lag IS NULL) AS isfirst,
-	 (istrue <> lead OR lead IS NULL) AS islast
-	 FROM ll_tb),
-fl_tb AS
-	(SELECT *
-	FROM isfl_tb
-	WHERE isfirst OR islast),
-total_range_tb AS
-	(SELECT *,
-	CASE WHEN (isfirst AND islast) THEN
-	 	valid_r
-	 WHEN (isfirst AND not islast) THEN
-	 	tstzrange(lower(valid_r),
-				  upper(LEAD(valid_r, 1) OVER (ORDER BY valid_r)))
-	 WHEN (not isfirst AND islast) THEN
-	 	tstzrange(lower(LAG(valid_r, 1) OVER (ORDER BY valid_r)),
-				  upper(valid_r))
-	 END
-	 AS total_range
-	FROM fl_tb)
-SELECT total_range AS valid_r,
+			tfrom,
+			tuntil,
+			istrue,
+			count(*) FILTER (WHERE istrue IS DISTINCT FROM previous)
+				OVER (ORDER BY tfrom ROWS UNBOUNDED PRECEDING) AS island
+		FROM ordered
+		WHERE tuntil IS NOT NULL)
+SELECT
+	tstzrange(min(tfrom),
+	max(CASE WHEN (tuntil-tfrom) > make_interval(mins := $3) THEN
+			tfrom + make_interval(mins := $3)
+		ELSE
+			tuntil
+		END)) AS valid_r,
 	(CASE WHEN istrue = 1 THEN
 		true
 	WHEN istrue = 0 THEN
@@ -195,8 +173,8 @@ SELECT total_range AS valid_r,
 	ELSE
 		NULL
 	END) AS istrue
-FROM total_range_tb
-WHERE isfirst', p_operator, p_seval, p_obs_relation)
+FROM islands
+GROUP BY island, istrue', p_operator, p_seval, p_obs_relation)
 USING p_statid, p_seid, p_maxminutes;
 END
 $func$ LANGUAGE plpgsql;
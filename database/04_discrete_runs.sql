@@ -0,0 +1,136 @@
+/*
+Run-length storage of discrete-valued sensors.
+Sensors like keli_1, varoitus_1, sateen_olomuoto_pwdxx and pwd_tila
+hold the same value for hours, yet seobs has a row for every observation.
+For the sensors marked discrete, seobs_runs stores the observations
+of a station and sensor with the same value as one run,
+which the tsa_block_runs query (tsa/sql/block_runs.sql)
+reads instead of the raw rows.
+Run init_db.sql and rawdata_schema.sql first,
+and call populate_seobs_runs() after populate_seobs().
+*/
+\connect tsa;
+
+ALTER TABLE sensors ADD COLUMN IF NOT EXISTS discrete boolean NOT NULL DEFAULT false;
+
+UPDATE sensors SET discrete = true
+WHERE name IN ('keli_1', 'keli_2', 'varoitus_1', 'varoitus_2',
+               'sateen_olomuoto_pwdxx', 'pwd_tila');
+
+/*
+One row per run of consecutive observations of a station and sensor
+with the same value, no two of them further apart than p_maxminutes:
+vfrom is the time of the first observation,
+and vuntil the end of the validity of the last one,
+i.e. the time of the next observation,
+but at most p_maxminutes after the last one, like in pack_ranges.
+The maxminutes must be that of the analysis, tsa.block.MAXMINUTES:
+the analysis tool reads the observations instead of runs built
+with another one, or not built up to the end of the analysis period.
+*/
+CREATE TABLE IF NOT EXISTS seobs_runs (
+  statid    integer     NOT NULL,
+  seid      integer     NOT NULL,
+  vfrom     timestamptz NOT NULL,
+  vuntil    timestamptz NOT NULL,
+  seval     real        NOT NULL,
+  nobs      integer     NOT NULL,
+  maxminutes integer,
+  PRIMARY KEY (statid, seid, vfrom)
+);
+
+-- Tables made before maxminutes was recorded; their runs are not used until built again
+ALTER TABLE seobs_runs ADD COLUMN IF NOT EXISTS maxminutes integer;
+
+/*
+Build the runs of discrete sensors from observations
+at or after p_since: runs from the last one starting before p_since on
+are deleted and built again, since new observations
+can continue the last run or end it earlier.
+p_since must not be later than the first observation inserted
+since the previous call; by default all the runs are built.
+
+Example usage, after populating a month:
+
+CALL populate_seobs_runs('2018-01-01');
+*/
+CREATE OR REPLACE PROCEDURE populate_seobs_runs(p_since timestamptz DEFAULT '-infinity',
+                                                p_maxminutes integer DEFAULT 30)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  DROP TABLE IF EXISTS seobs_runs_restart;
+  CREATE TEMP TABLE seobs_runs_restart ON COMMIT DROP AS
+  SELECT statid, seid, max(vfrom) AS vfrom
+  FROM seobs_runs
+  WHERE vfrom < p_since
+  GROUP BY statid, seid;
+
+  DELETE FROM seobs_runs
+  USING seobs_runs_restart
+  WHERE
+    seobs_runs.statid = seobs_runs_restart.statid
+    AND seobs_runs.seid = seobs_runs_restart.seid
+    AND seobs_runs.vfrom >= seobs_runs_restart.vfrom;
+  DELETE FROM seobs_runs
+  WHERE vfrom >= p_since;
+
+  WITH
+    obs AS (
+      SELECT
+        statobs.statid,
+        seobs.seid,
+        statobs.tfrom,
+        seobs.seval
+      FROM statobs
+      INNER JOIN seobs
+        ON statobs.id = seobs.obsid
+      INNER JOIN sensors
+        ON seobs.seid = sensors.id
+      LEFT JOIN seobs_runs_restart
+        ON statobs.statid = seobs_runs_restart.statid
+        AND seobs.seid = seobs_runs_restart.seid
+      WHERE
+        sensors.discrete
+        AND statobs.tfrom >= COALESCE(seobs_runs_restart.vfrom, p_since)
+    ),
+    ordered AS (
+      SELECT
+        statid,
+        seid,
+        tfrom,
+        seval,
+        lead(tfrom) OVER w AS tnext,
+        lag(tfrom) OVER w AS tprevious,
+        lag(seval) OVER w AS previous
+      FROM obs
+      WINDOW w AS (PARTITION BY statid, seid ORDER BY tfrom)
+    ),
+    numbered AS (
+      SELECT
+        *,
+        count(*) FILTER (
+          WHERE seval IS DISTINCT FROM previous
+          OR tfrom - tprevious > make_interval(mins := p_maxminutes))
+          OVER (PARTITION BY statid, seid ORDER BY tfrom ROWS UNBOUNDED PRECEDING) AS run
+      FROM ordered
+    )
+  INSERT INTO seobs_runs (statid, seid, vfrom, vuntil, seval, nobs, maxminutes)
+  SELECT
+    statid,
+    seid,
+    min(tfrom),
+    -- The last observation has no next one yet
+    max(least(tnext, tfrom + make_interval(mins := p_maxminutes))),
+    seval,
+    count(*),
+    p_maxminutes
+  FROM numbered
+  GROUP BY statid, seid, run, seval;
+
+  DROP TABLE seobs_runs_restart;
+  ANALYZE seobs_runs;
+END
+$$;
+
+CALL populate_seobs_runs();
@@ -0,0 +1,62 @@
+/*
+Availability index of sensor observations:
+for each station, sensor and year, a bitmap of the days (UTC)
+that have at least one observation.
+The analysis tool reads it before querying the observations,
+so that Blocks of station and sensor pairs without any data
+in the analysis period need not be queried at all.
+Run init_db.sql and rawdata_schema.sql first,
+and call populate_seobs_days() after populate_seobs().
+*/
+\connect tsa;
+
+/*
+Bit n of days (from the left, starting from 0) tells whether
+there are observations on day n + 1 of the year;
+the last bit is always unset in years of 365 days.
+*/
+CREATE TABLE IF NOT EXISTS seobs_days (
+  statid    integer     NOT NULL,
+  seid      integer     NOT NULL,
+  year      smallint    NOT NULL,
+  days      bit(366)    NOT NULL,
+  PRIMARY KEY (statid, seid, year)
+);
+
+/*
+Set the days of the observations at or after p_since.
+Days are only added, so p_since must not be later than
+the first observation inserted since the previous call;
+by default all the observations are read.
+
+Example usage, after populating a month:
+
+CALL populate_seobs_days('2018-01-01');
+*/
+CREATE OR REPLACE PROCEDURE populate_seobs_days(p_since timestamptz DEFAULT '-infinity')
+LANGUAGE SQL
+AS $$
+WITH
+  obs_days AS (
+    SELECT DISTINCT
+      statobs.statid,
+      seobs.seid,
+      (statobs.tfrom AT TIME ZONE 'UTC')::date AS day
+    FROM statobs
+    INNER JOIN seobs
+      ON statobs.id = seobs.obsid
+    WHERE statobs.tfrom >= p_since
+  )
+INSERT INTO seobs_days (statid, seid, year, days)
+SELECT
+  statid,
+  seid,
+  extract(year FROM day)::smallint,
+  bit_or(set_bit(repeat('0', 366)::bit(366), extract(doy FROM day)::integer - 1, 1))
+FROM obs_days
+GROUP BY statid, seid, extract(year FROM day)
+ON CONFLICT (statid, seid, year) DO UPDATE
+SET days = seobs_days.days | EXCLUDED.days;
+$$;
+
+CALL populate_seobs_days();
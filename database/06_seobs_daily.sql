@@ -0,0 +1,64 @@
+/*
+Daily summary of sensor observations:
+for each station, sensor and day (UTC), the number of observations,
+the first and last observation time and the min and max value.
+Coverage checks read this instead of grouping the whole
+seobs and statobs join, see observations_summary.sql and tsa.coverage.
+Run init_db.sql and rawdata_schema.sql first,
+and call populate_seobs_daily() after populate_seobs().
+*/
+\connect tsa;
+
+CREATE TABLE IF NOT EXISTS seobs_daily (
+  statid    integer     NOT NULL,
+  seid      integer     NOT NULL,
+  day       date        NOT NULL,
+  nobs      integer     NOT NULL,
+  first_ts  timestamptz NOT NULL,
+  last_ts   timestamptz NOT NULL,
+  min_seval real        NOT NULL,
+  max_seval real        NOT NULL,
+  PRIMARY KEY (statid, seid, day)
+);
+
+CREATE INDEX IF NOT EXISTS seobs_daily_day_idx ON seobs_daily(day);
+
+/*
+Summarize the days from the day of p_since on again,
+reading all the observations of those days.
+p_since must not be later than the first observation inserted
+since the previous call; by default all the days are summarized.
+
+Example usage, after populating a month:
+
+CALL populate_seobs_daily('2018-01-01');
+*/
+CREATE OR REPLACE PROCEDURE populate_seobs_daily(p_since timestamptz DEFAULT '-infinity')
+LANGUAGE SQL
+AS $$
+INSERT INTO seobs_daily (statid, seid, day, nobs, first_ts, last_ts, min_seval, max_seval)
+SELECT
+  statobs.statid,
+  seobs.seid,
+  (statobs.tfrom AT TIME ZONE 'UTC')::date,
+  count(*),
+  min(statobs.tfrom),
+  max(statobs.tfrom),
+  min(seobs.seval),
+  max(seobs.seval)
+FROM statobs
+INNER JOIN seobs
+  ON statobs.id = seobs.obsid
+-- Whole days, so that the rows of the days are replaced
+WHERE statobs.tfrom >= date_trunc('day', p_since AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+GROUP BY statobs.statid, seobs.seid, (statobs.tfrom AT TIME ZONE 'UTC')::date
+ON CONFLICT (statid, seid, day) DO UPDATE
+SET
+  nobs = EXCLUDED.nobs,
+  first_ts = EXCLUDED.first_ts,
+  last_ts = EXCLUDED.last_ts,
+  min_seval = EXCLUDED.min_seval,
+  max_seval = EXCLUDED.max_seval;
+$$;
+
+CALL populate_seobs_daily();
@@ -38,5 +38,8 @@ for m in "${months[@]}"; do
          COPY anturi_arvo FROM '/rawdata/anturi_arvo-2018_$m.csv' CSV HEADER DELIMITER '|'; \
          CALL populate_seobs(); \
          TRUNCATE TABLE anturi_arvo; \
+         CALL populate_seobs_runs('2018-$m-01'); \
+         CALL populate_seobs_days('2018-$m-01'); \
+         CALL populate_seobs_daily('2018-$m-01'); \
          COMMIT;"
 done
@@ -0,0 +1,99 @@
+-- Benchmark of primary Block queries:
+-- pack_ranges() builds its query with dynamic SQL and plans it on every call,
+-- whereas tsa prepares tsa_block_ranges (tsa/sql/block_ranges.sql)
+-- once per session and executes it for every Block.
+-- Both are run :n_calls times against a synthetic series
+-- of :n_obs observations in 10 minute steps.
+-- Uses temp tables only, so it can be run in the tsa database
+-- or any database where pack_ranges exists.
+--
+-- Example usage, from this directory:
+--
+-- psql -d tsa -f benchmark_block_query.sql
+-- psql -d tsa -v n_calls=500 -v n_obs=100 -f benchmark_block_query.sql
+
+\set ON_ERROR_STOP on
+\if :{?n_calls}
+\else
+	\set n_calls 200
+\endif
+\if :{?n_obs}
+\else
+	\set n_obs 1000
+\endif
+
+CREATE TEMP TABLE bench_obs AS
+SELECT
+	'2018-01-01'::timestamptz + make_interval(mins := 10*i) AS tfrom,
+	1 AS statid,
+	1 AS seid,
+	(i % 7)::real / 2 AS seval
+FROM generate_series(1, :n_obs) AS i;
+CREATE OR REPLACE TEMP VIEW obs_main AS
+SELECT tfrom, statid, seid, seval FROM bench_obs;
+ANALYZE bench_obs;
+
+\ir ../tsa/sql/block_ranges.sql
+-- Like tsa.db.prepare_block_query, use the generic plan
+-- so that executions are not planned again (PostgreSQL 12+)
+SELECT current_setting('server_version_num')::int >= 120000 AS has_plan_cache_mode \gset
+\if :has_plan_cache_mode
+	SET plan_cache_mode = force_generic_plan;
+\endif
+
+CREATE TEMP TABLE bench_results (
+	variant text,
+	n_calls integer,
+	total interval
+);
+
+-- Both variants must give the same ranges
+CREATE TEMP TABLE bench_prepared (valid_r, istrue) AS
+EXECUTE tsa_block_ranges(1, 1, '30 minutes', 1.5, '{}', false, true, true, '-infinity', 'infinity');
+\echo 'Rows differing between the variants (should be 0):'
+SELECT count(*) AS n_different_rows FROM (
+	(SELECT * FROM pack_ranges('obs_main', 30, 1, 1, '>=', '1.5')
+	 EXCEPT ALL
+	 SELECT * FROM bench_prepared)
+	UNION ALL
+	(SELECT * FROM bench_prepared
+	 EXCEPT ALL
+	 SELECT * FROM pack_ranges('obs_main', 30, 1, 1, '>=', '1.5'))
+) AS diff;
+
+-- Each call creates and drops a temp table like tsa does for Blocks,
+-- so that results are not transferred to the client
+\set dynamic_call 'CREATE TEMP TABLE bench_block AS SELECT * FROM pack_ranges(''obs_main'', 30, 1, 1, ''>='', ''1.5''); DROP TABLE bench_block;'
+\set prepared_call 'CREATE TEMP TABLE bench_block (valid_r, istrue) AS EXECUTE tsa_block_ranges(1, 1, ''30 minutes'', 1.5, ''{}'', false, true, true, ''-infinity'', ''infinity''); DROP TABLE bench_block;'
+
+-- Warm up caches
+\o /dev/null
+SELECT :'dynamic_call' FROM generate_series(1, 10) \gexec
+SELECT :'prepared_call' FROM generate_series(1, 10) \gexec
+\o
+
+SELECT clock_timestamp() AS t_start \gset
+\o /dev/null
+SELECT :'dynamic_call' FROM generate_series(1, :n_calls) \gexec
+\o
+INSERT INTO bench_results
+SELECT 'pack_ranges', :n_calls, clock_timestamp() - :'t_start'::timestamptz;
+
+SELECT clock_timestamp() AS t_start \gset
+\o /dev/null
+SELECT :'prepared_call' FROM generate_series(1, :n_calls) \gexec
+\o
+INSERT INTO bench_results
+SELECT 'tsa_block_ranges', :n_calls, clock_timestamp() - :'t_start'::timestamptz;
+
+\echo 'Time per call, including client round trips:'
+SELECT
+	variant,
+	n_calls,
+	:n_obs AS n_obs,
+	round((extract(epoch FROM total) * 1000 / n_calls)::numeric, 3) AS ms_per_call
+FROM bench_results;
+
+\echo 'Planning time of the prepared statement, once a plan is cached:'
+EXPLAIN (ANALYZE, SUMMARY ON, COSTS OFF, TIMING OFF)
+EXECUTE tsa_block_ranges(1, 1, '30 minutes', 1.5, '{}', false, true, true, '-infinity', 'infinity');
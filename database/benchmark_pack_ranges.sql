@@ -0,0 +1,247 @@
+-- Benchmark and equivalence check of pack_ranges (see 01_init_db.sql).
+-- pack_ranges finds runs of equal condition values with a single running count
+-- over rows sorted once ("gaps and islands"). The earlier version,
+-- defined below as pg_temp.pack_ranges_old, found the first and last row of each run
+-- with LEAD/LAG over several sorted passes.
+-- The two must return identical rows; this is checked first
+-- on a corpus of edge cases (see bench_cases below) with several operators.
+-- Then both are timed on synthetic series of increasing length.
+-- Uses temp objects only, so it can be run in the tsa database
+-- or any database where the current pack_ranges exists.
+--
+-- Example usage, from this directory:
+--
+-- psql -d tsa -f benchmark_pack_ranges.sql
+-- psql -d tsa -v max_obs=1000000 -f benchmark_pack_ranges.sql
+
+\set ON_ERROR_STOP on
+\if :{?max_obs}
+\else
+	\set max_obs 100000
+\endif
+
+-- Previous version of pack_ranges, for comparison only
+CREATE FUNCTION
+pg_temp.pack_ranges_old(p_obs_relation text,
+			p_maxminutes integer,
+			p_statid integer,
+			p_seid integer,
+			p_operator text,
+			p_seval text)
+RETURNS TABLE (valid_r tstzrange,
+			   istrue boolean) AS
+$func$
+BEGIN
+RETURN QUERY
+EXECUTE format(
+'WITH
+	nottruncated AS (
+		SELECT
+			tfrom,
+			lead(tfrom) OVER (ORDER BY tfrom) AS tuntil,
+			(seval %s %s) AS istrue
+		FROM %I
+		WHERE
+			statid = $1
+			AND seid = $2
+		ORDER BY tfrom),
+	truncated AS (
+		SELECT
+			tstzrange(tfrom,
+			(CASE WHEN (tuntil-tfrom) > make_interval(mins := $3) THEN
+				tfrom + make_interval(mins := $3)
+			 ELSE
+				tuntil
+			 END)) AS valid_r,
+			istrue
+		FROM nottruncated
+		WHERE tuntil IS NOT NULL),
+istrue_tb AS
+	(SELECT valid_r, COALESCE(istrue::int, -1) AS istrue
+	 FROM truncated
+	 ORDER BY valid_r),
+ll_tb AS
+	(SELECT valid_r,
+	 istrue,
+	 LEAD(istrue, 1) OVER (ORDER BY valid_r),
+	 LAG(istrue, 1) OVER (ORDER BY valid_r)
+	 FROM istrue_tb),
+isfl_tb AS
+	(SELECT valid_r,
+	 istrue,
+	 (istrue <> lag OR lag IS NULL) AS isfirst,
+	 (istrue <> lead OR lead IS NULL) AS islast
+	 FROM ll_tb),
+fl_tb AS
+	(SELECT *
+	FROM isfl_tb
+	WHERE isfirst OR islast),
+total_range_tb AS
+	(SELECT *,
+	CASE WHEN (isfirst AND islast) THEN
+	 	valid_r
+	 WHEN (isfirst AND not islast) THEN
+	 	tstzrange(lower(valid_r),
+				  upper(LEAD(valid_r, 1) OVER (ORDER BY valid_r)))
+	 WHEN (not isfirst AND islast) THEN
+	 	tstzrange(lower(LAG(valid_r, 1) OVER (ORDER BY valid_r)),
+				  upper(valid_r))
+	 END
+	 AS total_range
+	FROM fl_tb)
+SELECT total_range AS valid_r,
+	(CASE WHEN istrue = 1 THEN
+		true
+	WHEN istrue = 0 THEN
+		false
+	ELSE
+		NULL
+	END) AS istrue
+FROM total_range_tb
+WHERE isfirst', p_operator, p_seval, p_obs_relation)
+USING p_statid, p_seid, p_maxminutes;
+END
+$func$ LANGUAGE plpgsql;
+
+-- Edge cases, one station id each; observations are 10 minutes apart unless stated.
+-- p_maxminutes is 30 in all the checks.
+CREATE TEMP TABLE bench_cases (
+	statid integer,
+	seid integer,
+	tfrom timestamptz,
+	seval real
+);
+INSERT INTO bench_cases (statid, seid, tfrom, seval)
+SELECT c.statid, 1, '2018-01-01'::timestamptz + make_interval(mins := c.mins), c.seval
+FROM (VALUES
+	-- 1: no rows of the sensor, only of another one
+	(1, 0, NULL),
+	-- 2: single row
+	(2, 0, 1),
+	-- 3: two rows
+	(3, 0, 1), (3, 10, 0),
+	-- 4: NULL values only
+	(4, 0, NULL), (4, 10, NULL), (4, 20, NULL),
+	-- 5: NULL values at start, middle and end
+	(5, 0, NULL), (5, 10, NULL), (5, 20, 1), (5, 30, NULL), (5, 40, 1),
+	(5, 50, 1), (5, 60, 0), (5, 70, NULL), (5, 80, NULL),
+	-- 6: gaps longer than, equal to and just over p_maxminutes,
+	-- between equal and different values
+	(6, 0, 1), (6, 120, 1), (6, 150, 1), (6, 181, 1), (6, 300, 0),
+	(6, 330, 0), (6, 331, 1), (6, 500, NULL), (6, 600, NULL), (6, 610, 0),
+	-- 7: value changes on every row
+	(7, 0, 0), (7, 10, 1), (7, 20, 0), (7, 30, 1), (7, 40, 0), (7, 50, 1),
+	-- 8: real values that differ from the literals, e.g. 0.1::real <> 0.1
+	(8, 0, 0.1), (8, 10, 0.1), (8, 20, 1.5), (8, 30, 0.5), (8, 40, 0.1)
+) AS c(statid, mins, seval);
+-- Case 1 has a row of sensor 2 only
+UPDATE bench_cases SET seid = 2 WHERE statid = 1;
+-- 9: a random series of irregular steps and NULL values,
+-- inserted in random order
+SELECT setseed(0.5);
+INSERT INTO bench_cases (statid, seid, tfrom, seval)
+SELECT 9, 1, tfrom, seval
+FROM (
+	SELECT
+		'2018-01-01'::timestamptz
+			+ make_interval(mins := (sum(1 + floor(random() * 60)) OVER (ORDER BY i))::integer) AS tfrom,
+		(CASE WHEN random() < 0.1 THEN NULL ELSE floor(random() * 4) / 2 END)::real AS seval
+	FROM generate_series(1, 5000) AS i
+	) AS s
+ORDER BY random();
+ANALYZE bench_cases;
+
+CREATE TEMP TABLE bench_operators (operator text, seval text);
+INSERT INTO bench_operators VALUES
+	('>=', '1'), ('<', '0.5'), ('=', '1'), ('<>', '1'),
+	('>', '0.1'), ('=', '0.1'), ('in', '(0, 1.5)'), ('in', '(0.1, 0.5)');
+
+\echo 'Edge cases where the versions differ (should be none):'
+SELECT
+	c.statid,
+	o.operator,
+	o.seval,
+	d.n_different_rows
+FROM generate_series(1, 9) AS c(statid)
+CROSS JOIN bench_operators AS o
+CROSS JOIN LATERAL (
+	SELECT count(*) AS n_different_rows FROM (
+		(SELECT * FROM pg_temp.pack_ranges_old('bench_cases', 30, c.statid, 1, o.operator, o.seval)
+		 EXCEPT ALL
+		 SELECT * FROM pack_ranges('bench_cases', 30, c.statid, 1, o.operator, o.seval))
+		UNION ALL
+		(SELECT * FROM pack_ranges('bench_cases', 30, c.statid, 1, o.operator, o.seval)
+		 EXCEPT ALL
+		 SELECT * FROM pg_temp.pack_ranges_old('bench_cases', 30, c.statid, 1, o.operator, o.seval))
+	) AS diff
+	) AS d
+WHERE d.n_different_rows > 0;
+
+\echo 'Rows compared per edge case:'
+SELECT
+	c.statid,
+	sum((SELECT count(*) FROM pack_ranges('bench_cases', 30, c.statid, 1, o.operator, o.seval))) AS n_rows
+FROM generate_series(1, 9) AS c(statid)
+CROSS JOIN bench_operators AS o
+GROUP BY c.statid
+ORDER BY c.statid;
+
+-- Synthetic series of 100, 1000, ... up to :max_obs observations
+-- in 10 minute steps, with runs of equal values, NULL values and gaps;
+-- the station id is the length of the series
+CREATE TEMP TABLE bench_series AS
+SELECT
+	n.n_obs AS statid,
+	1 AS seid,
+	'2018-01-01'::timestamptz + make_interval(mins := 10*i) AS tfrom,
+	(CASE WHEN i % 101 = 0 THEN NULL ELSE (i / 5 % 7)::real / 2 END) AS seval
+FROM (
+	SELECT (10 ^ e)::integer AS n_obs
+	FROM generate_series(2, floor(log(:max_obs))::integer) AS e
+	) AS n
+CROSS JOIN generate_series(1, n.n_obs) AS i
+WHERE i % 97 NOT BETWEEN 1 AND 6;
+CREATE INDEX ON bench_series (statid, seid);
+ANALYZE bench_series;
+
+-- Mean milliseconds per call of function p_function on series p_statid
+CREATE FUNCTION pg_temp.time_calls(p_function text, p_statid integer, p_n_calls integer)
+RETURNS double precision AS
+$func$
+DECLARE
+	t_start timestamptz;
+BEGIN
+	t_start := clock_timestamp();
+	FOR i IN 1..p_n_calls LOOP
+		EXECUTE format(
+			'SELECT count(*) FROM %s(''bench_series'', 30, $1, 1, ''>='', ''1.5'')',
+			p_function)
+		USING p_statid;
+	END LOOP;
+	RETURN extract(epoch FROM clock_timestamp() - t_start) * 1000 / p_n_calls;
+END
+$func$ LANGUAGE plpgsql;
+
+-- Warm up caches
+SELECT pg_temp.time_calls('pg_temp.pack_ranges_old', 100, 10) \g /dev/null
+SELECT pg_temp.time_calls('pack_ranges', 100, 10) \g /dev/null
+
+\echo 'Time per call on series of increasing length:'
+SELECT
+	n_obs,
+	n_calls,
+	round(old_ms::numeric, 3) AS pack_ranges_old_ms,
+	round(new_ms::numeric, 3) AS pack_ranges_ms,
+	round((old_ms / new_ms)::numeric, 2) AS speedup
+FROM (
+	SELECT
+		statid AS n_obs,
+		n_calls,
+		pg_temp.time_calls('pg_temp.pack_ranges_old', statid, n_calls) AS old_ms,
+		pg_temp.time_calls('pack_ranges', statid, n_calls) AS new_ms
+	FROM (
+		SELECT DISTINCT statid, greatest(3, 100000 / statid) AS n_calls
+		FROM bench_series
+		) AS s
+	ORDER BY statid
+	) AS t;
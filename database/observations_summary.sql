@@ -1,17 +1,17 @@
 -- Get a summary of observations available in the database
 -- by month, station and sensor.
 --
--- NOTE: with a high amount of data in the database,
--- this may take a long time to execute!
+-- Reads the daily summary table seobs_daily (see 06_seobs_daily.sql)
+-- instead of the observations, so it is fast with any amount of data.
+-- Months are in UTC, like the days of seobs_daily.
+-- See also tsa.coverage for the same summary in Python.
 --
 -- Arttu K / WSP Finland 8/2019
 SELECT
-	date_part('month', tfrom AT TIME ZONE 'Europe/Helsinki') AS mon,
-	statobs.statid, seobs.seid, count(seobs.id) AS nrows,
-	min(tfrom) AT TIME ZONE 'Europe/Helsinki' AS first_ts,
-	max(tfrom) AT TIME ZONE 'Europe/Helsinki' AS last_ts
-FROM seobs
-INNER JOIN statobs
-ON seobs.obsid = statobs.id
-GROUP BY date_part('month', tfrom AT TIME ZONE 'Europe/Helsinki'), statobs.statid, seobs.seid
-ORDER BY statobs.statid, seobs.seid;
+	date_part('month', day) AS mon,
+	statid, seid, sum(nobs) AS nrows,
+	min(first_ts) AT TIME ZONE 'Europe/Helsinki' AS first_ts,
+	max(last_ts) AT TIME ZONE 'Europe/Helsinki' AS last_ts
+FROM seobs_daily
+GROUP BY date_part('month', day), statid, seid
+ORDER BY statid, seid;
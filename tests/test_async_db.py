@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of sharing the Block queries of concurrent Conditions
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from datetime import timezone
+from tsa.async_db import AsyncEvaluator
+from tsa.condition import Condition
+
+TIME_RANGE = (datetime(2018, 1, 1, tzinfo=timezone.utc),
+              datetime(2018, 1, 20, tzinfo=timezone.utc))
+
+class FakePool:
+    """
+    Pool of one connection returning no rows, counting the queries.
+    """
+    def __init__(self):
+        self.slot = asyncio.Lock()
+        self.queries = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.slot:
+            yield self
+
+    async def fetch(self, sql):
+        self.queries.append(sql)
+        await asyncio.sleep(0.05)
+        return []
+
+def test_shared_block_query_is_timed_once():
+    conditions = [Condition('c_1104', alias, 'c_1104#ilma > 0', TIME_RANGE)
+                  for alias in ('d01', 'd02', 'd03')]
+    for c in conditions:
+        for bl in c.blocks.values():
+            bl.set_sensor_id({'ilma': 181})
+    evaluator = AsyncEvaluator(db_params=None, max_inflight=1)
+
+    async def run():
+        evaluator.pool = FakePool()
+        for c in conditions:
+            evaluator.block_ranges(c.blocks[f'{c.master_alias}_0'], c)
+        return await asyncio.gather(*[evaluator.block_ranges(bl, c)
+                                      for c in conditions for bl in c.blocks.values()])
+
+    assert asyncio.run(run()) == [[], [], []]
+    assert len(evaluator.pool.queries) == 1
+    timings = [[t.block for t in c.timings.timings if t.stage == 'block'] for c in conditions]
+    assert timings == [['d01_0'], [], []]
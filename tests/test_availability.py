@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the availability index of observations
+
+import numpy
+import pytest
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from tsa.availability import Availability
+from tsa.availability import YEAR_BITS
+from tsa.availability import utc_date
+
+HELSINKI = timezone(timedelta(hours=2))
+
+def bitmap(n_years, days):
+    arr = numpy.zeros(n_years * YEAR_BITS, dtype=bool)
+    arr[list(days)] = True
+    return arr
+
+def test_utc_date():
+    assert utc_date(datetime(2018, 1, 1, 1, tzinfo=HELSINKI)) == date(2017, 12, 31)
+
+def test_days_with_data_across_years():
+    # Days 363-364 of 2017 and day 0-1 of 2018
+    avail = Availability(2017, 2018, {
+        (1104, 181): bitmap(2, [363, 364, YEAR_BITS, YEAR_BITS + 1]),
+    })
+    t_from = datetime(2017, 12, 29, tzinfo=timezone.utc)
+    t_until = datetime(2018, 1, 3, tzinfo=timezone.utc)
+    assert avail.days_with_data(1104, 181, t_from, t_until) == (4, 6)
+    assert avail.days_with_data(1104, 182, t_from, t_until) == (0, 6)
+
+def test_day_positions_of_leap_year():
+    avail = Availability(2020, 2020, {})
+    pos = avail.day_positions(datetime(2020, 12, 30, tzinfo=timezone.utc),
+                              datetime(2020, 12, 31, tzinfo=timezone.utc))
+    assert pos.tolist() == [364, 365]
+
+@pytest.mark.parametrize('index_last, obs_last, until, expected', [
+    # Index has the latest observations
+    (date(2018, 1, 20), date(2018, 1, 20), datetime(2018, 3, 1), True),
+    # Observations added after the index was populated
+    (date(2018, 1, 10), date(2018, 1, 20), datetime(2018, 1, 15), False),
+    # ... but the period ends before the last day of the index
+    (date(2018, 1, 10), date(2018, 1, 20), datetime(2018, 1, 9), True),
+    # No observations, or an empty index of existing observations
+    (None, None, datetime(2018, 1, 9), True),
+    (None, date(2018, 1, 20), datetime(2018, 1, 9), False),
+])
+def test_is_current(index_last, obs_last, until, expected):
+    until = until.replace(tzinfo=timezone.utc)
+    assert Availability.is_current(index_last, obs_last, until) is expected
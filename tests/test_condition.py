@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of parsing and checkpoints of Conditions without the database
+
+from datetime import datetime
+from datetime import timezone
+from tsa.condition import Condition
+from tsa.condition import parse_condition
+from tsa.intervals import IntervalSeries
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.intervals import NULL
+
+TIME_RANGE = (datetime(2018, 1, 1, tzinfo=timezone.utc),
+              datetime(2018, 1, 20, tzinfo=timezone.utc))
+
+def test_parse_condition_makes_blocks_of_unique_logic():
+    parsed = parse_condition('c_1104', 'd01',
+                             'c_1104#ilma > 0 and not (c_1104#tie < 2 or c_1104#ilma > 0)')
+    assert parsed.is_valid
+    assert parsed.errors == ()
+    assert [(k, bl.raw_logic) for k, bl in parsed.blocks] == [
+        ('d01_0', 'c_1104#ilma > 0'), ('d01_1', 'c_1104#tie < 2')]
+    assert parsed.alias_condition == 'd01_0 and not (d01_1 or d01_0)'
+    assert parsed.secondary is False
+
+def test_parse_condition_records_syntax_errors():
+    parsed = parse_condition('c_1104', 'd02', 'c_1104#ilma > 0 and')
+    assert not parsed.is_valid
+    assert parsed.expr is None
+    assert [e.msg for e in parsed.errors] == [
+        '"and" cannot be last element in condition:\nc_1104#ilma > 0 and\n'
+        + '~' * 16 + '^ HERE',
+        'There were errors with this condition and it will not be analyzed',
+    ]
+
+def test_conditions_share_parsing_but_not_blocks():
+    parse_condition.cache_clear()
+    a = Condition('c_1104', 'd01', 'C_1104#ilma  > 0 or c_1104#tie < 2', TIME_RANGE)
+    b = Condition('c_1104', 'd01', 'c_1104#ilma > 0 or  c_1104#tie < 2', TIME_RANGE)
+    info = parse_condition.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+    assert a.expr is b.expr
+    assert a.alias_condition == b.alias_condition == 'd01_0 or d01_1'
+    assert a.blocks_made and b.blocks_made
+    for k in a.blocks:
+        assert a.blocks[k] is not b.blocks[k]
+        assert a.blocks[k].errors is not b.blocks[k].errors
+
+def test_invalid_condition_gets_errors_of_each_instance():
+    a = Condition('c_1104', 'd03', 'c_1104#ilma > 0 or or', TIME_RANGE)
+    b = Condition('c_1105', 'd03', 'c_1104#ilma > 0 or or', TIME_RANGE)
+    assert not a.blocks_made and not b.blocks_made
+    assert len(a.errors) == len(b.errors) == 2
+    assert a.errors is not b.errors
+
+def test_checkpoint_round_trip(tmp_path):
+    dirpath = str(tmp_path)
+    c = Condition('c_1104', 'd04', 'c_1104#ilma > 0', TIME_RANGE)
+    c.set_results(IntervalSeries.from_rows(['d04_0', 'master'], [
+        (0, 10, TRUE, TRUE), (10, 30, FALSE, FALSE), (30, 40, NULL, NULL)]))
+    c.errors.add('Something to keep', log_add='warning')
+    c.save_checkpoint(dirpath, {'logic': 'a'})
+
+    other = Condition('c_1104', 'd04', 'c_1104#ilma > 0', TIME_RANGE)
+    assert not other.load_checkpoint(dirpath, {'logic': 'b'})
+    assert other.results.empty
+    assert other.load_checkpoint(dirpath, {'logic': 'a'})
+    assert other.results.vfrom.tolist() == [0, 10, 30]
+    assert other.results.values['master'].tolist() == [TRUE, FALSE, NULL]
+    assert (other.tottime_valid, other.tottime_notvalid) == (c.tottime_valid, c.tottime_notvalid)
+    assert [e.msg for e in other.errors.errors] == ['Something to keep']
+    # Restoring again does not duplicate the errors
+    assert other.load_checkpoint(dirpath, {'logic': 'a'})
+    assert len(other.errors) == 1
+
+def test_no_checkpoint(tmp_path):
+    c = Condition('c_1104', 'd05', 'c_1104#ilma > 0', TIME_RANGE)
+    assert c.read_checkpoint(str(tmp_path)) is None
+    assert not c.load_checkpoint(str(tmp_path), {})
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the condition tokenizer, parser and three-valued evaluation
+
+import itertools
+import numpy
+import pytest
+from tsa.condition_parser import And
+from tsa.condition_parser import Not
+from tsa.condition_parser import Or
+from tsa.condition_parser import ParseError
+from tsa.condition_parser import parse
+from tsa.condition_parser import tokenize
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.intervals import NULL
+
+CODES = {True: TRUE, False: FALSE, None: NULL}
+BOOLS = {v: k for k, v in CODES.items()}
+
+def kinds(tokens):
+    return [(t.kind, t.text) for t in tokens]
+
+def tree(s, aliases=None):
+    return parse(tokenize(s), s, aliases)
+
+def test_tokenize_joins_words_of_logic_elements():
+    tokens = tokenize('c_1104#ilma  >  0 and not(d01 or x#tie < 1)')
+    assert kinds(tokens) == [
+        ('logic', 'c_1104#ilma > 0'), ('and', 'and'), ('not', 'not'),
+        ('open_par', '('), ('logic', 'd01'), ('or', 'or'),
+        ('logic', 'x#tie < 1'), ('close_par', ')'),
+    ]
+    assert [t.pos for t in tokens] == [0, 18, 22, 25, 26, 30, 33, 42]
+
+def test_tokenize_keeps_in_tuple_in_logic():
+    tokens = tokenize('x#sade in ( 1, 2 ) or (y)')
+    assert kinds(tokens) == [
+        ('logic', 'x#sade in (1, 2)'), ('or', 'or'),
+        ('open_par', '('), ('logic', 'y'), ('close_par', ')'),
+    ]
+
+def test_tokenize_keywords_are_whole_words():
+    assert kinds(tokenize('andy or notes')) == [
+        ('logic', 'andy'), ('or', 'or'), ('logic', 'notes')]
+
+def test_parse_precedence():
+    expr = tree('a or b and not c')
+    assert isinstance(expr, Or)
+    assert isinstance(expr.operands[1], And)
+    assert isinstance(expr.operands[1].operands[1], Not)
+    assert expr.to_sql() == 'a or (b and not c)'
+    assert tree('(a or b) and c').to_sql() == '(a or b) and c'
+    assert tree('not (a and b)').to_sql() == 'not (a and b)'
+
+def test_parse_flattens_same_operators():
+    expr = tree('a and (b and c) and d')
+    assert [op.alias for op in expr.operands] == ['a', 'b', 'c', 'd']
+    assert expr.to_sql() == 'a and b and c and d'
+
+def test_parse_replaces_logic_with_aliases():
+    expr = tree('x#ilma > 0 and y', aliases={'x#ilma > 0': 'd01_0'})
+    assert list(expr.aliases()) == ['d01_0', 'y']
+    assert expr.operands[0].raw == 'x#ilma > 0'
+    assert expr.to_sql() == 'd01_0 and y'
+
+@pytest.mark.parametrize('s, msg, pos', [
+    ('', 'Condition is empty', 0),
+    ('a and', '"and" cannot be last element in condition', 2),
+    ('or a', '"or" cannot be first element in condition', 0),
+    ('a and or b', 'Illegal combination in condition: "and" before "or"', 6),
+    ('(a or b', 'Missing ")" for "(" in condition', 0),
+    ('a or b)', 'Unmatched ")" in condition', 6),
+    ('a (b)', 'Illegal combination in condition: "a" before "("', 2),
+])
+def test_parse_errors(s, msg, pos):
+    with pytest.raises(ParseError) as exc:
+        tree(s)
+    assert exc.value.msg == msg
+    assert exc.value.pos == pos
+    assert str(exc.value).endswith('~' * pos + '^ HERE')
+
+def test_evaluate_kleene_logic():
+    values = {'t': True, 'f': False, 'n': None}
+    assert tree('f and n').evaluate(values) is False
+    assert tree('t and n').evaluate(values) is None
+    assert tree('t or n').evaluate(values) is True
+    assert tree('f or n').evaluate(values) is None
+    assert tree('not n').evaluate(values) is None
+    assert tree('not f and t').evaluate(values) is True
+
+@pytest.mark.parametrize('s', [
+    'a and b', 'a or b', 'not a', 'a and not (b or c)', 'not (a and b) or c and not b',
+])
+def test_evaluate_codes_like_evaluate(s):
+    expr = tree(s)
+    combos = list(itertools.product([True, False, None], repeat=3))
+    values = {k: numpy.array([CODES[c[i]] for c in combos], dtype=numpy.int8)
+              for i, k in enumerate('abc')}
+    res = expr.evaluate_codes(values)
+    assert res.dtype == numpy.int8
+    assert [BOOLS[v] for v in res.tolist()] == [
+        expr.evaluate(dict(zip('abc', c))) for c in combos]
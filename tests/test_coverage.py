@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the observation coverage summary
+
+import pandas
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from tsa.coverage import COVERAGE_COLUMNS
+from tsa.coverage import DAILY_COLUMNS
+from tsa.coverage import summarize
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def daily_frame():
+    rows = [
+        (1104, 181, date(2018, 1, 30), 10, utc(2018, 1, 30, 1), utc(2018, 1, 30, 22), -5.0, 1.0),
+        (1104, 181, date(2018, 1, 31), 20, utc(2018, 1, 31, 0), utc(2018, 1, 31, 23), -7.5, 0.5),
+        (1104, 181, date(2018, 2, 1), 5, utc(2018, 2, 1, 3), utc(2018, 2, 1, 4), 2.0, 3.0),
+        (1105, 182, date(2018, 2, 2), 1, utc(2018, 2, 2, 12), utc(2018, 2, 2, 12), 4.0, 4.0),
+    ]
+    return pandas.DataFrame.from_records(rows, columns=DAILY_COLUMNS)
+
+def test_summarize_by_month():
+    res = summarize(daily_frame(), period='month')
+    assert list(res.columns) == list(COVERAGE_COLUMNS)
+    assert res[['statid', 'seid', 'period_from', 'days', 'nobs']].values.tolist() == [
+        [1104, 181, date(2018, 1, 1), 2, 30],
+        [1104, 181, date(2018, 2, 1), 1, 5],
+        [1105, 182, date(2018, 2, 1), 1, 1],
+    ]
+    first = res.iloc[0]
+    assert first['first_ts'] == utc(2018, 1, 30, 1)
+    assert first['last_ts'] == utc(2018, 1, 31, 23)
+    assert (first['min_seval'], first['max_seval']) == (-7.5, 1.0)
+
+def test_summarize_by_week_starts_on_monday():
+    res = summarize(daily_frame(), period='week')
+    # 2018-01-29 is a Monday
+    assert res['period_from'].tolist() == [date(2018, 1, 29), date(2018, 1, 29)]
+    assert res['nobs'].tolist() == [35, 1]
+
+def test_summarize_over_all_days():
+    res = summarize(daily_frame())
+    assert res[['statid', 'period_from', 'days', 'nobs']].values.tolist() == [
+        [1104, date(2018, 1, 30), 3, 35],
+        [1105, date(2018, 2, 2), 1, 1],
+    ]
+
+def test_summarize_without_rows():
+    empty = pandas.DataFrame.from_records([], columns=DAILY_COLUMNS)
+    for period in (None, 'day'):
+        res = summarize(empty, period=period)
+        assert res.empty
+        assert list(res.columns) == list(COVERAGE_COLUMNS)
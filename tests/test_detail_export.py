@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the Parquet export of condition results
+
+import json
+import pytest
+from collections import OrderedDict
+from types import SimpleNamespace
+from tsa.intervals import IntervalSeries
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.intervals import NULL
+
+pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+from tsa.detail_export import DetailWriter
+
+def condition(id_string, rows):
+    return SimpleNamespace(
+        id_string=id_string,
+        condition='a and b',
+        blocks=OrderedDict([('a', SimpleNamespace(raw_logic='s1122#ilma > 0')),
+                            ('b', SimpleNamespace(raw_logic='s1122#tie < 2'))]),
+        results=IntervalSeries.from_rows(['a', 'b', 'master'], rows)
+    )
+
+def test_write_conditions_as_row_groups(tmp_path):
+    path = str(tmp_path / 'details.parquet')
+    c1 = condition('s1_d1', [(0, 10, TRUE, TRUE, TRUE), (10, 20, TRUE, NULL, NULL)])
+    c2 = condition('s1_d2', [])
+    c3 = condition('s1_d3', [(5, 6, FALSE, TRUE, FALSE)])
+    with DetailWriter(path, [c1, c2, c3]) as details:
+        for c in (c1, c2, c3):
+            details.write_condition(c)
+    f = pyarrow_parquet.ParquetFile(path)
+    assert f.num_row_groups == 2
+    table = f.read()
+    assert table.column('condition').to_pylist() == ['s1_d1', 's1_d1', 's1_d3']
+    assert table.column('master').to_pylist() == [True, None, False]
+    assert dict(table.column('blocks').to_pylist()[1]) == {'a': True, 'b': None}
+    meta = json.loads(f.schema_arrow.metadata[b'tsa_conditions'])
+    assert meta['s1_d2']['blocks']['b'] == 's1122#tie < 2'
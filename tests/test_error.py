@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the error collection
+
+import pytest
+from tsa.error import TsaErrCollection
+
+def test_duplicates_are_counted_with_most_severe_level():
+    errs = TsaErrCollection('SHEET', silent=True)
+    errs.add('Station not found', log_add='warning')
+    errs.add('Other error', log_add='error')
+    errs.add('Station not found', log_add='error')
+    errs.add('Station not found', log_add='')
+    assert len(errs) == 2
+    e = errs.errors[0]
+    assert e.msg == 'Station not found'
+    assert e.count == 3
+    assert e.n_more == 2
+    assert e.log_add == 'error'
+    assert '2 more similar errors' in e.with_context()
+
+def test_silent_collection_keeps_traceback():
+    errs = TsaErrCollection('SHEET', silent=True)
+    try:
+        raise KeyError('x')
+    except KeyError:
+        errs.add('Failed', log_add='exception')
+    assert 'KeyError' in errs.errors[0].exc_text
+
+def test_extend_and_restore():
+    errs = TsaErrCollection('SHEET', silent=True)
+    errs.add('First', log_add='warning')
+    snapshot = errs.snapshot()
+    other = TsaErrCollection('CONDITION', silent=True)
+    other.add('First', log_add='warning', count=2)
+    other.add('Second', log_add='error')
+    errs.extend(other.errors)
+    assert [(e.msg, e.count) for e in errs.errors] == [('First', 3), ('Second', 1)]
+    errs.restore(snapshot)
+    assert [(e.msg, e.count) for e in errs.errors] == [('First', 1)]
+
+@pytest.mark.parametrize('log_add', ['info', 'critical', None])
+def test_unknown_level_is_rejected(log_add):
+    errs = TsaErrCollection('SHEET', silent=True)
+    with pytest.raises(ValueError):
+        errs.add('Message', log_add=log_add)
+    assert len(errs) == 0
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of reading condition input files
+
+import os
+import pandas
+import pytest
+from datetime import datetime
+from tsa.input_reader import open_input
+
+TABLE_CSV = '''sheet,start,end,site,master_alias,condition
+first,1.1.2018,20.1.2018,c_1104,d01,c_1104#ilma > 0
+first,1.1.2018,20.1.2018,c_1104,d02,d01 and c_1104#tie < 2
+,1.1.2018,5.1.2018,c_1105,d01,c_1105#sade in (1 2)
+'''
+
+SHEET_CSV = '''"start","end",,
+"1.2.2018","31.3.2018",,
+"site","master_alias","condition","comments are not read"
+"c_1104","A1","c_1104#ilma > 0","comment"
+"c_1104","A2",,
+'''
+
+def write(dirpath, fname, text):
+    path = os.path.join(str(dirpath), fname)
+    with open(path, 'w', encoding='utf-8') as fobj:
+        fobj.write(text)
+    return path
+
+def test_table_layout_is_split_into_sheets(tmp_path):
+    sheets = open_input(write(tmp_path, 'conds.csv', TABLE_CSV))
+    assert list(sheets.keys()) == ['first', 'conds']
+    first = sheets['first']()
+    assert (first.time_from, first.time_until) == (datetime(2018, 1, 1),
+                                                   datetime(2018, 1, 20, 23, 59, 59))
+    assert list(first.conditions.keys()) == ['c_1104_d01', 'c_1104_d02']
+    assert first.conditions['c_1104_d02'].excel_row == 3
+    rest = sheets['conds']()
+    assert list(rest.conditions.keys()) == ['c_1105_d01']
+    assert rest.conditions['c_1105_d01'].excel_row == 4
+
+def test_table_layout_with_different_dates(tmp_path):
+    text = TABLE_CSV.replace('first,1.1.2018,20.1.2018,c_1104,d02', 'first,2.1.2018,20.1.2018,c_1104,d02')
+    sheets = open_input(write(tmp_path, 'conds.csv', text))
+    with pytest.raises(ValueError, match='2 different values in column "start"'):
+        sheets['first']()
+
+def test_table_layout_with_missing_columns(tmp_path):
+    with pytest.raises(ValueError, match='Missing columns in input table: site, master_alias'):
+        open_input(write(tmp_path, 'conds.csv', 'start,end,condition\n'))
+
+def test_sheet_layout_ignores_rows_with_empty_cells(tmp_path):
+    sheets = open_input(write(tmp_path, 'sheet.csv', SHEET_CSV))
+    cc = sheets['sheet']()
+    assert (cc.time_from, cc.time_until) == (datetime(2018, 2, 1),
+                                             datetime(2018, 3, 31, 23, 59, 59))
+    assert list(cc.conditions.keys()) == ['c_1104_a1']
+    assert [e.msg for e in cc.errors.errors] == ['Cell C5 is empty: condition row ignored']
+
+def test_directory_of_csv_files_in_name_order(tmp_path):
+    write(tmp_path, 'b.csv', SHEET_CSV)
+    write(tmp_path, 'a.csv', TABLE_CSV)
+    write(tmp_path, 'notes.txt', 'not read')
+    assert list(open_input(str(tmp_path)).keys()) == ['first', 'a', 'b']
+
+def test_unsupported_file_type(tmp_path):
+    with pytest.raises(ValueError, match='Unsupported input file type ".txt"'):
+        open_input(write(tmp_path, 'notes.txt', ''))
+
+def test_parquet_table(tmp_path):
+    pytest.importorskip('pyarrow')
+    csv_sheets = open_input(write(tmp_path, 'conds.csv', TABLE_CSV))
+    path = os.path.join(str(tmp_path), 'conds.parquet')
+    pandas.read_csv(os.path.join(str(tmp_path), 'conds.csv'), dtype=str).to_parquet(path)
+    sheets = open_input(path)
+    assert list(sheets.keys()) == list(csv_sheets.keys())
+    for title in sheets:
+        assert (list(sheets[title]().conditions.keys())
+                == list(csv_sheets[title]().conditions.keys()))
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of IntervalSeries and Block ranges of results
+
+import numpy
+import pytest
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone
+from tsa.condition_parser import parse
+from tsa.condition_parser import tokenize
+from tsa.intervals import IntervalSeries
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.intervals import NULL
+from tsa.ranges import join_ranges
+from tsa.ranges import ranges_from_results
+
+def series(rows, columns=('a',)):
+    return IntervalSeries.from_rows(list(columns), rows)
+
+def dt(us):
+    return datetime.fromtimestamp(us / 1e6, tz=timezone.utc)
+
+def test_ranges_join_consecutive_rows_with_same_value():
+    s = series([(0, 10, TRUE), (10, 20, TRUE), (20, 30, FALSE), (40, 50, FALSE)])
+    rng = s.ranges('a')
+    assert rng.vfrom.tolist() == [0, 20, 40]
+    assert rng.vuntil.tolist() == [20, 30, 50]
+    assert rng.values['a'].tolist() == [TRUE, FALSE, FALSE]
+
+def test_ranges_skip_null_rows_and_sort():
+    s = series([(20, 30, TRUE), (0, 10, TRUE), (10, 20, NULL)])
+    rng = s.ranges('a')
+    assert rng.vfrom.tolist() == [0, 20]
+    assert rng.vuntil.tolist() == [10, 30]
+
+@pytest.mark.parametrize('rows', [
+    [],
+    [(0, 10, NULL), (10, 20, NULL)],
+])
+def test_ranges_of_empty_and_all_null_column(rows):
+    s = series(rows)
+    rng = s.ranges('a')
+    assert rng.empty
+    assert rng.columns == ['a']
+    assert ranges_from_results(s, 'a') == []
+
+def test_ranges_from_results_as_datetimes():
+    s = series([(0, 10, TRUE), (10, 20, FALSE)])
+    assert ranges_from_results(s, 'a') == [(dt(0), dt(10), True), (dt(10), dt(20), False)]
+
+def test_join_ranges():
+    head = [(1, 2, True), (2, 3, False)]
+    assert join_ranges(head, [(3, 5, False), (5, 6, True)]) == [
+        (1, 2, True), (2, 5, False), (5, 6, True)]
+    assert join_ranges(head, [(3, 4, True)]) == head + [(3, 4, True)]
+    assert join_ranges([], [(3, 4, True)]) == [(3, 4, True)]
+    assert join_ranges(head, []) == head
+
+def test_combine_left_joins_blocks_and_evaluates_master():
+    expr = parse(tokenize('a and not b'), 'a and not b')
+    blocks = OrderedDict([
+        ('a', series([(0, 20, TRUE), (20, 30, FALSE)])),
+        ('b', series([(10, 25, TRUE)], columns=('b',))),
+    ])
+    res = IntervalSeries.combine(expr, blocks)
+    assert res.vfrom.tolist() == [0, 10, 20, 25]
+    assert res.vuntil.tolist() == [10, 20, 25, 30]
+    assert res.values['a'].tolist() == [TRUE, TRUE, FALSE, FALSE]
+    assert res.values['b'].tolist() == [NULL, TRUE, TRUE, NULL]
+    assert res.values['master'].tolist() == [NULL, FALSE, FALSE, FALSE]
+
+def test_combine_with_empty_block():
+    expr = parse(tokenize('a or b'), 'a or b')
+    blocks = OrderedDict([
+        ('a', series([(0, 10, FALSE)])),
+        ('b', series([], columns=('b',))),
+    ])
+    res = IntervalSeries.combine(expr, blocks)
+    assert res.values['b'].tolist() == [NULL]
+    assert res.values['master'].tolist() == [NULL]
+
+def test_durations_between_split_rows_at_bounds():
+    s = series([(0, 10, TRUE), (10, 20, FALSE), (20, 40, TRUE)])
+    d = s.durations_between('a', TRUE, [5, 25, 50])
+    assert d.tolist() == [10, 15]
+    assert d.sum() + 5 == s.duration('a', TRUE).total_seconds() * 1e6
+
+def test_frame_round_trip():
+    s = series([(0, 10, TRUE), (10, 20, NULL)])
+    back = IntervalSeries.from_frame(s.to_frame())
+    assert back.vfrom.tolist() == s.vfrom.tolist()
+    assert back.vuntil.tolist() == s.vuntil.tolist()
+    assert back.values['a'].tolist() == [TRUE, NULL]
+    assert numpy.array_equal(IntervalSeries.concat([s, back]).vfrom, [0, 10, 0, 10])
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the metadata snapshot and its refreshing
+
+import os
+import pytest
+from datetime import datetime
+from datetime import timedelta
+from tsa import metadata
+from tsa.metadata import MetadataSnapshot
+from tsa.metadata import SEED_METADATA_PATH
+from tsa.metadata import current_metadata
+from tsa.metadata import load_metadata
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache' / 'metadata.json')
+    monkeypatch.setenv('TSA_METADATA_PATH', path)
+    return path
+
+@pytest.fixture
+def db_snapshot(monkeypatch):
+    """
+    Snapshot that ``MetadataSnapshot.from_db`` returns, with the number of calls.
+    """
+    snapshot = MetadataSnapshot(station_ids=[1104, 1105], sensors={'ilma': 181},
+                                discrete_sensors=[181], source='test')
+    calls = []
+
+    def from_db(pg_conn):
+        calls.append(pg_conn)
+        return snapshot
+
+    monkeypatch.setattr(MetadataSnapshot, 'from_db', staticmethod(from_db))
+    return snapshot, calls
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    snapshot = MetadataSnapshot(station_ids=[2, 1], sensors={'tie': 182, 'ilma': 181},
+                                discrete_sensors=[182], source='test')
+    snapshot.write(path)
+    back = MetadataSnapshot.read(path)
+    assert back.station_ids == {1, 2}
+    assert back.sensors == {'ilma': 181, 'tie': 182}
+    assert back.discrete_sensors == {182}
+    assert back.generated_at == snapshot.generated_at.replace(microsecond=0)
+
+def test_load_falls_back_to_packaged_snapshot(snapshot_path):
+    assert not os.path.exists(snapshot_path)
+    assert load_metadata().sensors == MetadataSnapshot.read(SEED_METADATA_PATH).sensors
+
+def test_outdated_packaged_snapshot_is_not_overwritten(snapshot_path, db_snapshot):
+    seed_mtime = os.path.getmtime(SEED_METADATA_PATH)
+    snapshot = current_metadata(pg_conn='conn', ttl=timedelta(hours=1))
+    assert snapshot is db_snapshot[0]
+    assert db_snapshot[1] == ['conn']
+    assert os.path.getmtime(SEED_METADATA_PATH) == seed_mtime
+    assert MetadataSnapshot.read(snapshot_path).sensors == {'ilma': 181}
+    assert load_metadata().discrete_sensors == {181}
+
+def test_fresh_snapshot_is_used_without_database(snapshot_path, db_snapshot):
+    os.makedirs(os.path.dirname(snapshot_path))
+    MetadataSnapshot(station_ids=[1], sensors={'sade': 183}).write(snapshot_path)
+    snapshot = current_metadata(pg_conn='conn', ttl=timedelta(hours=1))
+    assert snapshot.sensors == {'sade': 183}
+    assert db_snapshot[1] == []
+    current_metadata(pg_conn='conn', ttl=timedelta(hours=1), refresh=True)
+    assert db_snapshot[1] == ['conn']
+
+def test_outdated_snapshot_is_read_again(snapshot_path, db_snapshot):
+    os.makedirs(os.path.dirname(snapshot_path))
+    old = datetime.now() - timedelta(hours=2)
+    MetadataSnapshot(station_ids=[1], sensors={'sade': 183}, generated_at=old).write(snapshot_path)
+    assert current_metadata(pg_conn='conn', ttl=timedelta(hours=1)).sensors == {'ilma': 181}
+    assert db_snapshot[1] == ['conn']
+
+def test_ttl_from_environment(monkeypatch):
+    monkeypatch.setenv('TSA_METADATA_TTL_HOURS', '0.5')
+    assert metadata.metadata_ttl() == timedelta(minutes=30)
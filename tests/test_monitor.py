@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the run status and metrics files
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+from tsa.cond_collection import CondCollection
+from tsa.error import TsaErrCollection
+from tsa.monitor import RunMonitor
+from tsa.monitor import to_prometheus
+
+def analysis():
+    collections = OrderedDict()
+    for title in ('first', 'second'):
+        coll = CondCollection(datetime(2018, 1, 1), datetime(2018, 1, 20), title=title)
+        coll.add_condition('c_1104', 'd01', 'c_1104#ilma > 0')
+        coll.add_condition('c_1104', 'd02', 'c_1104#tie < 2')
+        collections[title] = coll
+    return SimpleNamespace(name='run "a"', collections=collections,
+                           errors=TsaErrCollection('ANALYSIS'), db_pool=None)
+
+def test_status_counts_steps_of_collections(tmp_path):
+    anls = analysis()
+    status_path = os.path.join(str(tmp_path), 'status.json')
+    metrics_path = os.path.join(str(tmp_path), 'status.prom')
+    mon = RunMonitor(anls, status_path, metrics_path=metrics_path)
+    mon.started_at = datetime.now()
+    mon.collection_started('first', None)
+    mon.collection_finished('first')
+    anls.collections['second'].n_temptables_done = 2
+    anls.collections['second'].n_fetched = 1
+    mon.collection_started('second', None)
+
+    with open(status_path) as fobj:
+        st = json.load(fobj)
+    assert st['collections'] == {'total': 2, 'done': 1, 'current': 'second'}
+    assert st['conditions'] == {'total': 4, 'done': 3}
+    assert st['steps'] == {'total': 8, 'done': 7}
+    assert st['finished'] is False
+    assert st['eta_seconds'] is not None
+    assert st['current_statement'] is None
+
+    with open(metrics_path) as fobj:
+        metrics = fobj.read()
+    assert 'tsa_conditions_done{run="run \\"a\\""} 3\n' in metrics
+
+def test_prometheus_skips_unknown_values():
+    st = OrderedDict([
+        ('name', 'run'), ('started_at', None), ('finished', False),
+        ('collections', {'total': 1, 'done': 0}), ('conditions', {'total': 2, 'done': 0}),
+        ('conditions_per_minute', 0.0), ('eta_seconds', None), ('db_seconds', 0.0),
+        ('errors', 0), ('current_statement', None),
+    ])
+    lines = to_prometheus(st).splitlines()
+    names = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert 'tsa_run_start_timestamp_seconds' not in names
+    assert 'tsa_eta_seconds' not in names
+    assert 'tsa_current_statement_age_seconds{run="run"} 0' in lines
+    assert '# TYPE tsa_db_seconds_total counter' in lines
+    assert len(names) == len([line for line in lines if not line.startswith('#')])
+
+class BlockedPool:
+    """
+    Pool whose connections are handed out only when ``.release`` is set.
+    """
+    def __init__(self):
+        self.borrowed = threading.Event()
+        self.release = threading.Event()
+
+    @contextmanager
+    def connection(self):
+        self.borrowed.set()
+        self.release.wait(5)
+        raise Exception('No connection')
+        yield
+
+class Session:
+    def get_backend_pid(self):
+        return 1234
+
+def test_collections_do_not_wait_for_statement_query(tmp_path):
+    anls = analysis()
+    mon = RunMonitor(anls, os.path.join(str(tmp_path), 'status.json'))
+    pool = BlockedPool()
+    pool.release.set()
+    mon.collection_started('first', Session(), db_pool=pool)
+    pool.release.clear()
+    pool.borrowed.clear()
+    updating = threading.Thread(target=mon.update)
+    updating.start()
+    try:
+        assert pool.borrowed.wait(5)
+        mon.collection_finished('first')
+        with open(mon.status_path) as fobj:
+            assert json.load(fobj)['collections']['done'] == 1
+    finally:
+        pool.release.set()
+        updating.join()
+    # The update started earlier does not overwrite the later status
+    with open(mon.status_path) as fobj:
+        assert json.load(fobj)['collections']['done'] == 1
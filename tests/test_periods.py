@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the validity breakdown by calendar period
+
+import pandas
+import pytest
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from tsa.condition import Condition
+from tsa.intervals import IntervalSeries
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.intervals import NULL
+from tsa.intervals import to_epoch_us
+from tsa.periods import period_bounds
+from tsa.periods import period_label
+
+def ts(s, tz='UTC'):
+    return pandas.Timestamp(s, tz=tz)
+
+def test_period_bounds_cut_first_and_last_period():
+    assert period_bounds(ts('2018-01-30 12:00'), ts('2018-03-02'), 'month') == [
+        ts('2018-01-30 12:00'), ts('2018-02-01'), ts('2018-03-01'), ts('2018-03-02')]
+
+def test_period_bounds_of_weeks_start_on_monday():
+    # 2018-01-01 is a Monday
+    assert period_bounds(ts('2018-01-01'), ts('2018-01-20'), 'week') == [
+        ts('2018-01-01'), ts('2018-01-08'), ts('2018-01-15'), ts('2018-01-20')]
+
+def test_period_bounds_within_one_period():
+    assert period_bounds(ts('2018-01-02 03:00'), ts('2018-01-02 04:00'), 'day') == [
+        ts('2018-01-02 03:00'), ts('2018-01-02 04:00')]
+
+def test_period_bounds_in_utc():
+    bounds = period_bounds(ts('2018-01-01 12:00', tz='Europe/Helsinki'),
+                           ts('2018-01-02 12:00', tz='Europe/Helsinki'), 'day')
+    assert bounds == [ts('2018-01-01 10:00'), ts('2018-01-02'), ts('2018-01-02 10:00')]
+    assert all(str(t.tz) == 'UTC' for t in bounds)
+
+@pytest.mark.parametrize('period, label', [
+    ('day', '31.12.2018'),
+    ('week', 'vk 1/2019'),
+    ('month', '12/2018'),
+])
+def test_period_label(period, label):
+    assert period_label(ts('2018-12-31'), period) == label
+
+def test_breakdown_adds_up_to_totals():
+    day = 24 * 3600 * 10**6
+    start = to_epoch_us(ts('2018-01-01'))
+    c = Condition('c_1104', 'd01', 'c_1104#ilma > 0',
+                  (datetime(2018, 1, 1, tzinfo=timezone.utc),
+                   datetime(2018, 1, 3, tzinfo=timezone.utc)))
+    c.set_results(IntervalSeries.from_rows(['d01_0', 'master'], [
+        (start, start + day // 2, TRUE, TRUE),
+        (start + day // 2, start + 3 * day // 2, FALSE, FALSE),
+        (start + 3 * day // 2, start + 2 * day, NULL, NULL),
+    ]))
+    rows = c.breakdown('day')
+    half = timedelta(hours=12)
+    assert rows == [
+        (ts('2018-01-01'), ts('2018-01-02'), half, half, timedelta(0)),
+        (ts('2018-01-02'), ts('2018-01-03'), timedelta(0), half, half),
+    ]
+    assert sum((r[2] for r in rows), timedelta(0)) == c.tottime_valid
+    assert sum((r[3] for r in rows), timedelta(0)) == c.tottime_notvalid
+    assert sum((r[4] for r in rows), timedelta(0)) == c.tottime_nodata
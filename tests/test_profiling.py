@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of stage timings
+
+import pytest
+from tsa.profiling import TsaTiming
+from tsa.profiling import TsaTimings
+from tsa.profiling import slowest
+
+def test_time_records_also_failing_stages():
+    timings = TsaTimings('c_1104_d01')
+    with timings.time('create', block='d01_0', sql='SELECT 1'):
+        pass
+    with pytest.raises(ZeroDivisionError):
+        with timings.time('fetch'):
+            1 / 0
+    assert [t.stage for t in timings.timings] == ['create', 'fetch']
+    assert [t.sql for t in timings.statements()] == ['SELECT 1']
+    assert str(timings.timings[0]).startswith('c_1104_d01 / d01_0 create: ')
+
+def test_seconds_by_stage():
+    timings = TsaTimings('coll')
+    timings.extend([TsaTiming('fetch', 'other', 1.0),
+                    TsaTiming('create', 'other', 0.5),
+                    TsaTiming('fetch', 'other', 2.0)])
+    assert all(t.context == 'coll' for t in timings.timings)
+    assert list(timings.by_stage().items()) == [('fetch', 3.0), ('create', 0.5)]
+    assert timings.seconds('fetch') == 3.0
+    assert timings.seconds() == 3.5
+
+def test_slowest_and_dict():
+    timings = [TsaTiming('a', 'x', 0.2), TsaTiming('b', 'x', 0.9, sql='SELECT 2'),
+               TsaTiming('c', 'x', 0.5)]
+    assert [t.stage for t in slowest(timings, 2)] == ['b', 'c']
+    assert dict(timings[1].to_dict()) == {'stage': 'b', 'seconds': 0.9, 'sql': 'SELECT 2'}
+    assert 'plan' in timings[1].to_dict(plan=True)
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of extending results of an earlier run over a shorter period
+
+from datetime import datetime
+from datetime import timezone
+from tsa.cond_collection import CondCollection
+from tsa.intervals import IntervalSeries
+from tsa.intervals import TRUE
+from tsa.intervals import FALSE
+from tsa.ranges import join_ranges
+from tsa.ranges import ranges_from_results
+
+SENSOR_IDS = {'ilma': 181, 'tie': 182, 'sade': 183}
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def dt(us):
+    return datetime.fromtimestamp(us / 1e6, tz=timezone.utc)
+
+def results(columns, rows):
+    return IntervalSeries.from_rows(list(columns), rows)
+
+def collection(time_until):
+    coll = CondCollection(utc(2018, 1, 1), time_until, title='test')
+    coll.add_condition('c_1104', 'd01', 'c_1104#ilma > 0 and c_1104#tie < 2')
+    coll.add_condition('c_1104', 'd02', 'd01 or c_1104#sade > 0')
+    for c in coll.conditions.values():
+        for bl in c.blocks.values():
+            bl.set_sensor_id(SENSOR_IDS)
+    return coll
+
+def test_joined_parts_equal_whole_ranges():
+    whole = results(['a'], [(0, 10, TRUE), (10, 30, FALSE), (30, 40, TRUE), (40, 60, TRUE)])
+    expected = ranges_from_results(whole, 'a')
+    for stitch in (10, 30, 40):
+        head = ranges_from_results(whole.select(whole.vuntil <= stitch), 'a')
+        tail = ranges_from_results(whole.select(whole.vfrom >= stitch), 'a')
+        assert join_ranges(head, tail) == expected
+    assert expected == [(dt(0), dt(10), True), (dt(10), dt(30), False), (dt(30), dt(60), True)]
+
+def test_extends_only_a_longer_period_of_the_same_logic():
+    old = collection(utc(2018, 1, 10))
+    new = collection(utc(2018, 1, 20))
+    assert new.extends(old.definition('c_1104_d01'), 'c_1104_d01')
+    assert not old.extends(new.definition('c_1104_d01'), 'c_1104_d01')
+    assert not new.extends(old.definition('c_1104_d01'), 'c_1104_d02')
+    # Logic of a referred Condition belongs to the definition
+    changed = collection(utc(2018, 1, 10))
+    changed.conditions['c_1104_d01'].condition = 'c_1104#ilma > 1'
+    assert not new.extends(changed.definition('c_1104_d02'), 'c_1104_d02')
+
+def test_stitch_points_at_earliest_last_range_of_blocks():
+    coll = collection(utc(2018, 1, 20))
+    coll.has_block_query = True
+    d01 = coll.conditions['c_1104_d01']
+    d02 = coll.conditions['c_1104_d02']
+    d01.base_results = results(['d01_0', 'd01_1'],
+                               [(0, 10, TRUE, TRUE), (10, 20, FALSE, TRUE), (20, 30, FALSE, FALSE)])
+    d02.base_results = results(['d02_0', 'd02_1'],
+                               [(0, 25, TRUE, FALSE), (25, 30, TRUE, TRUE)])
+    points = coll.stitch_points(['c_1104_d02'])
+    # d01_0 runs FALSE from 10 on, d01_1 FALSE from 20 on
+    assert points['c_1104_d01'] == dt(10)
+    # The secondary Block follows d01, the primary one starts its last range at 25
+    assert points['c_1104_d02'] == dt(10)
+
+def test_no_stitch_point_without_base_results():
+    coll = collection(utc(2018, 1, 20))
+    coll.has_block_query = True
+    coll.conditions['c_1104_d02'].base_results = results(
+        ['d02_0', 'd02_1'], [(0, 30, TRUE, TRUE)])
+    points = coll.stitch_points(['c_1104_d02'])
+    assert points == {'c_1104_d01': None, 'c_1104_d02': None}
@@ -0,0 +1,20 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of splitting Powerpoint reports into decks
+
+import pytest
+from tsa.report import deck_paths
+
+def test_one_deck_if_slides_fit():
+    assert deck_paths('results/a.pptx', 10) == ['results/a.pptx']
+    assert deck_paths('results/a.pptx', 10, max_slides=10) == ['results/a.pptx']
+
+def test_numbered_decks():
+    assert deck_paths('results/a.pptx', 11, max_slides=5) == [
+        'results/a_1.pptx', 'results/a_2.pptx', 'results/a_3.pptx']
+
+@pytest.mark.parametrize('max_slides', [0, -1])
+def test_max_slides_below_one(max_slides):
+    with pytest.raises(ValueError):
+        deck_paths('results/a.pptx', 11, max_slides=max_slides)
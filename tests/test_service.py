@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the request handling of the analysis service
+
+import asyncio
+import json
+import logging
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from tsa.service import AnalysisService
+from tsa.service import JobLogFilter
+from tsa.service import RequestError
+from tsa.service import check_input_path
+from tsa.service import check_name
+from tsa.service import current_job_id
+from tsa.service import option_value
+from tsa.utils import ContextThreadPoolExecutor
+
+def test_option_types():
+    assert option_value('max_slides', '20') == 20
+    assert option_value('dryvalidate', 'yes') is True
+    assert option_value('dryvalidate', '0') is False
+    assert option_value('breakdown', 'week') == 'week'
+    assert option_value('max_slides', None) is None
+
+@pytest.mark.parametrize('key, value', [
+    ('max_slides', 0),
+    ('max_slides', '-3'),
+    ('max_slides', 'many'),
+    ('explain_slowest', -1),
+    ('no_such_option', 1),
+])
+def test_invalid_options(key, value):
+    with pytest.raises(RequestError):
+        option_value(key, value)
+
+@pytest.mark.parametrize('name', ['run_2018.v1', 'a-b'])
+def test_valid_names(name):
+    assert check_name(name) == name
+
+@pytest.mark.parametrize('name', ['', '../other', 'a/b', 'a b', None])
+def test_invalid_names(name):
+    with pytest.raises(RequestError):
+        check_name(name, key='extend')
+
+def test_input_path_within_input_dir(tmp_path):
+    input_dir = tmp_path / 'input'
+    (input_dir / 'sub').mkdir(parents=True)
+    (tmp_path / 'secret.xlsx').write_text('')
+    os.symlink(str(tmp_path / 'secret.xlsx'), str(input_dir / 'link.xlsx'))
+    ok = str(input_dir / 'sub' / 'a.xlsx')
+    assert check_input_path(ok, str(input_dir)) == ok
+    for path in [str(input_dir / '..' / 'secret.xlsx'), str(input_dir / 'link.xlsx'),
+                 '/etc/passwd', str(tmp_path / 'input2' / 'a.xlsx')]:
+        with pytest.raises(RequestError) as e:
+            check_input_path(path, str(input_dir))
+        assert e.value.status == HTTPStatus.FORBIDDEN
+
+@pytest.mark.parametrize('body', [
+    {'input': '/etc/passwd', 'name': 'a'},
+    {'input': 'input/a.xlsx', 'name': 'a', 'extend': '../../tmp/x'},
+])
+def test_submit_request_rejects_paths(body):
+    service = AnalysisService(input_dir='input')
+    with pytest.raises(RequestError):
+        asyncio.run(service.submit_request([], {'content-type': 'application/json'},
+                                           json.dumps(body).encode('utf-8')))
+
+def test_upload_is_saved_before_queueing(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    service = AnalysisService()
+
+    async def submit():
+        service.queue = asyncio.Queue(maxsize=service.queue_size)
+        first = service.submit_request([('name', 'a'), ('filename', 'x/b.csv')], {}, b'data')
+        second = service.submit_request([('name', 'a'), ('filename', 'b.csv')], {}, b'other')
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    job, error = asyncio.run(submit())
+    assert job.input_path == os.path.join('results', 'uploads', 'a', 'b.csv')
+    with open(job.input_path, 'rb') as fobj:
+        assert fobj.read() == b'data'
+    assert isinstance(error, RequestError) and error.status == HTTPStatus.CONFLICT
+    assert service.uploading == set()
+
+def test_job_log_filter_follows_worker_threads():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    handler.addFilter(JobLogFilter('7'))
+    logger = logging.getLogger('tsa.test_job_log')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        token = current_job_id.set('7')
+        try:
+            logger.info('job thread')
+            with ContextThreadPoolExecutor(max_workers=2) as executor:
+                executor.submit(logger.info, 'worker thread').result()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(logger.info, 'other thread').result()
+        finally:
+            current_job_id.reset(token)
+        logger.info('after job')
+    finally:
+        logger.removeHandler(handler)
+    assert [r.getMessage() for r in records] == ['job thread', 'worker thread']
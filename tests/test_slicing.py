@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tests of the time slices of primary Block queries
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from tsa.slicing import BlockSlicer
+from tsa.slicing import slice_bounds
+
+WEEK = timedelta(days=7)
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_slice_bounds_aligned_to_epoch():
+    # 1970-01-01 is a Thursday, so are the bounds of weekly slices
+    bounds = slice_bounds(utc(2018, 1, 1), utc(2018, 1, 20), WEEK)
+    assert bounds == [utc(2018, 1, 4), utc(2018, 1, 11), utc(2018, 1, 18)]
+    assert slice_bounds(utc(2018, 1, 1), utc(2018, 1, 20), timedelta(days=1))[0] == utc(2018, 1, 2)
+
+def test_slice_bounds_exclude_the_period_ends():
+    assert slice_bounds(utc(2018, 1, 4), utc(2018, 1, 11), WEEK) == []
+    assert slice_bounds(utc(2018, 1, 5), utc(2018, 1, 6), WEEK) == []
+
+def test_slice_bounds_of_naive_times_in_utc():
+    assert slice_bounds(datetime(2018, 1, 1), datetime(2018, 1, 12), WEEK) == [
+        utc(2018, 1, 4), utc(2018, 1, 11)]
+
+def test_slices_cover_the_period():
+    slicer = BlockSlicer(pool=None, executor=None, obs_view_sql='',
+                         time_from=utc(2018, 1, 1), time_until=utc(2018, 1, 20))
+    assert slicer.slices() == [(None, utc(2018, 1, 4)),
+                               (utc(2018, 1, 4), utc(2018, 1, 11)),
+                               (utc(2018, 1, 11), utc(2018, 1, 18)),
+                               (utc(2018, 1, 18), None)]
+    assert slicer.slices(since=utc(2018, 1, 11)) == [(utc(2018, 1, 11), utc(2018, 1, 18)),
+                                                     (utc(2018, 1, 18), None)]
+    assert slicer.slices(since=utc(2018, 1, 19)) == [(utc(2018, 1, 19), None)]
@@ -3,55 +3,42 @@
 
 # Collection of CondCollections
 
+import json
 import logging
 import os
+import shutil
 import psycopg2
 import openpyxl as xl
+from .async_db import AsyncEvaluator
+from .async_db import HAS_ASYNCPG
 from .cond_collection import CondCollection
+from .input_reader import open_input
+from .detail_export import HAS_PYARROW
+from .report import ReportTemplate
+from .report import deck_paths
+from .db import DBParams
+from .db import ConnectionPool
+from .db import ReplicaPool
 from .error import TsaErrCollection
+from .periods import PERIODS
+from .profiling import CONDITION_STAGES
+from .slicing import BlockSlicer
+from .slicing import DEFAULT_SLICE_INTERVAL
+from .slicing import hypertable_interval
+from .snapshot import SnapshotEvaluator
 from .utils import trunc_str
-from .utils import list_local_statids
-from .utils import list_local_sensors
+from .utils import to_filename
+from .utils import ContextThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from datetime import timedelta
 from collections import OrderedDict
 
-DEFAULT_PG_HOST = 'localhost'
-DEFAULT_PG_PORT = 5432
-DEFAULT_PG_DBNAME = 'tsa'
-DEFAULT_PG_USER = 'postgres'
-DEFAULT_PG_PASSWORD = 'postgres'
-
 PPTX_TEMPLATE_PATH = 'report_template.pptx'
 
 log = logging.getLogger(__name__)
 
-class DBParams:
-    """
-    Stores parameters for database connection.
-    """
-    def __init__(self):
-        self.dbname = os.getenv('PG_DBNAME', DEFAULT_PG_DBNAME)
-        self.user = os.getenv('PG_USER', DEFAULT_PG_USER)
-        self.password = os.getenv('PG_PASSWORD', DEFAULT_PG_PASSWORD)
-        self.host = os.getenv('PG_HOST', DEFAULT_PG_HOST)
-        self.port = os.getenv('PG_PORT', DEFAULT_PG_PORT)
-
-    def keys(self):
-        return ['dbname', 'user', 'password', 'host', 'port']
-
-    def __getitem__(self, key):
-        return self.__dict__[key]
-
-    def __str__(self):
-        s = 'DBParams\n'
-        for k in self.keys():
-            if k == 'password':
-                v = '(not shown)'
-            else:
-                v = self.__dict__[k]
-            s += f'{k:8}: {v}, '
-        return s
-
 class AnalysisCollection:
     """
     A collection of ``CondCollection`` instances.
@@ -59,33 +46,38 @@ class AnalysisCollection:
     Enables validating CondCollections separately
     and then analysing them.
 
+    Input can be an Excel workbook, or CSV or Parquet files,
+    see ``tsa.input_reader.open_input``.
+
     Output files are saved in ``results/`` relative to current working directory.
     PowerPoint reports follow pattern ``results/[name][_sheetname].pptx``,
-    and Excel files ``results/[name].xlsx``.
+    Excel files ``results/[name]_report.xlsx``,
+    csv summary files ``results/[name]_summary.csv``
+    and timing profiles ``results/[name]_profile.json``.
     Existing output files with same filepath will be overwritten.
+
+    A connection pool shared with other analyses, e.g. by ``tsa.service``,
+    can be given as ``db_pool``; it is not closed by ``.close_db_pool()``.
     """
-    def __init__(self, input_xlsx, name):
+    def __init__(self, input_path, name, db_pool=None):
         self.created_at = datetime.now()
-        self.input_xlsx = input_xlsx
+        self.input_path = input_path
         self.name = name
-        self.workbook = xl.load_workbook(filename=input_xlsx, read_only=True)
+        # Sheet title - reader function pairs
+        self.sheets = open_input(input_path)
 
         os.makedirs('results', exist_ok=True)
         self.out_base_path = f'results/{self.name}'
 
-        # This will contain condition rows by Excel sheet,
+        # This will contain condition rows by sheet,
         # read by a separate method
         self.collections = OrderedDict()
 
-        # Station ids and sensor name-id pairs for dryvalidate checking.
-        # These represent the situation as of 8/2019.
-        # Updates must be made to corresponding functions in tsa.utils.
-        self.local_statids = list_local_statids()
-        self.local_sensor_pairs = list_local_sensors()
-
-        # DB connection is made by a separate method only if needed;
+        # DB connection pool is made by a separate method only if needed;
         # dryvalidate methods are available also without it.
         self.db_params = DBParams()
+        self.db_pool = db_pool
+        self.shared_db_pool = db_pool is not None
         self.db_statids = set()
         self.db_sensor_pairs = dict()
 
@@ -94,31 +86,57 @@ class AnalysisCollection:
 
     def add_collections(self, drop=['info']):
         """
-        Add CondCollections from worksheets.
+        Add CondCollections from worksheets or other input sheets.
         :param drop: list of sheets to exclude by title
         :type drop: list of strings
         """
-        sheetnames = [s for s in self.workbook.sheetnames if s.lower().strip() not in drop]
+        sheetnames = [s for s in self.sheets.keys() if s.lower().strip() not in drop]
         for title in sheetnames:
             try:
-                self.collections[title] = CondCollection.from_xlsx_sheet(
-                    ws=self.workbook[title]
-                )
+                self.collections[title] = self.sheets[title]()
                 log.info(f'Added CondCollection <{title}>')
             except:
                 self.errors.add(msg=f'Could not add CondCollection <{title}>: skipping',
                                 log_add='exception')
 
-    def set_sensor_ids(self, pairs):
+    def open_db_pool(self, **kwargs):
+        """
+        Open the database connection pool shared by the whole run,
+        if not opened yet, and return it.
+        ``kwargs`` are passed to ``tsa.db.ConnectionPool``,
+        or to ``tsa.db.ReplicaPool`` if several database hosts
+        are given in ``PG_HOSTS``; their availability is checked here.
+        """
+        if self.db_pool is None:
+            if len(self.db_params.hosts) > 1:
+                self.db_pool = ReplicaPool(self.db_params, **kwargs)
+                self.db_pool.check_all()
+            else:
+                self.db_pool = ConnectionPool(self.db_params, **kwargs)
+            log.info(f'Database connection pool opened for {str(self)}')
+        return self.db_pool
+
+    def close_db_pool(self):
+        """
+        Close all connections of the pool, unless it is shared.
+        """
+        if self.db_pool is not None:
+            if not self.shared_db_pool:
+                self.db_pool.close()
+            self.db_pool = None
+
+    def set_sensor_ids(self, pairs, discrete=None):
         """
         Set sensor name-id pairs for all ``Blocks``.
 
         :param pairs: dict, key = sensor id, value = sensor name
+        :param discrete: ids of discrete-valued sensors, whose Blocks
+            read the runs of equal values, see ``Block.get_execute_sql``
         """
         for coll in self.collections.keys():
             for cnd in self[coll].conditions.keys():
                 for bl in self[coll][cnd].blocks.keys():
-                    self[coll][cnd][bl].set_sensor_id(pairs)
+                    self[coll][cnd][bl].set_sensor_id(pairs, discrete_ids=discrete)
 
     def validate_statids_with_set(self, station_ids):
         """
@@ -146,60 +164,302 @@ class AnalysisCollection:
                             log_add='error'
                         )
 
-    def collect_errors(self):
+    def has_errors(self):
+        """
+        Return ``True`` if any of the levels has errors.
+        """
+        if len(self.errors):
+            return True
+        for coll in self.collections.values():
+            if len(coll.errors):
+                return True
+            for cond in coll.conditions.values():
+                if len(cond.errors):
+                    return True
+                for block in cond.blocks.values():
+                    if len(block.errors):
+                        return True
+        return False
+
+    def collect_errors(self, fobj):
         """
-        Collect error messages from all levels
-        into an OrderedDict tree.
+        Write error messages from all levels
+        as a JSON tree into file object ``fobj``.
+        The tree is streamed one object at a time
+        instead of building it in memory.
 
-        :return: tuple ``(True if any errors, OrderedDict of errors)``
+        :return: ``True`` if any errors
         """
-        log.info('Building error message tree ...')
+        log.info('Writing error message tree ...')
         haserrs = False
-        master = OrderedDict(
-            errors = [str(e) for e in self.errors.errors],
-            collections = OrderedDict()
-        )
-        if master['errors']:
-            haserrs = True
+
+        def write_errors(errs, ind):
+            nonlocal haserrs
+            msgs = [str(e) for e in errs.errors]
+            haserrs = haserrs or len(msgs) > 0
+            fobj.write(' '*ind + '"errors": ' + json.dumps(msgs))
+
+        def write_key(i, key, ind):
+            fobj.write((',' if i else '') + '\n' + ' '*ind + json.dumps(key) + ': {\n')
+
+        fobj.write('{\n')
+        write_errors(self.errors, 4)
+        fobj.write(',\n    "collections": {')
+        for i, coll in enumerate(self.collections.values()):
+            write_key(i, str(coll), 8)
+            write_errors(coll.errors, 12)
+            fobj.write(',\n            "conditions": {')
+            for j, cond in enumerate(coll.conditions.values()):
+                write_key(j, str(cond), 16)
+                write_errors(cond.errors, 20)
+                fobj.write(',\n                    "blocks": {')
+                for k, block in enumerate(cond.blocks.values()):
+                    write_key(k, str(block), 24)
+                    write_errors(block.errors, 28)
+                    fobj.write('\n                        }')
+                fobj.write('\n                    }\n                }')
+            fobj.write('\n            }\n        }')
+        fobj.write('\n    }\n}\n')
+        return haserrs
+
+    def slowest_statements(self, n):
+        """
+        Return the ``n`` slowest database statements
+        as ``(collection title, timing)`` pairs.
+        """
+        pairs = [(coll.title, t) for coll in self.collections.values()
+                 for t in coll.statements()]
+        pairs.sort(key=lambda x: x[1].seconds, reverse=True)
+        return pairs[:n]
+
+    def stage_seconds(self):
+        """
+        Return stage - total seconds pairs of all collections
+        and their conditions, condition stages first.
+        """
+        stages = OrderedDict((k, 0.0) for k in CONDITION_STAGES)
+        for coll in self.collections.values():
+            timings = [coll.timings] + [c.timings for c in coll.conditions.values()]
+            for tms in timings:
+                for k, v in tms.by_stage().items():
+                    stages[k] = stages.get(k, 0.0) + v
+        return stages
+
+    def collect_profile(self, fobj, n_slowest=10):
+        """
+        Write the stage timings of all collections and their conditions
+        as JSON to ``fobj``, with the ``n_slowest`` slowest statements
+        and their query plans if captured.
+        """
+        collections = []
         for coll in self.collections.values():
-            colldict = OrderedDict(
-                errors = [str(e) for e in coll.errors.errors],
-                conditions = OrderedDict()
-            )
-            if colldict['errors']:
-                haserrs = True
+            conditions = []
             for cond in coll.conditions.values():
-                conddict = OrderedDict(
-                    errors = [str(e) for e in cond.errors.errors],
-                    blocks = OrderedDict()
-                )
-                if conddict['errors']:
-                    haserrs = True
-                for block in cond.blocks.values():
-                    blockdict = OrderedDict(
-                        errors = [str(e) for e in block.errors.errors]
-                    )
-                    if blockdict['errors']:
-                        haserrs = True
-                    conddict['blocks'][str(block)] = blockdict
-                colldict['conditions'][str(cond)] = conddict
-            master['collections'][str(coll)] = colldict
-        return haserrs, master
+                conditions.append(OrderedDict([
+                    ('condition', cond.id_string),
+                    ('seconds', round(cond.timings.seconds(), 6)),
+                    ('timings', [t.to_dict() for t in cond.timings.timings])
+                ]))
+            collections.append(OrderedDict([
+                ('collection', coll.title),
+                ('analysis_seconds', coll.analysis_seconds),
+                ('timings', [t.to_dict() for t in coll.timings.timings]),
+                ('conditions', conditions)
+            ]))
+        statements = []
+        for title, t in self.slowest_statements(n_slowest):
+            d = OrderedDict(collection=title, condition=t.context)
+            d.update(t.to_dict(plan=True))
+            statements.append(d)
+        profile = OrderedDict([
+            ('name', self.name),
+            ('input_path', self.input_path),
+            ('created_at', self.created_at.strftime('%Y-%m-%d %H:%M:%S')),
+            ('stages', OrderedDict((k, round(v, 6)) for k, v in self.stage_seconds().items())),
+            ('slowest_statements', statements),
+            ('collections', collections)
+        ])
+        json.dump(profile, fobj, indent=2)
 
-    def run_analyses(self):
+    def profile_summary(self, n=5):
+        """
+        Return lines summarizing the stage timings:
+        total time by stage, and the ``n`` slowest conditions
+        and database statements.
+        """
+        conditions = [(cond.timings.seconds(), coll.title, cond)
+                      for coll in self.collections.values()
+                      for cond in coll.conditions.values()]
+        lines = ['Time by stage: ' + ', '.join(f'{k} {v:.1f} s'
+                                               for k, v in self.stage_seconds().items())]
+        conditions.sort(key=lambda x: x[0], reverse=True)
+        for seconds, title, cond in conditions[:n]:
+            parts = ', '.join(f'{k} {v:.1f} s' for k, v in cond.timings.by_stage().items())
+            lines.append(f'Slow condition {title} / {cond.id_string}: {seconds:.1f} s ({parts})')
+        for title, t in self.slowest_statements(n):
+            lines.append(f'Slow statement {title} / {str(t)}')
+        return lines
+
+    def run_analyses(self, details=False, report_workers=None, max_slides=None,
+                     explain_slowest=0, monitor=None, resume=False, extend_from=None,
+                     block_workers=0, slice_days=None, template=None, report_executor=None,
+                     async_workers=0, collection_workers=None, snapshot_workers=0,
+                     breakdown=None):
         """
         Run analyses for CondCollections that were made from the selected Excel sheets,
         and save results according to the selected formats and path names.
-        Analyses are run against collection-specific db connections.
+        Analyses are run against collection-specific db sessions
+        borrowed from the connection pool, see ``.open_db_pool()``.
+        With several database hosts, a collection whose session is lost
+        is analyzed again on another host, reusing the results
+        fetched and saved before the connection was lost.
+
+        :param details: save result intervals of each collection
+            as ``results/[name]_[sheetname]_details.parquet``
+            (requires ``pyarrow``)
+        :type details: boolean
+        :param report_workers: number of worker processes making Powerpoint
+            reports while the next collections are analyzed;
+            ``None`` for the number of CPUs, ``0`` to make them one by one
+        :type report_workers: integer
+        :param max_slides: max number of slides per Powerpoint file;
+            larger collections are split into numbered files
+        :type max_slides: integer
+        :param explain_slowest: number of slowest database statements
+            of the whole run whose query plans are captured
+            with ``EXPLAIN (ANALYZE, BUFFERS)`` into the timing profile;
+            this runs the statements again
+        :type explain_slowest: integer
+        :param monitor: writes live status of the run, if given
+        :type monitor: ``tsa.monitor.RunMonitor``
+        :param resume: restore results of Conditions saved by an earlier,
+            interrupted run of the same name from ``results/[name]_checkpoints/``
+            instead of analyzing them again; otherwise old checkpoints are removed.
+            Results are saved there as they are fetched in any case,
+            see ``CondCollection.load_checkpoints``.
+        :type resume: boolean
+        :param extend_from: name of an earlier run over a shorter period
+            starting at the same time; results saved by it are extended
+            with the rest of the period instead of analyzing the whole period,
+            see ``CondCollection.load_bases``
+        :type extend_from: string
+        :param block_workers: number of threads querying primary Blocks
+            in time slices, each on its own pool connection, so the pool
+            must allow ``block_workers + 2`` connections;
+            ``0`` to query each Block at once in the collection's session,
+            see ``tsa.slicing.BlockSlicer``
+        :type block_workers: integer
+        :param slice_days: length of the time slices in days;
+            by default the chunk interval of the ``statobs`` hypertable
+        :type slice_days: number
+        :param template: report template read beforehand,
+            by default read from ``PPTX_TEMPLATE_PATH``
+        :type template: ``tsa.report.ReportTemplate``
+        :param report_executor: executor making Powerpoint reports,
+            shared with other runs and thus not shut down here;
+            ``report_workers`` is ignored if given
+        :type report_executor: ``concurrent.futures.ProcessPoolExecutor``
+        :param async_workers: max number of concurrent queries
+            of Blocks and Conditions of a collection, each on its own
+            asyncpg connection besides the pool; ``0`` to analyze
+            the Conditions one by one in the collection's session,
+            see ``tsa.async_db.AsyncEvaluator`` (requires ``asyncpg``)
+        :type async_workers: integer
+        :param collection_workers: number of collections analyzed
+            in the database concurrently, each in its own session,
+            so the pool must allow ``collection_workers + block_workers + 1``
+            connections; by default the number of database hosts.
+            Outputs are saved in the order of the collections in any case.
+        :type collection_workers: integer
+        :param snapshot_workers: number of threads analyzing the Conditions
+            of a collection in parallel, each on its own pool connection,
+            all reading the observations on a snapshot exported by
+            the collection's session; the pool must allow
+            ``snapshot_workers`` more connections.
+            ``0`` to analyze the Conditions in the collection's session,
+            see ``tsa.snapshot.SnapshotEvaluator``.
+            Overrides ``async_workers``.
+        :type snapshot_workers: integer
+        :param breakdown: report the validity of each condition also by
+            calendar period, ``day``, ``week`` or ``month``, in an extra worksheet
+            of each collection and on the slides, see ``Condition.breakdown``;
+            ``None`` for totals only
+        :type breakdown: string
         """
+        if breakdown is not None and breakdown not in PERIODS:
+            self.errors.add(msg=f'Unknown breakdown period {breakdown}, '
+                                f'expected one of {", ".join(PERIODS)}; totals only are reported',
+                            log_add='warning')
+            breakdown = None
+        for coll in self.collections.values():
+            coll.breakdown = breakdown
+        if details and not HAS_PYARROW:
+            self.errors.add(msg='pyarrow is not installed, result details are not saved',
+                            log_add='warning')
+            details = False
+        if async_workers and not HAS_ASYNCPG:
+            self.errors.add(msg='asyncpg is not installed, conditions are analyzed one by one',
+                            log_add='warning')
+            async_workers = 0
+        if async_workers and snapshot_workers:
+            self.errors.add(msg='Conditions are analyzed on a shared snapshot, async_workers is ignored',
+                            log_add='warning')
+            async_workers = 0
+        if async_workers:
+            log.info(f'Conditions are analyzed with up to {async_workers} concurrent queries')
+        if snapshot_workers:
+            snapshot_executor = ContextThreadPoolExecutor(max_workers=snapshot_workers)
+            log.info(f'Conditions are analyzed by {snapshot_workers} threads on a shared snapshot')
+        else:
+            snapshot_executor = None
+        if collection_workers is None:
+            collection_workers = len(self.db_params.hosts)
+
+        # Template is read and validated once for all the reports
+        if template is None:
+            try:
+                template = ReportTemplate(PPTX_TEMPLATE_PATH)
+            except:
+                self.errors.add(msg=f'Cannot use report template {PPTX_TEMPLATE_PATH}, '
+                                    'Powerpoint reports are not saved',
+                                log_add='exception')
+        if template is None:
+            executor = None
+        elif report_executor is not None:
+            executor = report_executor
+        elif report_workers != 0:
+            executor = ProcessPoolExecutor(max_workers=report_workers)
+        else:
+            executor = None
+        # Collection - (path, future) pairs of reports in progress
+        pending_reports = []
+
+        if block_workers:
+            block_executor = ContextThreadPoolExecutor(max_workers=block_workers)
+            if slice_days:
+                slice_interval = timedelta(days=slice_days)
+            else:
+                with self.open_db_pool().connection() as pg_conn:
+                    slice_interval = hypertable_interval(pg_conn) or DEFAULT_SLICE_INTERVAL
+            log.info(f'Primary Blocks are queried in {str(slice_interval)} slices '
+                     f'by {block_workers} threads')
+        else:
+            block_executor = None
+
         log.info(f'Initializing Excel workbook for {str(self)}')
-        wb = xl.Workbook()
-        ws = wb.active
-        ws.title = 'INFO'
-        ws['A1'].value = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws['B1'].value = 'analysis started'
+        # Write-only workbook keeps memory use constant and is
+        # saved only once in the end; the csv summary file
+        # is updated after each collection instead.
+        wb = xl.Workbook(write_only=True)
+        ws_info = wb.create_sheet(title='INFO')
+        ws_info.append([datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'analysis started'])
         wb_path = f'{self.out_base_path}_report.xlsx'
         log.info(f'Excel workbook will be saved as {wb_path}')
+        summary_path = f'{self.out_base_path}_summary.csv'
+        if os.path.exists(summary_path):
+            os.remove(summary_path)
+        log.info(f'Summary results will be appended to {summary_path}')
+        profile_path = f'{self.out_base_path}_profile.json'
 
         # Prepare directory for png images for pptx;
         # keep the pngs if png_dir is passed to
@@ -208,29 +468,193 @@ class AnalysisCollection:
         os.makedirs(png_dir, exist_ok=True)
         log.info(f'Png images will be saved to {png_dir}')
 
-        for cl in self.collections.keys():
-            try:
-                with psycopg2.connect(**self.db_params) as pg_conn:
-                    coll_pptx_path = f'{self.out_base_path}_{cl}.pptx'
-                    self.collections[cl].run_analysis(pg_conn=pg_conn,
-                                                      wb=wb,
-                                                      wb_path=wb_path,
-                                                      pptx_path=coll_pptx_path,
-                                                      pptx_template=PPTX_TEMPLATE_PATH,
-                                                      png_dir=png_dir)
+        checkpoint_dir = f'{self.out_base_path}_checkpoints'
+        if not resume and os.path.exists(checkpoint_dir):
+            log.info(f'Removing old checkpoints {checkpoint_dir}')
+            shutil.rmtree(checkpoint_dir)
+        log.info(f'Results will be saved to {checkpoint_dir} as they are fetched')
+        if extend_from is not None:
+            base_dir = os.path.join(os.path.dirname(self.out_base_path),
+                                    f'{extend_from}_checkpoints')
+            log.info(f'Results of {base_dir} are extended')
+
+        def analyze_in_session(cl, explain_above, checkpoint_dir):
+            """
+            Analyze collection ``cl`` in the database in a session of its own.
+
+            :return: ``True`` if the connection was lost
+            """
+            coll = self.collections[cl]
+            pool = self.open_db_pool()
+            # A fully restored collection needs no db session
+            if coll.pending_conditions():
+                conn_context = pool.connection()
+            else:
+                conn_context = nullcontext()
+            with conn_context as pg_conn:
+                # Block slices and concurrent queries use the same host as the session
+                if pg_conn is not None and isinstance(pool, ReplicaPool):
+                    host = pool.host_of(pg_conn)
+                    host_pool = pool.host_pool(host)
+                    host_params = self.db_params.for_host(*host)
+                else:
+                    host_pool = pool
+                    host_params = self.db_params
+                if block_executor is not None:
+                    slicer = BlockSlicer(pool=host_pool,
+                                         executor=block_executor,
+                                         obs_view_sql=coll.obs_view_sql(),
+                                         time_from=coll.time_from,
+                                         time_until=coll.time_until,
+                                         interval=slice_interval)
+                else:
+                    slicer = None
+                if async_workers:
+                    async_evaluator = AsyncEvaluator(host_params, max_inflight=async_workers)
+                else:
+                    async_evaluator = None
+                if snapshot_executor is not None:
+                    snapshot_evaluator = SnapshotEvaluator(pool=host_pool, executor=snapshot_executor)
+                else:
+                    snapshot_evaluator = None
+                if monitor is not None:
+                    monitor.collection_started(cl, pg_conn, db_pool=host_pool)
+                if details:
+                    coll_details_path = f'{self.out_base_path}_{cl}_details.parquet'
+                else:
+                    coll_details_path = None
+                coll.analyze(pg_conn=pg_conn,
+                             details_path=coll_details_path,
+                             explain_slowest=explain_slowest,
+                             explain_above=explain_above,
+                             checkpoint_dir=checkpoint_dir,
+                             block_slicer=slicer,
+                             async_evaluator=async_evaluator,
+                             snapshot_evaluator=snapshot_evaluator)
+                return pg_conn is not None and bool(pg_conn.closed)
+
+        def analyze(cl):
+            """
+            Analyze collection ``cl`` in the database,
+            on other hosts if its connection is lost.
+            """
+            coll = self.collections[cl]
+            # Statements of this collection are explained only if they are
+            # among the slowest ones so far
+            explain_above = 0.0
+            if explain_slowest:
+                so_far = self.slowest_statements(explain_slowest)
+                if len(so_far) == explain_slowest:
+                    explain_above = so_far[-1][1].seconds
+            coll_checkpoint_dir = os.path.join(checkpoint_dir, to_filename(cl))
+            if resume:
+                coll.load_checkpoints(coll_checkpoint_dir)
+            if extend_from is not None:
+                coll.load_bases(os.path.join(base_dir, to_filename(cl)))
+            os.makedirs(coll_checkpoint_dir, exist_ok=True)
+            attempts = len(self.db_params.hosts)
+            for attempt in range(1, attempts + 1):
+                errors = coll.errors_snapshot()
+                try:
+                    lost = analyze_in_session(cl, explain_above, coll_checkpoint_dir)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if attempt == attempts:
+                        raise
+                    log.warning(f'Database error in the session of {str(coll)}', exc_info=True)
+                    lost = True
+                if not lost or attempt == attempts:
+                    break
+                # Errors caused by the lost connection are forgotten,
+                # and results saved before it are not fetched again
+                log.warning(f'Database connection of {str(coll)} was lost, '
+                            f'analyzing the rest on another host ({attempt}/{attempts - 1})')
+                coll.restore_errors(errors)
+                coll.load_checkpoints(coll_checkpoint_dir)
+            log.debug(f'{str(coll)} is analyzed in the database')
+
+        if collection_workers > 1:
+            collection_executor = ContextThreadPoolExecutor(max_workers=collection_workers)
+            log.info(f'Up to {collection_workers} collections are analyzed concurrently')
+        else:
+            collection_executor = None
+        # Collection - future of its database analysis
+        futures = OrderedDict()
+
+        if monitor is not None:
+            monitor.start()
+        try:
+            if collection_executor is not None:
+                for cl in self.collections.keys():
+                    futures[cl] = collection_executor.submit(analyze, cl)
+            for cl in self.collections.keys():
+                try:
+                    if cl in futures:
+                        futures[cl].result()
+                    else:
+                        analyze(cl)
+                    reports = self.collections[cl].save_outputs(
+                        wb=wb,
+                        summary_path=summary_path,
+                        pptx_path=f'{self.out_base_path}_{cl}.pptx',
+                        pptx_template=template,
+                        png_dir=png_dir,
+                        report_executor=executor,
+                        max_slides=max_slides
+                    )
+                    pending_reports.extend((self.collections[cl], r) for r in reports)
                     log.debug(f'{str(self.collections[cl])} is analyzed')
-            except:
-                self.errors.add(
-                    msg=f'Skipping {str(self.collections[cl])} due to fatal error',
-                    log_add='exception'
-                )
-
-        wb['INFO']['A2'].value = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        wb['INFO']['B2'].value = 'analysis ended'
-        wb.save(wb_path)
-        log.info(f'Excel workbook saved as {wb_path}')
+                except:
+                    self.errors.add(
+                        msg=f'Skipping {str(self.collections[cl])} due to fatal error',
+                        log_add='exception'
+                    )
+                if monitor is not None:
+                    monitor.collection_finished(cl)
+        finally:
+            # Sheets written so far are saved even if the run is interrupted
+            ws_info.append([datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'analysis ended'])
+            wb.save(wb_path)
+            log.info(f'Excel workbook saved as {wb_path}')
+
+            if executor is not None:
+                log.info(f'Waiting for {len(pending_reports)} Powerpoint reports ...')
+                for coll, (path, future) in pending_reports:
+                    if coll.merge_report(path, future):
+                        log.info(f'{path} saved')
+                if executor is not report_executor:
+                    executor.shutdown()
+            if collection_executor is not None:
+                for future in futures.values():
+                    future.cancel()
+                collection_executor.shutdown()
+            if block_executor is not None:
+                block_executor.shutdown()
+            if snapshot_executor is not None:
+                snapshot_executor.shutdown()
+
+            with open(profile_path, 'w') as fobj:
+                self.collect_profile(fobj, n_slowest=max(10, explain_slowest))
+            log.info(f'Timing profile saved as {profile_path}')
+            if monitor is not None:
+                monitor.stop()
         log.info(f'{str(self)} analyzed')
 
+    def output_files(self, max_slides=None):
+        """
+        Return the paths of the result files that ``.run_analyses()``
+        has written since this instance was created, i.e. in this run.
+        ``max_slides`` must be the same as given to ``.run_analyses()``.
+        """
+        paths = [f'{self.out_base_path}_report.xlsx',
+                 f'{self.out_base_path}_summary.csv',
+                 f'{self.out_base_path}_profile.json']
+        for cl, coll in self.collections.items():
+            paths.append(f'{self.out_base_path}_{cl}_details.parquet')
+            paths.extend(deck_paths(f'{self.out_base_path}_{cl}.pptx',
+                                    len(coll.conditions), max_slides))
+        since = self.created_at.timestamp()
+        return [p for p in paths if os.path.exists(p) and os.path.getmtime(p) >= since]
+
     def __getitem__(self, key):
         """
         Return the CondCollection from the OrderedDict referenced by ``key``.
@@ -238,6 +662,6 @@ class AnalysisCollection:
         return self.collections[key]
 
     def __str__(self):
-        s = f'<AnalysisCollection {self.name}> from <{self.input_xlsx}> '
+        s = f'<AnalysisCollection {self.name}> from <{self.input_path}> '
         s += f'with {len(self.collections)} collections>'
         return s
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Concurrent Block queries and Condition fetches with asyncpg, called by CondCollection
+
+import asyncio
+import logging
+from .db import BLOCK_QUERY_SQL
+from .db import BLOCK_RUNS_QUERY_SQL
+from .intervals import IntervalSeries
+
+try:
+    import asyncpg
+    HAS_ASYNCPG = True
+except ImportError:
+    HAS_ASYNCPG = False
+
+log = logging.getLogger(__name__)
+
+async def create_ranges_table(conn, alias, ranges):
+    """
+    Like ``tsa.condition.create_ranges_table``,
+    using asyncpg connection ``conn``.
+    """
+    await conn.execute(f"CREATE TEMP TABLE {alias} "
+                       f"(valid_r tstzrange, {alias} boolean) ON COMMIT DROP;")
+    await conn.execute(f"INSERT INTO {alias} "
+                       "SELECT tstzrange(vfrom, vuntil), value "
+                       "FROM unnest($1::timestamptz[], $2::timestamptz[], $3::boolean[]) "
+                       "AS r(vfrom, vuntil, value);",
+                       [r[0] for r in ranges], [r[1] for r in ranges], [r[2] for r in ranges])
+
+class AsyncEvaluator:
+    """
+    Creates the Condition tables of a ``CondCollection``
+    and fetches their results with asyncpg, so that independent queries
+    are run concurrently, at most ``max_inflight`` at a time,
+    each on its own connection.
+
+    The ranges of all primary Blocks are queried first, concurrently,
+    and identical Blocks of different Conditions only once.
+    Each Condition is then combined and fetched on a connection
+    of its own, as soon as the ranges of its Blocks are ready:
+    the ranges are uploaded into Block temp tables like with
+    ``tsa.slicing.BlockSlicer``, and secondary Blocks read the results
+    of the Conditions they refer to, already fetched or restored.
+    The statements are the same as in the collection's own session,
+    see ``Condition.create_db_temptable``, so the results are identical,
+    and errors are recorded to the Conditions the same way.
+
+    Each run uses a pool of its own, since asyncpg pools
+    belong to an event loop.
+
+    :param db_params: connection parameters, e.g. ``tsa.db.DBParams``
+    :param max_inflight: max number of concurrent statements
+    """
+    def __init__(self, db_params, max_inflight):
+        self.db_params = db_params
+        self.max_inflight = max_inflight
+        self.coll = None
+        self.pool = None
+        self.prepared = True
+        self.block_futures = {}
+
+    def run(self, coll, keys):
+        """
+        Analyze the Conditions ``keys`` of CondCollection ``coll``,
+        setting their results like ``Condition.fetch_results_from_db``.
+
+        :return: dict of Condition key - ``True`` if the results were fetched
+        """
+        return asyncio.run(self.run_conditions(coll, keys))
+
+    async def run_conditions(self, coll, keys):
+        self.coll = coll
+        self.prepared = True
+        self.block_futures = {}
+        self.pool = await asyncpg.create_pool(database=self.db_params['dbname'],
+                                              user=self.db_params['user'],
+                                              password=self.db_params['password'],
+                                              host=self.db_params['host'],
+                                              port=int(self.db_params['port']),
+                                              min_size=0,
+                                              max_size=self.max_inflight,
+                                              statement_cache_size=0,
+                                              init=self.init_connection,
+                                              setup=self.setup_connection)
+        try:
+            for k in keys:
+                for bl in coll.conditions[k].blocks.values():
+                    if not bl.secondary:
+                        self.block_ranges(bl, coll.conditions[k])
+            # Like in the collection's session, a secondary Condition
+            # can refer to primary ones and to secondary ones before it
+            order = ([k for k in keys if not coll.conditions[k].secondary]
+                     + [k for k in keys if coll.conditions[k].secondary])
+            tasks = {}
+            for k in order:
+                tasks[k] = asyncio.ensure_future(self.condition(k, dict(tasks)))
+            fetched = await asyncio.gather(*[tasks[k] for k in keys])
+        finally:
+            await self.pool.close()
+            self.pool = None
+        return dict(zip(keys, fetched))
+
+    async def init_connection(self, conn):
+        """
+        Create the ``obs_main`` view of the collection
+        and prepare the Block queries in a new connection.
+        """
+        await conn.execute(self.coll.obs_view_sql())
+        try:
+            async with conn.transaction():
+                await conn.execute(BLOCK_QUERY_SQL)
+                if any(bl.discrete for cnd in self.coll.conditions.values()
+                       for bl in cnd.blocks.values()):
+                    await conn.execute(BLOCK_RUNS_QUERY_SQL)
+        except asyncpg.PostgresError:
+            log.exception('Could not prepare Block query, using pack_ranges instead')
+            self.prepared = False
+
+    async def setup_connection(self, conn):
+        # Settings are reset when a connection is returned to the pool
+        if conn.get_server_version() >= (12, 0):
+            await conn.execute("SET plan_cache_mode = force_generic_plan;")
+
+    def block_ranges(self, bl, cnd):
+        """
+        Return a future of the ranges of primary Block ``bl``
+        of Condition ``cnd``, shared by identical Blocks;
+        the query is timed to the Block that requests it first.
+        """
+        key = (bl.station_id, bl.sensor_id, bl.operator, bl.value_str)
+        if key not in self.block_futures:
+            self.block_futures[key] = asyncio.ensure_future(self.query_ranges(bl, cnd))
+        return self.block_futures[key]
+
+    async def query_ranges(self, bl, cnd):
+        """
+        Query the ranges of primary Block ``bl`` in time order,
+        timing the query to Condition ``cnd``.
+        """
+        async with self.pool.acquire() as conn:
+            sql = bl.get_execute_sql() if self.prepared else None
+            if sql is None:
+                sql = bl.get_sql_def()
+            log.debug(sql)
+            with cnd.timings.time('block', block=bl.alias):
+                rows = await conn.fetch(sql)
+        return sorted(((r[0].lower, r[0].upper, r[1]) for r in rows), key=lambda r: r[0])
+
+    def failed(self, cnd, created):
+        """
+        Record the errors of Condition ``cnd`` like in the collection's session,
+        where fetching fails too if the temp table was not ``created``.
+        Must be called in an ``except`` block.
+        """
+        if not created:
+            cnd.errors.add(
+                msg='Failed to create temp table',
+                log_add='exception'
+            )
+        cnd.errors.add(
+            msg='Cannot not fetch results from db',
+            log_add='exception'
+        )
+
+    async def condition(self, key, earlier):
+        """
+        Create the table of Condition ``key`` and fetch its results,
+        once the Conditions in ``earlier`` it refers to are done.
+
+        :return: ``True`` if the results were fetched
+        """
+        cnd = self.coll.conditions[key]
+        log.info(f'Creating temp table {cnd.id_string}')
+        # All the ranges are awaited before taking a connection,
+        # so that waiting Conditions never hold one
+        try:
+            ranges = []
+            for bl in cnd.blocks.values():
+                if not bl.secondary:
+                    ranges.append((bl.alias, await self.block_ranges(bl, cnd)))
+                    continue
+                ref = bl.source_view
+                if ref in earlier:
+                    available = await earlier[ref]
+                else:
+                    available = ref in self.coll.restored or ref in self.coll.no_data
+                if not available:
+                    raise Exception(f'No results of Condition {ref} for Block {bl.alias}')
+                ranges.append((bl.alias, self.coll.conditions[ref].results.rows('master')))
+        except:
+            self.failed(cnd, created=False)
+            return False
+
+        select_sql = cnd.get_select_sql()
+        created = False
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    try:
+                        for alias, rr in ranges:
+                            await create_ranges_table(conn, alias, rr)
+                        with cnd.timings.time('combine'):
+                            await conn.execute(f"CREATE TEMP TABLE {cnd.id_string} ON COMMIT DROP "
+                                               f"AS ( \n{select_sql});")
+                        created = True
+                        log.info(f'Temp table created for {str(cnd)}')
+                    finally:
+                        self.coll.n_temptables_done += 1
+                    with cnd.timings.time('fetch'):
+                        rows = await conn.fetch(f"{cnd.get_fetch_sql()} ORDER BY vfrom;")
+        except:
+            self.failed(cnd, created)
+            return False
+        cnd.set_results(IntervalSeries.from_rows(cnd.get_result_columns(),
+                                                 [tuple(r) for r in rows]))
+        return True
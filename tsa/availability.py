@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Days with observations by station and sensor, called by CondCollection
+
+import logging
+import numpy
+import psycopg2
+from datetime import date
+from datetime import timedelta
+from datetime import timezone
+
+log = logging.getLogger(__name__)
+
+# Length of the day bitmaps of the seobs_days table
+YEAR_BITS = 366
+
+def utc_date(t):
+    """
+    Return the UTC date of timezone-aware datetime ``t``.
+    """
+    return t.astimezone(timezone.utc).date()
+
+class Availability:
+    """
+    Days that have observations of a station and sensor,
+    read from the ``seobs_days`` table (see ``database/05_seobs_days.sql``)
+    for the years of a period.
+    Days are in UTC, and a day with observations may have them
+    outside the period too, so ``.days_with_data()`` never
+    underestimates: no days means certainly no observations.
+
+    :param first_year: first year of the bitmaps
+    :type first_year: integer
+    :param last_year: last year of the bitmaps
+    :type last_year: integer
+    :param bitmaps: (station id, sensor id) - boolean array of the days
+        from the start of ``first_year``, by day of year
+    :type bitmaps: dict
+    """
+    def __init__(self, first_year, last_year, bitmaps):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def from_db(cls, pg_conn, time_from, time_until, pairs):
+        """
+        Read the days of station and sensor id ``pairs``
+        for the years between ``time_from`` and ``time_until``,
+        or return ``None`` if there is no ``seobs_days`` table
+        or it is not up to date for the period, see ``.is_current()``.
+        """
+        first_year = utc_date(time_from).year
+        last_year = utc_date(time_until).year
+        statids = sorted(set(p[0] for p in pairs))
+        seids = sorted(set(p[1] for p in pairs))
+        with pg_conn.cursor() as cur:
+            try:
+                cur.execute("SELECT max(year) FROM seobs_days;")
+                index_year = cur.fetchone()[0]
+                # Last day with observations in the index:
+                # position of the last set bit in the bitmaps of the last year
+                cur.execute("SELECT max(make_date(year, 1, 1) "
+                            "+ length(rtrim(days::text, '0')) - 1) "
+                            "FROM seobs_days WHERE year = %s;",
+                            (index_year,))
+                index_last_day = cur.fetchone()[0]
+                cur.execute("SELECT max(tfrom) FROM statobs;")
+                obs_last = cur.fetchone()[0]
+                cur.execute("SELECT statid, seid, year, days::text FROM seobs_days "
+                            "WHERE statid = ANY(%s) AND seid = ANY(%s) "
+                            "AND year BETWEEN %s AND %s;",
+                            (statids, seids, first_year, last_year))
+                rows = cur.fetchall()
+                pg_conn.commit()
+            except psycopg2.Error:
+                pg_conn.rollback()
+                log.info('No availability index seobs_days in database')
+                return None
+        obs_last_day = None if obs_last is None else utc_date(obs_last)
+        if not cls.is_current(index_last_day, obs_last_day, time_until):
+            log.warning(f'Availability index seobs_days ends on {index_last_day} '
+                        f'but observations on {obs_last_day}, not using it: '
+                        'run populate_seobs_days() after populating observations')
+            return None
+        n_years = last_year - first_year + 1
+        bitmaps = {}
+        for statid, seid, year, days in rows:
+            if (statid, seid) not in bitmaps:
+                bitmaps[(statid, seid)] = numpy.zeros(n_years * YEAR_BITS, dtype=bool)
+            start = (year - first_year) * YEAR_BITS
+            bitmaps[(statid, seid)][start:start + YEAR_BITS] = (
+                numpy.frombuffer(days.encode(), dtype=numpy.uint8) == ord('1'))
+        return cls(first_year, last_year, bitmaps)
+
+    @staticmethod
+    def is_current(index_last_day, obs_last_day, time_until):
+        """
+        Tell whether the index can be used for a period ending at ``time_until``:
+        it has the day of the latest observation ``obs_last_day``,
+        so no observations have been added since it was last populated,
+        or at least the whole period is before its last day ``index_last_day``.
+        Either date is ``None`` if there are no observations or no index rows.
+        """
+        if obs_last_day is None:
+            return True
+        if index_last_day is None:
+            return False
+        return index_last_day >= obs_last_day or utc_date(time_until) <= index_last_day
+
+    def day_positions(self, time_from, time_until):
+        """
+        Return the bitmap positions of the days between
+        ``time_from`` and ``time_until``, inclusive.
+        """
+        first_day = utc_date(time_from)
+        n_days = (utc_date(time_until) - first_day).days + 1
+        days = [first_day + timedelta(days=i) for i in range(n_days)]
+        return numpy.array([(d.year - self.first_year) * YEAR_BITS
+                            + (d - date(d.year, 1, 1)).days for d in days], dtype=numpy.int64)
+
+    def days_with_data(self, statid, seid, time_from, time_until):
+        """
+        Return the number of days between ``time_from`` and ``time_until``
+        with observations of station ``statid`` and sensor ``seid``,
+        and the number of all the days, as tuple.
+        """
+        positions = self.day_positions(time_from, time_until)
+        bitmap = self.bitmaps.get((statid, seid))
+        if bitmap is None:
+            return 0, len(positions)
+        return int(bitmap[positions].sum()), len(positions)
+
+    def __repr__(self):
+        return (f'<Availability of {len(self.bitmaps)} station and sensor pairs '
+                f'in {self.first_year}-{self.last_year}>')
@@ -3,13 +3,26 @@
 
 # Block class, called by Condition
 
+import copy
 import logging
+import re
+from .db import BLOCK_QUERY_NAME
+from .db import BLOCK_QUERY_FLAGS
+from .db import BLOCK_RUNS_QUERY_NAME
+from .db import block_query_values
 from .error import TsaErrCollection
 from .utils import to_pg_identifier
 from .utils import with_errpointer
 
 log = logging.getLogger(__name__)
 
+# Binary operators, surrounded by whitespaces;
+# longer alternatives first so that e.g. ">=" is not read as ">"
+BINOP_RE = re.compile(' (<>|>=|<=|=|>|<|in) ')
+
+# Max validity of a single sensor observation in minutes
+MAXMINUTES = 30
+
 class Block:
     """
     Represents a logical subcondition
@@ -35,8 +48,10 @@ class Block:
     :type order_nr: integer
     :param raw_logic: logic to parse, bound to single sensor or existing Condition
     :type raw_logic: string
+    :param silent: if ``True``, parsing errors are recorded but not logged
+    :type silent: boolean
     """
-    def __init__(self, master_alias, parent_site, order_nr, raw_logic):
+    def __init__(self, master_alias, parent_site, order_nr, raw_logic, silent=False):
         self.raw_logic = raw_logic
         self.master_alias = to_pg_identifier(master_alias)
         self.parent_site = to_pg_identifier(parent_site)
@@ -50,14 +65,31 @@ class Block:
         self.source_view = None
         self.sensor = None
         self.sensor_id = None
+        # Whether the sensor is discrete-valued, i.e. its ranges
+        # are read from the runs of equal values, see .get_execute_sql()
+        self.discrete = False
+        # Whether the station has certainly no data of the sensor
+        # in the analysis period, see CondCollection.check_availability
+        self.no_data = False
         self.operator = None
         self.value_str = None
 
-        self.errors = TsaErrCollection(f'BLOCK <{self.alias}>')
+        self.errors = TsaErrCollection(f'BLOCK <{self.alias}>', silent=silent)
 
         # Set values depending on raw logic given
         self.unpack_logic()
 
+    def copy(self):
+        """
+        Return a copy of the Block without parsing the raw logic again.
+        Errors recorded so far are added (and logged)
+        to a new error collection of the copy.
+        """
+        bl = copy.copy(self)
+        bl.errors = TsaErrCollection(self.errors.context)
+        bl.errors.extend(self.errors.errors)
+        return bl
+
     def is_valid(self):
         """
         Sanity check: is Block ready for analysis?
@@ -90,8 +122,6 @@ class Block:
         :param raw_logic: original logic string
         :type raw_logic: string
         """
-        binops = [' = ', ' <> ', ' > ', ' < ', ' >= ', ' <= ', ' in ']
-
         # ERROR if too many hashtags or operators
         n_hashtags = self.raw_logic.count('#')
         if n_hashtags > 1:
@@ -99,12 +129,8 @@ class Block:
                 msg='Too many "#" symbols, only one or zero allowed',
                 log_add='error'
             )
-        n_binops = 0
-        binop_in_str = None
-        for binop in binops:
-            if binop in self.raw_logic:
-                n_binops += self.raw_logic.count(binop)
-                binop_in_str = binop
+        binops_in_str = BINOP_RE.findall(self.raw_logic)
+        n_binops = len(binops_in_str)
         if n_binops > 1:
             self.errors.add(
                 msg='Too many "=", "<>", ">", "<", ">=", "<=", "in" operators, only one or zero allowed',
@@ -146,14 +172,14 @@ class Block:
         elif n_hashtags == 1 and n_binops == 1:
             self.secondary = False
             self.site = self.parent_site
-            parts = self.raw_logic.split('#')
-            parts = [parts[0]] + parts[1].split(binop_in_str)
             try:
-                self.station = to_pg_identifier(parts[0])
+                lhs, value_str = BINOP_RE.split(self.raw_logic, maxsplit=1)[::2]
+                station, sensor = lhs.split('#')
+                self.station = to_pg_identifier(station)
                 self.station_id = int(''.join(i for i in self.station if i.isdigit()))
-                self.sensor = to_pg_identifier(parts[1])
-                self.operator = binop_in_str.lower().strip()
-                self.value_str = parts[2].lower().strip()
+                self.sensor = to_pg_identifier(sensor)
+                self.operator = binops_in_str[0].lower()
+                self.value_str = value_str.lower().strip()
             except:
                 self.errors.add(
                     msg='Cannot set attributes for primary condition',
@@ -178,10 +204,12 @@ class Block:
                 log_add='error'
             )
 
-    def set_sensor_id(self, nameid_pairs):
+    def set_sensor_id(self, nameid_pairs, discrete_ids=None):
         """
         Set sensor id based on name-id dict,
-        presumably gotten from database.
+        presumably gotten from database,
+        and whether the sensor is one of the discrete ones
+        of ``discrete_ids``, if given.
         """
         if not self.secondary:
             try:
@@ -191,6 +219,7 @@ class Block:
                     msg=f'No sensor id found by sensor name "{self.sensor}"',
                     log_add='error'
                 )
+            self.discrete = self.sensor_id in (discrete_ids or ())
 
     def get_sql_def(self):
         """
@@ -208,13 +237,18 @@ class Block:
                    f"master AS {self.alias} "
                    f"FROM {self.source_view}")
 
+        elif self.no_data:
+            # Block is PRIMARY without observations -> no ranges
+            sql = ("SELECT NULL::tstzrange AS valid_r, "
+                   f"NULL::boolean AS {self.alias} WHERE false")
+
         else:
             # Block is PRIMARY -> make pack_ranges call
             # to form time ranges and boolean values
             sql = (f"SELECT valid_r, istrue AS {self.alias} "
                    "FROM pack_ranges("
                    "p_obs_relation := 'obs_main', "
-                   "p_maxminutes := 30, "
+                   f"p_maxminutes := {MAXMINUTES}, "
                    f"p_statid := {self.station_id}, "
                    f"p_seid := {self.sensor_id}, "
                    f"p_operator := '{self.operator}', "
@@ -222,6 +256,64 @@ class Block:
 
         return sql
 
+    def get_execute_sql(self, since=None, until=None):
+        """
+        Create ``EXECUTE`` call of the prepared statement
+        ``tsa.db.BLOCK_QUERY_NAME`` for a primary Block,
+        or ``tsa.db.BLOCK_RUNS_QUERY_NAME`` if the sensor is discrete,
+        or return ``None`` if its values are not numeric
+        or it certainly has no data, see ``.get_sql_def()``.
+        If ``since`` is given, only observations from that time on are used,
+        and if ``until`` is given, observations before that time
+        and the first one after it.
+        """
+        if self.secondary is not False or not self.is_valid() or self.no_data:
+            return None
+        values = block_query_values(self.operator, self.value_str)
+        if values is None or self.operator not in BLOCK_QUERY_FLAGS:
+            return None
+        # PostgreSQL compares a list of values as real
+        # but a single value, also "in (x)", as float8
+        operator = self.operator
+        if operator == 'in' and len(values) == 1:
+            operator = '='
+        if operator == 'in':
+            value_args = f"NULL, ARRAY[{', '.join(values)}]::real[]"
+        else:
+            value_args = f"{values[0]}, '{{}}'"
+        flags = ', '.join(str(f).lower() for f in BLOCK_QUERY_FLAGS[operator])
+        since_arg = '-infinity' if since is None else since.isoformat()
+        until_arg = 'infinity' if until is None else until.isoformat()
+        name = BLOCK_RUNS_QUERY_NAME if self.discrete else BLOCK_QUERY_NAME
+        return (f"EXECUTE {name}({self.station_id}, {self.sensor_id}, "
+                f"'{MAXMINUTES} minutes', {value_args}, {flags}, "
+                f"'{since_arg}', '{until_arg}')")
+
+    def get_query_sql(self, prepared=False):
+        """
+        Return the query of the Block ranges:
+        ``.get_execute_sql()`` if ``prepared`` is ``True``
+        and it is available, ``.get_sql_def()`` otherwise.
+        """
+        execute_sql = self.get_execute_sql() if prepared else None
+        if execute_sql is not None:
+            return execute_sql
+        return self.get_sql_def()
+
+    def get_create_sql(self, prepared=False):
+        """
+        Create SQL call for the temp table of the Block
+        that is dropped at the end of the transaction.
+        If ``prepared`` is ``True``, a primary Block uses
+        the prepared statement ``tsa.db.BLOCK_QUERY_NAME``
+        instead of ``pack_ranges`` when its values are numeric.
+        """
+        execute_sql = self.get_execute_sql() if prepared else None
+        if execute_sql is not None:
+            return (f"CREATE TEMP TABLE {self.alias} (valid_r, {self.alias}) "
+                    f"ON COMMIT DROP AS {execute_sql};")
+        return f"CREATE TEMP TABLE {self.alias} ON COMMIT DROP AS ({self.get_sql_def()});"
+
     def __str__(self):
         if self.secondary is None:
             s = '<? '
@@ -3,16 +3,38 @@
 
 # Collection of Conditions for analysis
 
+import copy
+import csv
 import logging
-import pptx
 import os
+import psycopg2
+import tempfile
 import openpyxl as xl
+from .availability import Availability
+from .block import MAXMINUTES
 from .condition import Condition
+from .coverage import read_daily
+from .coverage import summarize
+from .detail_export import DetailWriter
+from .db import prepare_block_query
+from .db import prepare_block_runs_query
+from .db import current_block_runs
+from .report import ReportTemplate
+from .report import PLACEHOLDERS
+from .report import deck_paths
+from .report import render_deck
 from .error import TsaErrCollection
+from .intervals import IntervalSeries
+from .periods import BREAKDOWN_COLUMNS
+from .periods import SLIDE_MAX_PERIODS
+from .periods import period_label
+from .profiling import TsaTimings
+from .profiling import slowest
+from .ranges import ranges_from_results
 from .utils import strfdelta
-from .utils import list_local_statids
-from .utils import list_local_sensors
 from collections import OrderedDict
+from openpyxl.cell import WriteOnlyCell
+from datetime import date
 from datetime import datetime
 from io import BytesIO
 from pptx.util import Pt
@@ -21,6 +43,46 @@ from pptx.dml.color import RGBColor
 
 log = logging.getLogger(__name__)
 
+# Descriptions of input value locations for error messages:
+# Excel sheets (and csv files in the same layout) ...
+XLSX_NAMES = dict(
+    start='cell A2',
+    end='cell B2',
+    cell='Cell {col}{row}',
+    columns=('A', 'B', 'C')
+)
+# ... and tables with one condition per row
+TABLE_NAMES = dict(
+    start='column "start"',
+    end='column "end"',
+    cell='Column "{col}" on row {row}',
+    columns=('site', 'master_alias', 'condition')
+)
+
+# Columns of the summary results, see ``CondCollection.summary_rows``;
+# ``collection`` is only used in the csv summary file
+SUMMARY_COLUMNS = ('collection', 'site', 'master_alias', 'condition',
+                   'data_from', 'data_until', 'valid', 'notvalid',
+                   'nodata', 'rows')
+
+def parse_date(value, what):
+    """
+    Return ``value`` as datetime;
+    strings must be d.m.Y dates.
+    ``what`` describes the value for error messages.
+    """
+    dateformat = '%d.%m.%Y'
+    if value is None:
+        raise Exception(f'{what} is empty')
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.strptime(str(value).strip(), dateformat)
+    except:
+        raise Exception(f'Cannot parse {what[0].lower() + what[1:]}')
+
 class CondCollection:
     """
     A collection of conditions to analyze.
@@ -56,9 +118,24 @@ class CondCollection:
 
         # Database-specific stuff
         self.has_main_db_view = False
+        self.has_block_query = False
+        self.has_block_runs_query = False
         self.station_ids_in_db_view = set()
 
         self.errors = TsaErrCollection(f'COLLECTION <{self.title}>')
+        # Collection level stages; Conditions are timed separately
+        self.timings = TsaTimings(self.title)
+        self.analysis_seconds = None
+        # Progress of the analysis, followed by tsa.monitor.RunMonitor
+        self.n_temptables_done = 0
+        self.n_fetched = 0
+        # Keys of Conditions whose results were restored from checkpoints
+        self.restored = set()
+        # Keys of Conditions that certainly have no data, see .check_availability()
+        self.no_data = set()
+        # Calendar period of the validity breakdown in the outputs,
+        # a key of tsa.periods.PERIODS, or None for totals only
+        self.breakdown = None
 
     def add_condition(self, site, master_alias, raw_condition, excel_row=None):
         """
@@ -87,21 +164,32 @@ class CondCollection:
             return
         self.conditions[candidate.id_string] = candidate
 
+    def obs_view_sql(self):
+        """
+        Create SQL call of the temporary view ``obs_main``
+        of the observations in the analysis period.
+        """
+        from_str = self.time_from.strftime('%Y-%m-%d %H:%M:%S')
+        until_str = self.time_until.strftime('%Y-%m-%d %H:%M:%S')
+        return ("CREATE OR REPLACE TEMP VIEW obs_main AS "
+                "SELECT tfrom, statid, seid, seval "
+                "FROM statobs "
+                "INNER JOIN seobs "
+                "ON statobs.id = seobs.obsid "
+                f"WHERE tfrom BETWEEN '{from_str}'::timestamptz AND '{until_str}'::timestamptz;")
+
     def setup_obs_view(self, pg_conn):
         """
         Create temporary view ``obs_main``
-        that works as the main source for Block queries.
+        that works as the main source for Block queries,
+        and prepare the primary Block query reading from it,
+        and the one reading the runs if there are discrete sensors.
+        If the latter is not available, the Blocks of discrete sensors
+        read the observations like the others.
 
         :param pg_conn: valid psycopg2 connection object
         """
-        from_str = self.time_from.strftime('%Y-%m-%d %H:%M:%S')
-        until_str = self.time_until.strftime('%Y-%m-%d %H:%M:%S')
-        sql = ("CREATE OR REPLACE TEMP VIEW obs_main AS "
-               "SELECT tfrom, statid, seid, seval "
-               "FROM statobs "
-               "INNER JOIN seobs "
-               "ON statobs.id = seobs.obsid "
-               f"WHERE tfrom BETWEEN '{from_str}'::timestamptz AND '{until_str}'::timestamptz;")
+        sql = self.obs_view_sql()
         with pg_conn.cursor() as cur:
             try:
                 log.debug(sql)
@@ -112,6 +200,15 @@ class CondCollection:
                 pg_conn.rollback()
                 self.errors.add(msg='Cannot create obs_main db view',
                                 log_add='exception')
+                return
+        self.has_block_query = prepare_block_query(pg_conn)
+        discrete_blocks = [bl for cnd in self.conditions.values()
+                           for bl in cnd.blocks.values() if bl.discrete]
+        if self.has_block_query and discrete_blocks:
+            self.has_block_runs_query = prepare_block_runs_query(pg_conn)
+            if not self.has_block_runs_query:
+                for bl in discrete_blocks:
+                    bl.discrete = False
 
     def validate_statids_with_db(self, pg_conn):
         """
@@ -163,295 +260,1000 @@ class CondCollection:
                         log_add='error'
                     )
 
-    def create_condition_temptables(self, pg_conn):
+    def references(self, key):
+        """
+        Return keys of the Conditions in this collection
+        that the secondary Blocks of Condition ``key`` refer to.
+        """
+        refs = []
+        for bl in self.conditions[key].blocks.values():
+            if bl.secondary and bl.source_view in self.conditions and bl.source_view not in refs:
+                refs.append(bl.source_view)
+        return refs
+
+    def required_conditions(self, keys):
+        """
+        Return ``keys`` and the keys of the Conditions
+        they refer to directly or indirectly, as a set.
+        """
+        required = set()
+        stack = list(keys)
+        while stack:
+            k = stack.pop()
+            if k in required:
+                continue
+            required.add(k)
+            stack.extend(self.references(k))
+        return required
+
+    def logic_definition(self, key, _seen=None):
+        """
+        Return the logic the results of Condition ``key`` depend on,
+        i.e. the condition string and the logic of the Conditions
+        it refers to, as a JSON serializable dict.
+        """
+        _seen = (_seen or set()) | {key}
+        refs = OrderedDict()
+        for ref in self.references(key):
+            # A circular reference fails in the database anyway
+            if ref not in _seen:
+                refs[ref] = self.logic_definition(ref, _seen)
+        return OrderedDict([('condition', self.conditions[key].condition),
+                            ('references', refs)])
+
+    def definition(self, key):
+        """
+        Return what the results of Condition ``key`` are computed of:
+        the analysis period, max validity of an observation
+        and ``.logic_definition(key)``.
+        Results saved with a different definition are not restored.
+        """
+        return OrderedDict([('time_from', self.time_from.isoformat()),
+                            ('time_until', self.time_until.isoformat()),
+                            ('maxminutes', MAXMINUTES),
+                            ('logic', self.logic_definition(key))])
+
+    def load_checkpoints(self, dirpath):
+        """
+        Restore results of the Conditions saved to ``dirpath``
+        by an earlier run with the same definitions,
+        see ``Condition.load_checkpoint``.
+        Keys of the restored Conditions are added to ``.restored``.
+        """
+        if not os.path.isdir(dirpath):
+            return
+        for k, c in self.conditions.items():
+            if not c.is_valid():
+                continue
+            try:
+                if c.load_checkpoint(dirpath, self.definition(k)):
+                    self.restored.add(k)
+            except:
+                c.errors.add(
+                    msg=f'Cannot restore results from {dirpath}, analyzing again',
+                    log_add='exception'
+                )
+        self.recombine_checkpoints(dirpath)
+        log.info(f'{len(self.restored)}/{len(self.conditions)} results of {str(self)} restored')
+
+    def recombines(self, definition, key):
+        """
+        Return ``True`` if the results computed of ``definition``
+        contain the Block ranges of Condition ``key``:
+        the period is the same, and the conditions differ
+        but have the same primary Blocks, and the Conditions
+        that the secondary Blocks refer to are restored.
+        """
+        new = self.definition(key)
+        return (definition['logic']['condition'] != new['logic']['condition']
+                and definition['maxminutes'] == new['maxminutes']
+                and definition['time_from'] == new['time_from']
+                and definition['time_until'] == new['time_until']
+                and all(bl.source_view in self.restored
+                        for bl in self.conditions[key].blocks.values() if bl.secondary))
+
+    def recombine_checkpoints(self, dirpath):
+        """
+        Make the results of the Conditions whose logic was changed
+        after the results in ``dirpath`` were saved, but whose Blocks were not,
+        without the database, see ``Condition.recombine``,
+        and save them as checkpoints of the new definitions.
+        Keys of the recombined Conditions are added to ``.restored``.
+        """
+        for k, c in self.conditions.items():
+            if not c.is_valid() or k in self.restored:
+                continue
+            try:
+                meta = c.read_checkpoint(dirpath)
+                if meta is None or not self.recombines(meta['definition'], k):
+                    continue
+                aliases = c.recombinable_aliases(meta['definition']['logic']['condition'])
+                if aliases is None:
+                    continue
+                c.load_base(dirpath)
+                references = {ref: self.conditions[ref].results for ref in self.references(k)}
+                c.recombine(c.base_results, aliases, references)
+                c.base_results = None
+                c.save_checkpoint(dirpath, self.definition(k))
+                self.restored.add(k)
+                log.info(f'Results of {str(c)} recombined of the Blocks in {dirpath}')
+            except:
+                c.base_results = None
+                c.errors.add(
+                    msg=f'Cannot recombine results from {dirpath}, analyzing again',
+                    log_add='exception'
+                )
+
+    def extends(self, definition, key):
+        """
+        Return ``True`` if results computed of ``definition``
+        can be extended to those of Condition ``key``:
+        the logic is the same and the period starts at the same time
+        but ends earlier.
+        """
+        new = self.definition(key)
+        return (definition['logic'] == new['logic']
+                and definition['maxminutes'] == new['maxminutes']
+                and definition['time_from'] == new['time_from']
+                and definition['time_until'] < new['time_until'])
+
+    def load_bases(self, dirpath):
+        """
+        Read results of the Conditions saved to ``dirpath``
+        by an earlier run over a shorter period, so that only the rest
+        of the period is analyzed, see ``Condition.extend_db_temptable``.
+        Observations of the earlier period are assumed unchanged.
+        """
+        if not os.path.isdir(dirpath):
+            log.warning(f'No results to extend found in {dirpath}')
+            return
+        n_bases = 0
+        for k in self.pending_conditions():
+            c = self.conditions[k]
+            try:
+                meta = c.read_checkpoint(dirpath)
+                if meta is None or not self.extends(meta['definition'], k):
+                    continue
+                c.load_base(dirpath)
+                n_bases += 1
+            except:
+                c.errors.add(
+                    msg=f'Cannot read results to extend from {dirpath}, analyzing the whole period',
+                    log_add='exception'
+                )
+        log.info(f'{n_bases}/{len(self.conditions)} results of {str(self)} are extended')
+
+    def stitch_points(self, keys):
+        """
+        Return the times from which the results of Conditions ``keys``
+        are recomputed when extending their ``.base_results``,
+        as a dict; ``None`` means the whole period is analyzed.
+        Results before the time do not change:
+        for a primary Block, it is the start of its last range,
+        the only one that can continue with the new observations;
+        for a secondary Block, the time of the Condition it refers to.
+        The earliest time of the Blocks is used.
+        Requires the prepared Block query.
+        """
+        points = {}
+        def point(k, seen):
+            if k in points:
+                return points[k]
+            c = self.conditions[k]
+            p = None
+            if c.base_results is not None and self.has_block_query and k not in seen:
+                times = []
+                for bl in c.blocks.values():
+                    if bl.secondary:
+                        ref = bl.source_view
+                        times.append(point(ref, seen | {k}) if ref in self.conditions else None)
+                    elif bl.get_execute_sql() is None:
+                        times.append(None)
+                    else:
+                        head = ranges_from_results(c.base_results, bl.alias)
+                        times.append(head[-1][0] if head else None)
+                if times and None not in times:
+                    p = min(times)
+            points[k] = p
+            return p
+        for k in keys:
+            point(k, set())
+        return points
+
+    def error_collections(self):
+        """
+        Return the error collections of this collection,
+        its Conditions and their Blocks.
+        """
+        errs = [self.errors]
+        for c in self.conditions.values():
+            errs.append(c.errors)
+            errs.extend(bl.errors for bl in c.blocks.values())
+        return errs
+
+    def errors_snapshot(self):
+        """
+        Return the state of all errors, see ``TsaErrCollection.snapshot``.
+        """
+        return [(errs, errs.snapshot()) for errs in self.error_collections()]
+
+    def restore_errors(self, snapshot):
+        """
+        Forget the errors added after ``.errors_snapshot()``.
+        """
+        for errs, snap in snapshot:
+            errs.restore(snap)
+
+    def check_availability(self, pg_conn):
+        """
+        Check the primary Blocks of the valid Conditions against
+        the days with observations in the analysis period,
+        see ``tsa.availability.Availability``, before querying them.
+        Blocks without any data are marked ``.no_data``,
+        so that their ranges are empty without reading the observations.
+        Conditions whose Blocks all have no data, or refer to Conditions
+        without data, get empty results without the database,
+        and their keys are added to ``.no_data``.
+        Blocks without data and with data on some days only
+        are logged, but not recorded as errors, since they are routine.
+        Without the ``seobs_days`` table, or if it is not up to date,
+        nothing is checked and all the Blocks are queried.
+        """
+        self.no_data = set()
+        keys = [k for k, c in self.conditions.items() if c.is_valid()]
+        blocks = [bl for k in keys for bl in self.conditions[k].blocks.values()
+                  if not bl.secondary]
+        for bl in blocks:
+            bl.no_data = False
+        if not blocks:
+            return
+        availability = Availability.from_db(pg_conn, self.time_from, self.time_until,
+                                            set((bl.station_id, bl.sensor_id) for bl in blocks))
+        if availability is None:
+            return
+        for k in keys:
+            c = self.conditions[k]
+            for bl in c.blocks.values():
+                if bl.secondary:
+                    continue
+                n_days, n_all = availability.days_with_data(bl.station_id, bl.sensor_id,
+                                                            self.time_from, self.time_until)
+                if n_days == 0:
+                    bl.no_data = True
+                    log.info(f'{str(c)}: No data of sensor "{bl.sensor}" at station {bl.station_id} '
+                             f'in the analysis period: Block {bl.alias} is empty')
+                elif n_days < n_all:
+                    log.info(f'{str(c)}: Data of sensor "{bl.sensor}" at station {bl.station_id} '
+                             f'on {n_days}/{n_all} days of the analysis period')
+        # Secondary Conditions may refer to the primary ones and to secondary ones before them
+        order = ([k for k in keys if not self.conditions[k].secondary]
+                 + [k for k in keys if self.conditions[k].secondary])
+        for k in order:
+            c = self.conditions[k]
+            if k in self.restored or c.base_results is not None:
+                continue
+            if all(bl.source_view in self.no_data if bl.secondary else bl.no_data
+                   for bl in c.blocks.values()):
+                c.set_results(IntervalSeries.from_rows(c.get_result_columns(), []))
+                self.no_data.add(k)
+        log.info(f'{repr(availability)}: {len(self.no_data)} conditions of {str(self)} have no data')
+
+    def check_block_runs(self, pg_conn):
+        """
+        Check that the runs of the discrete sensors of the primary Blocks
+        in ``seobs_runs`` are up to date for the analysis period
+        and built with ``MAXMINUTES``, see ``tsa.db.current_block_runs``.
+        Blocks whose runs are not read the observations instead,
+        like the other Blocks, so the results are the same.
+        """
+        blocks = [bl for c in self.conditions.values() if c.is_valid()
+                  for bl in c.blocks.values()
+                  if bl.discrete and not bl.secondary and not bl.no_data]
+        if not blocks:
+            return
+        pairs = set((bl.station_id, bl.sensor_id) for bl in blocks)
+        try:
+            current = current_block_runs(pg_conn, pairs, self.time_from, self.time_until,
+                                         MAXMINUTES)
+            pg_conn.commit()
+        except psycopg2.Error:
+            pg_conn.rollback()
+            log.warning('Cannot check the runs of discrete sensors in seobs_runs, '
+                        'reading the observations instead', exc_info=True)
+            current = set()
+        for pair in sorted(pairs - current):
+            log.warning(f'Runs of sensor {pair[1]} at station {pair[0]} in seobs_runs '
+                        f'are not up to date for {str(self)} or not built with maxminutes '
+                        f'{MAXMINUTES}, reading the observations instead: '
+                        'run populate_seobs_runs() after populating observations')
+        for bl in blocks:
+            if (bl.station_id, bl.sensor_id) not in current:
+                bl.discrete = False
+
+    def coverage(self, pg_conn, period=None):
+        """
+        Return the coverage of the observations of the primary Blocks
+        in the analysis period by station, sensor and ``period``,
+        from the daily summary table, see ``tsa.coverage.coverage``.
+        """
+        pairs = set((bl.station_id, bl.sensor_id) for c in self.conditions.values()
+                    for bl in c.blocks.values()
+                    if not bl.secondary and bl.sensor_id is not None)
+        daily = read_daily(pg_conn, self.time_from, self.time_until,
+                           station_ids=set(p[0] for p in pairs),
+                           sensor_ids=set(p[1] for p in pairs))
+        keep = [p in pairs for p in zip(daily['statid'], daily['seid'])]
+        return summarize(daily[keep], period=period)
+
+    def pending_conditions(self):
+        """
+        Return keys of the valid Conditions not restored from checkpoints.
+        """
+        return [k for k, c in self.conditions.items()
+                if c.is_valid() and k not in self.restored]
+
+    def create_condition_temptables(self, pg_conn, only=None, slicer=None):
         """
         For each Condition, create the corresponding temporary table in db.
         Primary conditions are handled first, only then secondary ones;
         if there are secondary conditions depending further on each other,
         it is up to the user to give them in correct order!
+        If ``only`` is given, temp tables are created only
+        for the Conditions of those keys.
+        Conditions with results of an earlier run in ``.base_results``
+        are extended from their stitch point, see ``.stitch_points``.
+        If ``slicer`` is given, primary Blocks are queried in time slices,
+        see ``tsa.slicing.BlockSlicer``.
         """
+        keys = [k for k, c in self.conditions.items()
+                if c.is_valid() and (only is None or k in only)]
+        # Conditions with results of an earlier run are extended from their stitch point;
+        # a temp table referred to by other Conditions must have the results
+        # from where they are extended, or all if they are computed from the start
+        points = self.stitch_points(keys)
+        keep_from = dict(points)
+        for k in keys:
+            for ref in self.references(k):
+                if ref in keep_from and keep_from[ref] is not None:
+                    if points[k] is None:
+                        keep_from[ref] = None
+                    else:
+                        keep_from[ref] = min(keep_from[ref], points[k])
+        for k in keys:
+            if points[k] is None:
+                self.conditions[k].base_results = None
+
+        def create(cnd):
+            if points[cnd] is None:
+                self.conditions[cnd].create_db_temptable(pg_conn=pg_conn,
+                                                         prepared=self.has_block_query,
+                                                         slicer=slicer)
+            else:
+                self.conditions[cnd].extend_db_temptable(pg_conn=pg_conn,
+                                                         since=points[cnd],
+                                                         keep_from=keep_from[cnd],
+                                                         slicer=slicer)
+
         # First round for primary ones only
         # so temp tables referenced by secondary conditions
         # can be found in the database session
-        for cnd in self.conditions.keys():
-            if self.conditions[cnd].secondary or not self.conditions[cnd].is_valid():
+        self.n_temptables_done = 0
+        for cnd in keys:
+            if self.conditions[cnd].secondary:
                 continue
-            self.conditions[cnd].create_db_temptable(pg_conn=pg_conn)
+            create(cnd)
+            self.n_temptables_done += 1
 
         # Second round for secondary ones,
         # viewnames list is now updated every time
-        for cnd in self.conditions.keys():
-            if not self.conditions[cnd].is_valid():
-                continue
+        for cnd in keys:
             if self.conditions[cnd].secondary:
-                self.conditions[cnd].create_db_temptable(pg_conn=pg_conn)
+                create(cnd)
+                self.n_temptables_done += 1
+        # Invalid and unneeded ones are skipped
+        self.n_temptables_done = len(self.conditions)
 
-    def fetch_all_results(self, pg_conn):
+    def fetch_all_results(self, pg_conn, details_path=None, checkpoint_dir=None, prefetched=None):
         """
         Fetch results
-        for all Conditions that have a corresponding view in the database.
+        for all Conditions that have a corresponding view in the database,
+        except the ones restored from checkpoints.
+        If ``prefetched`` is given, the results have been fetched already,
+        e.g. by ``tsa.async_db.AsyncEvaluator``: it tells by Condition key
+        whether the results were fetched, and the database is not used.
+        If ``details_path`` is provided, result intervals of each Condition
+        are written to that Parquet file as soon as they are fetched,
+        see ``tsa.detail_export.DetailWriter``.
+        If ``checkpoint_dir`` is provided, results are saved there
+        as soon as they are fetched, see ``Condition.save_checkpoint``.
         """
-        cnd_len = len(self.conditions)
-        for i, cnd in enumerate(self.conditions.keys()):
-            log.info(f'Fetching {i+1}/{cnd_len}: {str(self.conditions[cnd])} ...')
+        details = None
+        if details_path is not None:
             try:
-                self.conditions[cnd].fetch_results_from_db(pg_conn=pg_conn)
+                details = DetailWriter(details_path, self.conditions.values())
             except:
-                self.conditions[cnd].errors.add(
-                    msg='Exception while fetching results, skipping',
+                self.errors.add(
+                    msg=f'Cannot open detail file {details_path}, details are not saved',
                     log_add='exception'
                 )
+        try:
+            cnd_len = len(self.conditions)
+            self.n_fetched = 0
+            for i, cnd in enumerate(self.conditions.keys()):
+                if cnd in self.restored:
+                    log.info(f'Using restored results {i+1}/{cnd_len}: {str(self.conditions[cnd])}')
+                    self.n_fetched = i + 1
+                    fetched = False
+                elif cnd in self.no_data:
+                    log.info(f'No data {i+1}/{cnd_len}: {str(self.conditions[cnd])}')
+                    self.n_fetched = i + 1
+                    fetched = True
+                elif prefetched is not None:
+                    log.info(f'Fetched {i+1}/{cnd_len}: {str(self.conditions[cnd])}')
+                    self.n_fetched = i + 1
+                    fetched = prefetched.get(cnd, False)
+                else:
+                    log.info(f'Fetching {i+1}/{cnd_len}: {str(self.conditions[cnd])} ...')
+                    try:
+                        fetched = self.conditions[cnd].fetch_results_from_db(pg_conn=pg_conn)
+                    except:
+                        self.conditions[cnd].errors.add(
+                            msg='Exception while fetching results, skipping',
+                            log_add='exception'
+                        )
+                        continue
+                    finally:
+                        self.n_fetched = i + 1
+                if fetched and checkpoint_dir is not None:
+                    try:
+                        self.conditions[cnd].save_checkpoint(checkpoint_dir, self.definition(cnd))
+                    except:
+                        self.conditions[cnd].errors.add(
+                            msg=f'Cannot save results to {checkpoint_dir}',
+                            log_add='exception'
+                        )
+                if details is not None:
+                    try:
+                        details.write_condition(self.conditions[cnd])
+                    except:
+                        self.conditions[cnd].errors.add(
+                            msg=f'Cannot write result details to {details_path}',
+                            log_add='exception'
+                        )
+        finally:
+            # The file is readable only when closed
+            if details is not None:
+                details.close()
+
+    def summary_rows(self):
+        """
+        Yield summary result values of each condition as tuples
+        in the order of ``SUMMARY_COLUMNS``.
+        """
+        for cnd in self.conditions.values():
+            n_rows = 0 if cnd.results is None else len(cnd.results)
+            yield (cnd.site,
+                   cnd.master_alias,
+                   cnd.condition,
+                   cnd.data_from,
+                   cnd.data_until,
+                   cnd.percentage_valid,
+                   cnd.percentage_notvalid,
+                   cnd.percentage_nodata,
+                   n_rows)
 
     def to_worksheet(self, wb):
         """
         Add a worksheet to an ``openpyxl.Workbook`` instance
         containing summary results of the condition collection.
+
+        Rows are appended in order, so ``wb`` can be
+        a write-only workbook that streams them to disk.
         """
         assert isinstance(wb, xl.Workbook)
-        ws = wb.create_sheet()
-        ws.title = self.title or 'conditions'
-
-        # Headers in fixed cells & styling
-        headers = {'A1': 'start',
-                   'B1': 'end',
-                   'D1': 'analyzed',
-                   'A3': 'site',
-                   'B3': 'master_alias',
-                   'C3': 'condition',
-                   'D3': 'data_from',
-                   'E3': 'data_until',
-                   'F3': 'valid',
-                   'G3': 'notvalid',
-                   'H3': 'nodata',
-                   'I3': 'rows'
-                   }
-        for k, v in headers.items():
-            ws[k] = v
-            ws[k].font = xl.styles.Font(bold=True)
-
-        # Global values
-        ws['A2'] = self.time_from
-        ws['B2'] = self.time_until
-        ws['D2'] = self.created_at
-
-        # Condition rows
-        r = 4
+        ws = wb.create_sheet(title=self.title or 'conditions')
+
+        def cell(value, bold=False, number_format=None):
+            c = WriteOnlyCell(ws, value=value)
+            if bold:
+                c.font = xl.styles.Font(bold=True)
+            if number_format is not None:
+                c.number_format = number_format
+            return c
+
+        # Headers & global values
+        ws.append([cell('start', bold=True), cell('end', bold=True),
+                   None, cell('analyzed', bold=True)])
+        ws.append([self.time_from, self.time_until, None, self.created_at])
+        ws.append([cell(h, bold=True) for h in SUMMARY_COLUMNS[1:]])
+
+        # Condition rows, percentages in columns F:H
+        for row in self.summary_rows():
+            ws.append([cell(v, number_format='0.00 %') if 5 <= i <= 7 else v
+                       for i, v in enumerate(row)])
+
+    def breakdown_rows(self):
+        """
+        Yield the validity of each condition by ``.breakdown`` period
+        as tuples in the order of ``BREAKDOWN_COLUMNS``,
+        see ``Condition.breakdown``.
+        Times are naive UTC, since Excel has no time zones.
+        """
         for cnd in self.conditions.values():
-            ws[f'A{r}'] = cnd.site
-            ws[f'B{r}'] = cnd.master_alias
-            ws[f'C{r}'] = cnd.condition
-            ws[f'D{r}'] = cnd.data_from
-            ws[f'E{r}'] = cnd.data_until
-            ws[f'F{r}'] = cnd.percentage_valid
-            ws[f'G{r}'] = cnd.percentage_notvalid
-            ws[f'H{r}'] = cnd.percentage_nodata
-            ws[f'I{r}'] = cnd.main_df.shape[0]
-
-            # Percent format
-            ws[f'F{r}'].number_format = '0.00 %'
-            ws[f'G{r}'].number_format = '0.00 %'
-            ws[f'H{r}'].number_format = '0.00 %'
-
-            r += 1
+            for t0, t1, valid, notvalid, nodata in cnd.breakdown(self.breakdown):
+                tts = (t1 - t0).total_seconds()
+                times = (valid, notvalid, nodata)
+                yield ((cnd.site,
+                        cnd.master_alias,
+                        period_label(t0, self.breakdown),
+                        t0.tz_localize(None).to_pydatetime(),
+                        t1.tz_localize(None).to_pydatetime())
+                       + tuple(t.total_seconds() / tts if tts else None for t in times)
+                       + tuple(round(t.total_seconds() / 3600, 2) for t in times))
+
+    def to_breakdown_worksheet(self, wb):
+        """
+        Add a worksheet named after the collection and ``.breakdown``
+        to an ``openpyxl.Workbook`` instance, containing the validity
+        of the conditions by period, see ``.breakdown_rows()``.
+        """
+        assert isinstance(wb, xl.Workbook)
+        suffix = f'_{self.breakdown}'
+        ws = wb.create_sheet(title=(self.title or 'conditions')[:31-len(suffix)] + suffix)
+
+        def cell(value, bold=False, number_format=None):
+            c = WriteOnlyCell(ws, value=value)
+            if bold:
+                c.font = xl.styles.Font(bold=True)
+            if number_format is not None:
+                c.number_format = number_format
+            return c
+
+        ws.append([cell(h, bold=True) for h in BREAKDOWN_COLUMNS])
+        # Percentages in columns F:H
+        for row in self.breakdown_rows():
+            ws.append([cell(v, number_format='0.00 %') if 5 <= i <= 7 else v
+                       for i, v in enumerate(row)])
+
+    def append_summary(self, path):
+        """
+        Append summary results of the condition collection
+        to csv file ``path``, with header if the file is new.
+        The file is flushed to disk before returning,
+        so results of analyzed collections survive a crash.
+        """
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'a', newline='', encoding='utf-8') as fobj:
+            writer = csv.writer(fobj)
+            if write_header:
+                writer.writerow(SUMMARY_COLUMNS)
+            for row in self.summary_rows():
+                writer.writerow((self.title,) + row)
+            fobj.flush()
+            os.fsync(fobj.fileno())
 
     def to_pptx(self, pptx_template, png_dir=None):
         """
         Return a ``pptx`` presentation object,
         making a slide of each condition.
 
-        ``pptx`` must be a filepath or file-like object
+        ``pptx_template`` must be a ``tsa.report.ReportTemplate``,
+        or a filepath or file-like object
         representing a PowerPoint file that includes the master
         layout for the TSA report and nothing else. The default
-        placeholder indices must conform with the constants here!
-        """
-        phi = dict(
-        HEADER_IDX = 17,     # Slide header placeholder
-        TITLE_IDX = 0,       # Condition title placeholder
-        BODY_IDX = 13,       # Condition string placeholder
-        TIMERANGE_IDX = 15,  # Placeholder for condition start/end time text
-        VALIDTABLE_IDX = 18, # Validity time/percentage table placeholder
-        ERRORS_IDX = 19,     # Placeholder for errors and warnings
-        MAINPLOT_IDX = 11,   # Main timeline plot placeholder
-        FOOTER_IDX = 16,     # Slide footer placeholder
-        )
-        MAINPLOT_H_PX = 3840 # Main timeline plot height in pixels
-
-        pres = pptx.Presentation(pptx_template)
+        placeholder indices must conform with ``tsa.report.PLACEHOLDERS``!
+        Pass a ``ReportTemplate`` when making multiple reports
+        so that the template is read and validated only once.
+        """
+        if not isinstance(pptx_template, ReportTemplate):
+            pptx_template = ReportTemplate(pptx_template)
+        phi = PLACEHOLDERS
+        pres = pptx_template.new_presentation()
         layout = pres.slide_layouts[0]
+        w, h = pptx_template.plot_size_px
+
+        # Texts shared by all slides
+        header_txt = 'TSA report: '
+        if self.title is not None:
+            header_txt += self.title
+        header_txt += ' ' + self.created_at.strftime('%d.%m.%Y')
+        footer_txt = 'TSATool v0.1, copyright WSP Finland'
+        tb_font_color = RGBColor.from_string('000000')
 
-        # Ensure placeholder indices exist as they should
-        indices_in_pres = [ph.placeholder_format.idx for ph in layout.placeholders]
-        for k, v in phi.items():
-            if v not in indices_in_pres:
-                raise Exception(f'{k} {v} not in default layout placeholders')
+        def set_cell(cell, text):
+            # Text and styling in one go
+            cell.text = text
+            cell.fill.background()
+            for ph in cell.text_frame.paragraphs:
+                ph.font.name = 'Montserrat'
+                ph.font.size = Pt(8)
+                ph.font.color.rgb = tb_font_color
 
         # Add slides and fill in contents for each condition.
         for c in self.conditions.values():
-            s = pres.slides.add_slide(layout)
-
-            # Slide header
-            txt = 'TSA report: '
-            if self.title is not None:
-                txt += self.title
-            txt += ' ' + self.created_at.strftime('%d.%m.%Y')
-            s.placeholders[phi['HEADER_IDX']].text = txt
-
-            # Slide footer
-            txt = 'TSATool v0.1, copyright WSP Finland'
-            s.placeholders[phi['FOOTER_IDX']].text = txt
-
-            # Condition title
-            s.placeholders[phi['TITLE_IDX']].text = c.id_string
-
-            # Condition string / body
-            s.placeholders[phi['BODY_IDX']].text = c.condition
-
-            # Condition data time range
-            if not (c.data_from is None or c.data_until is None):
-                txt = 'Datan tarkasteluväli {}-{}'.format(
-                    c.data_from.strftime('%d.%m.%Y %H:%M'),
-                    c.data_until.strftime('%d.%m.%Y %H:%M')
-                )
-            else:
-                txt = 'Ei dataa saatavilla'
-            s.placeholders[phi['TIMERANGE_IDX']].text = txt
-
-            # Master condition validity table
-            tb_shape = s.placeholders[phi['VALIDTABLE_IDX']].insert_table(rows=3, cols=4)
-            tb = tb_shape.table
-
-            tb.cell(0, 0).text = ''
-
-            tb.cell(0, 1).text = 'Voimassa'
-            tb.cell(0, 2).text = 'Ei voimassa'
-            tb.cell(0, 3).text = 'Tieto puuttuu'
-
-            tb.cell(1, 0).text = 'Yhteensä'
-            txt = strfdelta(c.tottime_valid, '{days} pv {hours} h {minutes} min')
-            tb.cell(1, 1).text = txt
-            txt = strfdelta(c.tottime_notvalid, '{days} pv {hours} h {minutes} min')
-            tb.cell(1, 2).text = txt
-            txt = strfdelta(c.tottime_nodata, '{days} pv {hours} h {minutes} min')
-            tb.cell(1, 3).text = txt
-
-            tb.cell(2, 0).text = 'Osuus tarkasteluajasta'
-            txt = '{} %'.format(round(c.percentage_valid*100, 2))
-            tb.cell(2, 1).text = txt
-            txt = '{} %'.format(round(c.percentage_notvalid*100, 2))
-            tb.cell(2, 2).text = txt
-            txt = '{} %'.format(round(c.percentage_nodata*100, 2))
-            tb.cell(2, 3).text = txt
-
-            for cl in tb.iter_cells():
-                cl.fill.background()
-                for ph in cl.text_frame.paragraphs:
-                    ph.font.name = 'Montserrat'
-                    ph.font.size = Pt(8)
-                    ph.font.color.rgb = RGBColor.from_string('000000')
-
-            for row in tb.rows:
-                row.height = Cm(0.64)
-
-            # Condition errors and warnings
-            txt = c.errors.short_str()
-            s.placeholders[phi['ERRORS_IDX']].text = txt
+            with c.timings.time('slide'):
+                s = pres.slides.add_slide(layout)
+
+                # Slide header and footer
+                s.placeholders[phi['HEADER_IDX']].text = header_txt
+                s.placeholders[phi['FOOTER_IDX']].text = footer_txt
+
+                # Condition title
+                s.placeholders[phi['TITLE_IDX']].text = c.id_string
+
+                # Condition string / body
+                s.placeholders[phi['BODY_IDX']].text = c.condition
+
+                # Condition data time range
+                if not (c.data_from is None or c.data_until is None):
+                    txt = 'Datan tarkasteluväli {}-{}'.format(
+                        c.data_from.strftime('%d.%m.%Y %H:%M'),
+                        c.data_until.strftime('%d.%m.%Y %H:%M')
+                    )
+                else:
+                    txt = 'Ei dataa saatavilla'
+                s.placeholders[phi['TIMERANGE_IDX']].text = txt
+
+                # Master condition validity table,
+                # followed by the shares of each period if they fit on the slide
+                tottimes = (c.tottime_valid, c.tottime_notvalid, c.tottime_nodata)
+                percentages = (c.percentage_valid, c.percentage_notvalid, c.percentage_nodata)
+                cell_texts = [
+                    ['', 'Voimassa', 'Ei voimassa', 'Tieto puuttuu'],
+                    ['Yhteensä'] + [strfdelta(t, '{days} pv {hours} h {minutes} min')
+                                    for t in tottimes],
+                    ['Osuus tarkasteluajasta'] + ['{} %'.format(round(p*100, 2))
+                                                  for p in percentages]
+                ]
+                periods = c.breakdown(self.breakdown) if self.breakdown is not None else []
+                if len(periods) <= SLIDE_MAX_PERIODS:
+                    for t0, t1, *times in periods:
+                        tts = (t1 - t0).total_seconds()
+                        cell_texts.append([period_label(t0, self.breakdown)]
+                                          + ['{} %'.format(round(t.total_seconds() / tts * 100, 2))
+                                             if tts else '' for t in times])
+                tb_shape = s.placeholders[phi['VALIDTABLE_IDX']].insert_table(
+                    rows=len(cell_texts), cols=4)
+                tb = tb_shape.table
+                for i, row in enumerate(tb.rows):
+                    row.height = Cm(0.64) if i < 3 else Cm(0.45)
+                    for j, txt in enumerate(cell_texts[i]):
+                        set_cell(tb.cell(i, j), txt)
+
+                # Condition errors and warnings
+                txt = c.errors.short_str()
+                s.placeholders[phi['ERRORS_IDX']].text = txt
 
             # Condition main timeline plot; ignored if no data to viz
-            if c.main_df is None:
+            if c.results is None:
                 continue
-            # Find out the proportion of plot height of the width
-            wh_factor = s.placeholders[phi['MAINPLOT_IDX']].height \
-                        / s.placeholders[phi['MAINPLOT_IDX']].width
-            w, h = MAINPLOT_H_PX, wh_factor*MAINPLOT_H_PX
 
             # NOTE: Saving png as in-memory object does not work
             #       for some reason.
             #       Saving it to file instead and keeping the file
             #       if png_dir is provided.
-            # with BytesIO() as fobj:
-            #     c.save_timelineplot(fobj, w, h)
-            #     s.placeholders[phi['MAINPLOT_IDX']].insert_picture(fobj)
+            #       Temporary files are uniquely named,
+            #       since reports may be made in parallel.
+            if png_dir is not None and not os.path.exists(png_dir):
+                self.errors.add(
+                    msg=f'Directory "{png_dir}" for images does not exist, not saving png files',
+                    log_add='warning'
+                )
+                png_dir = None
             if png_dir is None:
-                fobj = 'temp.png'
+                fd, fobj = tempfile.mkstemp(suffix='.png')
+                os.close(fd)
                 rm_png = True
             else:
-                if not os.path.exists(png_dir):
-                    self.errors.add(
-                        msg=f'Directory "{png_dir}" for images does not exist, not saving png files',
-                        log_add='warning'
-                    )
-                    fobj = 'temp.png'
-                    rm_png = True
-                else:
-                    fobj = os.path.join(png_dir, f'{self.title}_{c.id_string}.png')
-                    rm_png = False
-            saved = c.save_timelineplot(fobj, w, h)
-            if saved:
-                s.placeholders[phi['MAINPLOT_IDX']].insert_picture(fobj)
+                fobj = os.path.join(png_dir, f'{self.title}_{c.id_string}.png')
+                rm_png = False
+            try:
+                with c.timings.time('plot'):
+                    saved = c.save_timelineplot(fobj, w, h)
+                    if saved:
+                        s.placeholders[phi['MAINPLOT_IDX']].insert_picture(fobj)
+            finally:
                 if rm_png:
                     os.remove(fobj)
 
         return pres
 
-    def save_pptx(self, pptx_template, out_path, png_dir=None):
+    def report_parts(self, out_path, max_slides=None):
         """
-        Call ``.to_pptx`` and save result to file.
+        Return a list of ``(path, collection)`` pairs
+        where the conditions are split into decks of at most
+        ``max_slides`` slides, see ``tsa.report.deck_paths``.
+        The collections are shallow copies sharing the Conditions.
         """
-        pptx_obj = self.to_pptx(pptx_template=pptx_template, png_dir=png_dir)
-        pptx_obj.save(out_path)
+        paths = deck_paths(out_path, len(self.conditions), max_slides)
+        items = list(self.conditions.items())
+        size = max_slides or len(items)
+        parts = []
+        for i, path in enumerate(paths):
+            part = copy.copy(self)
+            part.conditions = OrderedDict(items[i*size:(i+1)*size])
+            parts.append((path, part))
+        return parts
+
+    def save_pptx(self, pptx_template, out_path, png_dir=None, max_slides=None):
+        """
+        Call ``.to_pptx`` and save result to file,
+        or to multiple numbered files if there are more conditions
+        than ``max_slides``.
+
+        :return: list of saved file paths
+        """
+        paths = []
+        for path, part in self.report_parts(out_path, max_slides):
+            pptx_obj = part.to_pptx(pptx_template=pptx_template, png_dir=png_dir)
+            with self.timings.time('save_pptx'):
+                pptx_obj.save(path)
+            paths.append(path)
+        return paths
+
+    def submit_pptx(self, executor, pptx_template, out_path, png_dir=None, max_slides=None):
+        """
+        Like ``.save_pptx``, but make the reports in ``executor``
+        (e.g. ``concurrent.futures.ProcessPoolExecutor``),
+        one task per file.
+        Errors and timings of the tasks must be merged back
+        with ``.merge_report`` once they are done.
+
+        :return: list of ``(path, future)`` pairs
+        """
+        if not isinstance(pptx_template, ReportTemplate):
+            pptx_template = ReportTemplate(pptx_template)
+        return [(path, executor.submit(render_deck, part, pptx_template, path, png_dir))
+                for path, part in self.report_parts(out_path, max_slides)]
+
+    def merge_report(self, path, future):
+        """
+        Wait for a report task made by ``.submit_pptx``
+        and add the errors and timings recorded in it
+        to this collection and its conditions.
+
+        :return: ``True`` if the report was saved
+        """
+        try:
+            coll_errors, coll_timings, cond_results = future.result()
+        except:
+            self.errors.add(
+                msg=f'Could not save Powerpoint report {path}',
+                log_add='exception'
+            )
+            return False
+        self.errors.extend(coll_errors)
+        self.timings.extend(coll_timings)
+        for k, (errs, timings) in cond_results.items():
+            self.conditions[k].errors.extend(errs)
+            self.conditions[k].timings.extend(timings)
+        return True
+
+    def statements(self):
+        """
+        Timings of the database statements of all Conditions.
+        """
+        return [t for c in self.conditions.values() for t in c.timings.statements()]
+
+    def explain_slowest(self, pg_conn, n, min_seconds=0.0):
+        """
+        Capture the query plans of the ``n`` slowest statements
+        of the Conditions that took longer than ``min_seconds``,
+        see ``tsa.profiling.TsaTiming.explain``.
+        The statements are run again, so the Condition temp tables
+        and ``obs_main`` must still exist in the session of ``pg_conn``.
+        """
+        for t in slowest(self.statements(), n):
+            if t.seconds <= min_seconds:
+                break
+            log.info(f'Explaining {str(t)} ...')
+            try:
+                t.explain(pg_conn)
+            except:
+                self.errors.add(
+                    msg=f'Could not explain {t.stage} statement of {t.context}',
+                    log_add='exception'
+                )
 
     def run_analysis(self,
                      pg_conn,
                      wb=None,
-                     wb_path=None,
+                     summary_path=None,
+                     details_path=None,
                      pptx_path=None,
                      pptx_template=None,
-                     png_dir=None):
+                     png_dir=None,
+                     report_executor=None,
+                     max_slides=None,
+                     explain_slowest=0,
+                     explain_above=0.0,
+                     checkpoint_dir=None,
+                     block_slicer=None,
+                     async_evaluator=None,
+                     snapshot_evaluator=None):
         """
         Call necessary methods to run the condition analysis
         and save results to the specified
         ``openpyxl.Workbook`` instance ``wb`` as new worksheet
-        and the ``pptx_path`` as ``.pptx`` file.
-        If ``wb_path`` is provided, save the workbook in the end
-        (will overwrite existing files).
-        If an output is ``None``, it is not created.
+        and the ``pptx_path`` as ``.pptx`` file,
+        i.e. ``.analyze()`` and then ``.save_outputs()``.
+        See them for the arguments.
+
+        :return: ``(path, future)`` pairs of Powerpoint reports in progress,
+            see ``.save_outputs()``
+        """
+        self.analyze(pg_conn=pg_conn,
+                     details_path=details_path,
+                     explain_slowest=explain_slowest,
+                     explain_above=explain_above,
+                     checkpoint_dir=checkpoint_dir,
+                     block_slicer=block_slicer,
+                     async_evaluator=async_evaluator,
+                     snapshot_evaluator=snapshot_evaluator)
+        return self.save_outputs(wb=wb,
+                                 summary_path=summary_path,
+                                 pptx_path=pptx_path,
+                                 pptx_template=pptx_template,
+                                 png_dir=png_dir,
+                                 report_executor=report_executor,
+                                 max_slides=max_slides)
+
+    def analyze(self,
+                pg_conn,
+                details_path=None,
+                explain_slowest=0,
+                explain_above=0.0,
+                checkpoint_dir=None,
+                block_slicer=None,
+                async_evaluator=None,
+                snapshot_evaluator=None):
+        """
+        Run the database part of the analysis in the session of ``pg_conn``:
+        create the Condition temp tables and fetch their results.
+        If ``details_path`` is provided, result intervals
+        are saved to that Parquet file.
+
+        Time spent in each stage is recorded in ``.timings``
+        and in the Conditions' ``.timings``.
+        Query plans are captured for the ``explain_slowest`` slowest
+        database statements taking longer than ``explain_above`` seconds.
+
+        Results of the Conditions are saved to ``checkpoint_dir``
+        as soon as they are fetched, if provided.
+        Results restored earlier with ``.load_checkpoints()``
+        are not analyzed again; if all of them were restored,
+        the database is not used and ``pg_conn`` may be ``None``.
+
+        If ``block_slicer`` is given, primary Blocks are queried
+        in time slices concurrently, see ``tsa.slicing.BlockSlicer``.
+        If ``async_evaluator`` is given, the Conditions are analyzed
+        with concurrent queries on connections of its own instead,
+        see ``tsa.async_db.AsyncEvaluator``, unless results of an earlier
+        run are extended.
+        If ``snapshot_evaluator`` is given, the Conditions are analyzed
+        in parallel on a snapshot exported from the session of ``pg_conn``
+        instead, see ``tsa.snapshot.SnapshotEvaluator``, with the same exception.
         """
         log.info(f'Starting analysis of {str(self)}')
-        self.setup_obs_view(pg_conn=pg_conn)
-        log.info('obs_main db view created')
-        # FIXME: Station id validation agains unique values in db view
-        #        is not done, because the SELECT DISTINCT query is very
-        #        slow for some reason.
-        #        This step is not mandatory, though.
-        #        If a station id is missing, the result should be just
-        #        an empty table and / or a database error for that condition.
-        # self.validate_statids_with_db(pg_conn=pg_conn)
-        # log.debug('Station ids validated')
-        self.create_condition_temptables(pg_conn=pg_conn)
-        log.info('Temp tables created for conditions')
+        analysis_starttime = datetime.now()
+        pending = self.pending_conditions()
+        if pending:
+            # Conditions certainly without data need no queries
+            with self.timings.time('availability'):
+                self.check_availability(pg_conn)
+            pending = [k for k in pending if k not in self.no_data]
+            with self.timings.time('runs'):
+                self.check_block_runs(pg_conn)
+        prefetched = None
+        # Extending earlier results needs the collection's own session
+        extending = any(self.conditions[k].base_results is not None for k in pending)
+        if pending and snapshot_evaluator is not None and not extending:
+            log.info(f'Analyzing {len(pending)} conditions in parallel on a shared snapshot')
+            prefetched = snapshot_evaluator.run(self, pending, pg_conn=pg_conn)
+        elif pending and async_evaluator is not None and not extending:
+            log.info(f'Analyzing {len(pending)} conditions with concurrent queries')
+            self.n_temptables_done = 0
+            prefetched = async_evaluator.run(self, pending)
+            self.n_temptables_done = len(self.conditions)
+        elif pending:
+            with self.timings.time('obs_view'):
+                self.setup_obs_view(pg_conn=pg_conn)
+            log.info('obs_main db view created')
+            # FIXME: Station id validation agains unique values in db view
+            #        is not done, because the SELECT DISTINCT query is very
+            #        slow for some reason.
+            #        This step is not mandatory, though.
+            #        If a station id is missing, the result should be just
+            #        an empty table and / or a database error for that condition.
+            # self.validate_statids_with_db(pg_conn=pg_conn)
+            # log.debug('Station ids validated')
+            # Restored Conditions are needed only if pending ones refer to them
+            self.create_condition_temptables(pg_conn=pg_conn,
+                                             only=self.required_conditions(pending),
+                                             slicer=block_slicer)
+            log.info('Temp tables created for conditions')
+        else:
+            log.info(f'All results of {str(self)} restored from checkpoints or without data, '
+                     'database is not used')
+            self.n_temptables_done = len(self.conditions)
 
         log.info('Starting to fetch results from database ...')
         starttime = datetime.now()
-        self.fetch_all_results(pg_conn=pg_conn)
+        self.fetch_all_results(pg_conn=pg_conn,
+                               details_path=details_path,
+                               checkpoint_dir=checkpoint_dir,
+                               prefetched=prefetched)
         log.info(f'Results fetched in {str(datetime.now() - starttime)}')
 
+        # Statements run concurrently are not timed individually
+        if explain_slowest and pending and prefetched is None:
+            with self.timings.time('explain'):
+                self.explain_slowest(pg_conn=pg_conn,
+                                     n=explain_slowest,
+                                     min_seconds=explain_above)
+
+        self.analysis_seconds = (datetime.now() - analysis_starttime).total_seconds()
+
+    def save_outputs(self,
+                     wb=None,
+                     summary_path=None,
+                     pptx_path=None,
+                     pptx_template=None,
+                     png_dir=None,
+                     report_executor=None,
+                     max_slides=None):
+        """
+        Save the results fetched by ``.analyze()`` to the specified
+        ``openpyxl.Workbook`` instance ``wb`` as new worksheet
+        and the ``pptx_path`` as ``.pptx`` file.
+        The workbook is not saved here: it is meant to be
+        a write-only workbook saved once after all collections.
+        If ``summary_path`` is provided, summary results are
+        appended to that csv file right away.
+        If an output is ``None``, it is not created.
+
+        If ``report_executor`` is provided, Powerpoint reports
+        are made in it and this method returns without waiting for them:
+        the returned ``(path, future)`` pairs must be passed to
+        ``.merge_report``. Otherwise an empty list is returned.
+        Reports are split into files of at most ``max_slides`` slides.
+        """
+        starttime = datetime.now()
         if wb is not None:
             log.info('Creating Excel sheet ...')
-            self.to_worksheet(wb)
-            if wb_path is not None:
-                wb.save(wb_path)
-                log.info(f'Excel sheet saved to {wb_path}')
+            with self.timings.time('worksheet'):
+                self.to_worksheet(wb)
+                if self.breakdown is not None:
+                    self.to_breakdown_worksheet(wb)
         else:
             log.warning(f'No Excel sheet saved from {str(self)}')
 
-        if pptx_path is not None and pptx_template is not None:
-            log.info(f'Saving Powerpoint report as {pptx_path} ...')
-            self.save_pptx(pptx_template=pptx_template,
-                           out_path=pptx_path,
-                           png_dir=png_dir)
-            log.info(f'{pptx_path} saved')
-        else:
+        if summary_path is not None:
+            with self.timings.time('summary'):
+                self.append_summary(summary_path)
+            log.info(f'Summary results appended to {summary_path}')
+
+        reports = []
+        if pptx_path is None or pptx_template is None:
             log.warning(f'No Powerpoint report saved from {str(self)}')
+        elif report_executor is not None:
+            log.info(f'Submitting Powerpoint report {pptx_path} ...')
+            reports = self.submit_pptx(executor=report_executor,
+                                       pptx_template=pptx_template,
+                                       out_path=pptx_path,
+                                       png_dir=png_dir,
+                                       max_slides=max_slides)
+        else:
+            log.info(f'Saving Powerpoint report as {pptx_path} ...')
+            paths = self.save_pptx(pptx_template=pptx_template,
+                                   out_path=pptx_path,
+                                   png_dir=png_dir,
+                                   max_slides=max_slides)
+            log.info(f'{", ".join(paths)} saved')
+        # Reports made in worker processes are not included
+        self.analysis_seconds = ((self.analysis_seconds or 0.0)
+                                 + (datetime.now() - starttime).total_seconds())
+        return reports
 
     def __getitem__(self, key):
         """
@@ -479,39 +1281,44 @@ class CondCollection:
                   Any columns outside A:C are ignored,
                   so additional data can be placed outside them.
         """
-        # Start and end dates must be d.m.Y dates, start in cell A2
-        # and end in cell B2.
-        dateformat = '%d.%m.%Y'
-        time_from, time_until = ws['A2'].value, ws['B2'].value
-        if time_from is None:
-            raise Exception('Start date in cell A2 is empty')
-        if not isinstance(time_from, datetime):
-            try:
-                time_from = datetime.strptime(time_from, dateformat)
-            except:
-                raise Exception('Cannot parse start date in cell A2')
-        if time_until is None:
-            raise Exception('End date in cell B2 is empty')
-        if not isinstance(time_until, datetime):
-            try:
-                time_until = datetime.strptime(time_until, dateformat)
-            except:
-                raise Exception('Cannot parse end date in cell B2')
+        # Read cell values in bulk, row by row
+        rows = ws.iter_rows(min_row=4, max_col=3, values_only=True)
+        return cls.from_rows(title=ws.title,
+                             time_from=ws['A2'].value,
+                             time_until=ws['B2'].value,
+                             rows=enumerate(rows, start=4))
+
+    @classmethod
+    def from_rows(cls, title, time_from, time_until, rows, names=XLSX_NAMES):
+        """
+        Create a condition collection for analysis
+        from values read from any input source.
+
+        :param time_from: start date as datetime or d.m.Y string
+        :param time_until: end date as datetime or d.m.Y string
+        :param rows: iterable of ``(row number, (site, master_alias, raw_condition))``
+        :param names: descriptions of value locations for error messages,
+            see ``XLSX_NAMES``
+        """
+        start, end = names['start'], names['end']
+        time_from = parse_date(time_from, f'Start date in {start}')
+        time_until = parse_date(time_until, f'End date in {end}')
         if time_from > time_until:
-            raise Exception('Start date in cell A2 must not be greater than end date in cell B2')
+            raise Exception(f'Start date in {start} must not be greater than end date in {end}')
 
-        cc = cls(time_from=time_from, time_until=time_until, title=ws.title)
-        for row in ws.iter_rows(min_row=4, max_col=3):
-            cells = [c for c in row]
+        cc = cls(time_from=time_from, time_until=time_until, title=title)
+        for row_nr, values in rows:
+            values = tuple(values)
             cells_ok = True
-            for c in cells:
-                if c.value is None:
-                    cc.errors.add(f'Cell {c.coordinate} is empty: condition row ignored')
+            for col, v in zip(names['columns'], values):
+                if v is None:
+                    cell = names['cell'].format(col=col, row=row_nr)
+                    cc.errors.add(f'{cell} is empty: condition row ignored')
                     cells_ok = False
             # Row is ignored if any of the three cells is empty
             if not cells_ok:
                 continue
-            cc.add_condition(site=cells[0].value, master_alias=cells[1].value,
-                             raw_condition=cells[2].value, excel_row=cells[0].row)
+            cc.add_condition(site=values[0], master_alias=values[1],
+                             raw_condition=values[2], excel_row=row_nr)
 
         return cc
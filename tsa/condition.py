@@ -3,20 +3,36 @@
 
 # Condition class, called by CondCollection
 
+import json
 import logging
-import re
+import os
 import pandas
 import psycopg2
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from .block import Block
+from .condition_parser import tokenize
+from .condition_parser import parse
+from .condition_parser import ParseError
 from .error import TsaErrCollection
+from .intervals import IntervalSeries
+from .intervals import TRUE
+from .intervals import FALSE
+from .intervals import to_epoch_us
+from .periods import period_bounds
+from .profiling import TsaTimings
+from .ranges import ranges_from_results
+from .ranges import join_ranges
 from .utils import to_pg_identifier
 from .utils import eliminate_umlauts
 from .utils import trunc_str
+from .utils import write_atomic
 from matplotlib import rcParams
+from datetime import datetime
 from datetime import timedelta
 from collections import OrderedDict
+from collections import namedtuple
+from functools import lru_cache
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +40,115 @@ log = logging.getLogger(__name__)
 rcParams['font.family'] = 'sans-serif'
 rcParams['font.sans-serif'] = ['Arial', 'Tahoma']
 
+# Max number of parsed condition strings kept in memory
+PARSE_CACHE_SIZE = 4096
+
+class ParsedCondition(namedtuple('ParsedCondition',
+    ['expr', 'alias_condition', 'blocks', 'secondary', 'is_valid', 'errors'])):
+    """
+    Immutable result of parsing a condition string, see ``parse_condition()``.
+    ``blocks`` is a tuple of alias - Block pairs; the Blocks are prototypes
+    that must be copied before use. ``errors`` is a tuple of TsaErrors
+    recorded but not logged while parsing.
+    """
+    __slots__ = ()
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_condition(site, master_alias, condition):
+    """
+    Extract Blocks (that is, subconditions) from ``condition``,
+    parse it into a syntax tree whose leaves refer to the Blocks,
+    define the alias condition based on the syntax tree
+    and detect condition type (secondary if any of the blocks is
+    secondary).
+
+    Results are memoized by the arguments, so the same condition rows
+    on multiple sheets are parsed only once; ``condition`` should therefore
+    be given with whitespaces normalized.
+    See :py:mod:``tsa.condition_parser`` for the grammar.
+
+    :return: ``ParsedCondition``
+    """
+    is_valid = True
+    errors = TsaErrCollection('PARSER', silent=True)
+    tokens = tokenize(condition)
+
+    # Make a Block of each unique logic element in the order they appear.
+    # If a block with same contents already exists,
+    # the element refers to the existing block with its order number.
+    blocks = OrderedDict()
+    aliases = dict()
+    for tok in tokens:
+        if tok.kind != 'logic' or tok.text in aliases:
+            continue
+        try:
+            bl = Block(master_alias=master_alias,
+                parent_site=site,
+                order_nr=len(blocks),
+                raw_logic=tok.text,
+                silent=True)
+            blocks[bl.alias] = bl
+            aliases[tok.text] = bl.alias
+        except:
+            errors.add(
+                msg=f'Cannot create Block from "{tok.text}"',
+                log_add='exception'
+            )
+            is_valid = False
+
+    # Check the syntax: parsing stops at the first illegal element
+    expr = None
+    alias_condition = ''
+    try:
+        expr = parse(tokens, source=condition, aliases=aliases)
+        alias_condition = expr.to_sql()
+    except ParseError as e:
+        errors.add(
+            msg=str(e),
+            log_add='error'
+        )
+        is_valid = False
+
+    # Also check if all Blocks are marked valid
+    is_valid = is_valid and all(bl.secondary is not None for bl in blocks.values())
+
+    if len(blocks) == 0:
+        errors.add(
+            msg='No Blocks were created',
+            log_add='warning'
+        )
+        is_valid = False
+
+    if not is_valid:
+        errors.add(
+            msg=('There were errors with this condition '
+                 'and it will not be analyzed'),
+            log_add='warning'
+        )
+
+    return ParsedCondition(
+        expr=expr,
+        alias_condition=alias_condition,
+        blocks=tuple(blocks.items()),
+        secondary=any(bl.secondary for bl in blocks.values()),
+        is_valid=is_valid,
+        errors=tuple(errors.errors)
+    )
+
+def create_ranges_table(cur, alias, ranges):
+    """
+    Create temp table ``alias`` like ``Block.get_create_sql()`` does,
+    of ranges given as ``(lower, upper, value)`` tuples,
+    using cursor ``cur``.
+    """
+    cur.execute(f"CREATE TEMP TABLE {alias} "
+                f"(valid_r tstzrange, {alias} boolean) ON COMMIT DROP;")
+    cur.execute(f"INSERT INTO {alias} "
+                "SELECT tstzrange(vfrom, vuntil), value "
+                "FROM unnest(%s::timestamptz[], %s::timestamptz[], %s::boolean[]) "
+                "AS r(vfrom, vuntil, value);",
+                ([r[0] for r in ranges], [r[1] for r in ranges], [r[2] for r in ranges]))
+
 class Condition:
     """
     Logical combination of Blocks.
@@ -60,16 +185,23 @@ class Condition:
         self.excel_row = excel_row
 
         self.errors = TsaErrCollection(str(self))
+        # Time spent in database queries and reporting, see tsa.profiling
+        self.timings = TsaTimings(self.id_string)
 
         # Following attrs will be set by .make_blocks method
         self.blocks = OrderedDict()
+        self.expr = None
         self.alias_condition = ''
         self.secondary = None
         self.blocks_made = False
         self.make_blocks()
 
-        # pandas DataFrames for results
-        self.main_df = pandas.DataFrame()
+        # Result intervals, see .main_df for a DataFrame
+        self.results = IntervalSeries()
+        # Results of an earlier run over a shorter period,
+        # and the time from which they are recomputed, see .extend_db_temptable()
+        self.base_results = None
+        self.stitch_at = None
 
         # Total time will be set to represent
         # actual min and max timestamps of the data
@@ -81,229 +213,37 @@ class Condition:
         self.percentage_notvalid = 0
         self.percentage_nodata = 1
 
-    def validate_order(self, tuples):
-        """
-        Validate order of the elements of a :py:class:``Block``.
-
-        :param tuples: list of tuples, each of which has
-            ``open_par`, ``close_par``, ``andor``, ``not`` or ``block``
-            in the first index and the string element itself in the second.
-        :type tuples: list or tuple
-        :return: ``False`` if there were erroneous elements, ``True`` otherwise
-
-        Following element types may be in the first index:
-            ``open_par``, ``not``, ``block``
-
-        Following elements may be in the last index:
-            ``close_par``, ``block``
-
-        For elements other than the last one, see the table below
-        to see what element can follow each element.
-        Take the first element from left and the next element from top.
-
-        +-------------+------------+-------------+---------+-------+---------+
-        |             | `open_par` | `close_par` | `andor` | `not` | `block` |
-        +=============+============+=============+=========+=======+=========+
-        | `open_par`  | OK         | X           | X       | OK    | OK      |
-        +-------------+------------+-------------+---------+-------+---------+
-        | `close_par` | X          | OK          | OK      | X     | X       |
-        +-------------+------------+-------------+---------+-------+---------+
-        | `andor`     | OK         | X           | X       | OK    | OK      |
-        +-------------+------------+-------------+---------+-------+---------+
-        | `not`       | OK         | X           | X       | X     | OK      |
-        +-------------+------------+-------------+---------+-------+---------+
-        | `block`     | X          | OK          | OK      | X     | X       |
-        +-------------+------------+-------------+---------+-------+---------+
-        """
-        success = True
-        allowed_first = ('open_par', 'not', 'block')
-        allowed_pairs = (
-        ('open_par', 'open_par'), ('open_par', 'not'), ('open_par', 'block'),
-        ('close_par', 'close_par'), ('close_par', 'andor'),
-        ('andor', 'open_par'), ('andor', 'not'), ('andor', 'block'),
-        ('not', 'open_par'), ('not', 'block'),
-        ('block', 'close_par'), ('block', 'andor')
-        )
-        allowed_last = ('close_par', 'block')
-        last_i = len(tuples) - 1
-
-        for i, el in enumerate(tuples):
-            if i == 0:
-                if el[0] not in allowed_first:
-                    self.errors.add(
-                        msg=f'"{el[1]}" cannot be first element in condition',
-                        log_add='error'
-                    )
-                    success = False
-            elif i == last_i:
-                if el[0] not in allowed_last:
-                    self.errors.add(
-                        msg=f'"{el[1]}" cannot be last element in condition',
-                        log_add='error'
-                    )
-                    success = False
-            if i < last_i:
-                if (el[0], tuples[i+1][0]) not in allowed_pairs:
-                    self.errors.add(
-                        msg=f'Illegal combination in condition: "{el[1]}" before "{tuples[i+1][1]}" ',
-                        log_add='error'
-                    )
-                    success = False
-
-        return success
-
     def make_blocks(self):
         """
-        Extract a list of Block instances (that is, subconditions)
-        into ``self.blocks`` based on ``self.condition``,
-        define ``self.alias_condition`` based on the aliases of the Block instances
-        and detect condition type (``secondary == True`` if any of the blocks has
-        ``secondary == True``, ``False`` otherwise).
+        Set Block instances (that is, subconditions) into ``self.blocks``,
+        syntax tree ``self.expr``, ``self.alias_condition``,
+        condition type and validity
+        from the parsed ``self.condition``, see ``parse_condition()``.
+        The Blocks are copies owned by this Condition,
+        and parsing errors are added to the errors of this Condition.
         """
-        is_valid = True
-        value = self.condition
-
-        # Generally, opening and closing bracket counts must match
-        n_open = value.count('(')
-        n_close = value.count(')')
-        if n_open != n_close:
-            self.errors.add(
-                msg=f'Unequal of "(" ({n_open}) and ")" ({n_close}) in condition',
-                log_add='error'
-            )
-            is_valid = False
-
-        # Eliminate multiple whitespaces
-        # and leading and trailing whitespaces
-        value = ' '.join(value.split()).strip()
-
-        # Split by
-        # - parentheses
-        # - and, or, not: must be surrounded by spaces
-        # - not: starting the string and followed by space.
-        # Then strip results from trailing and leading whitespaces
-        # and remove empty elements.
-        sp = re.split(
-        '([()]|(?<=\s)and(?=\s)|(?<=\s)or(?=\s)|(?<=\s)not(?=\s)|^not(?=\s))', value)
-        sp = [el.strip() for el in sp]
-        sp = [el for el in sp if el]
-
-        # Handle special case of parentheses after "in":
-        # they are part of the logic element.
-        # Block() will detect in the next step
-        # if the tuple after "in" is not correctly enclosed by ")".
-        new_sp = []
-        for el in sp:
-            if not new_sp:
-                new_sp.append(el)
-                continue
-            if len(new_sp[-1]) > 3 and new_sp[-1][-3:] == ' in':
-                new_sp[-1] = new_sp[-1] + ' ' + el
-            elif ' in ' in new_sp[-1] and new_sp[-1][-1] != ')':
-                new_sp[-1] = new_sp[-1] + el
-            else:
-                new_sp.append(el)
-
-        # Identify the "role" of each element by making them into
-        # tuples like (role, element).
-        # First, mark parentheses and and-or-not operators.
-        # The rest should convert to logic blocks;
-        # Block() raises error if this does not succeed.
-        idfied = []
-        i = 0
-        tokens = {'(': 'open_par',
-                  ')': 'close_par',
-                  'and': 'andor',
-                  'or': 'andor',
-                  'not': 'not'}
-        for el in new_sp:
-            if el in tokens.keys():
-                idfied.append( (tokens[el], el) )
-            else:
-                try:
-                    bl = Block(master_alias=self.master_alias,
-                        parent_site=self.site,
-                        order_nr=i,
-                        raw_logic=el)
-                    # If a block with same contents already exists,
-                    # do not add a new one with another order number i,
-                    # but add the existing block with its order number.
-                    # The .index() method raises an error in case the tuple with
-                    # Block element is NOT contained in the list.
-                    existing_blocks = [t for t in idfied if t[0] == 'block']
-                    for eb in existing_blocks:
-                        if eb[1].raw_logic == bl.raw_logic:
-                            idfied.append(eb)
-                            break
-                    else:
-                        idfied.append(('block', bl))
-                        i += 1
-                except:
-                    self.errors.add(
-                        msg=f'Cannot create Block from "{el}"',
-                        log_add='exception'
-                    )
-                    is_valid = False
-
-        # Check the correct order of the tuples.
-        # This should raise and error and thus exit the method
-        # if there is an illegal combination of elements next to each other.
-        is_valid = is_valid and self.validate_order(idfied)
-
-        # Also check if all Blocks are marked valid
-        is_valid = is_valid and all(el[1].secondary is not None for el in idfied if el[0] == 'block')
-
-        # If validation was successful, attributes can be set
-
-        # Pick up all unique blocks in the order they appear
-        blocks = OrderedDict()
-        for el in idfied:
-            if el[0] == 'block' and el[1].alias not in blocks.keys():
-                blocks[el[1].alias] = el[1]
-        self.blocks = blocks
-        if len(self.blocks) == 0:
-            self.errors.add(
-                msg='No Blocks were created',
-                log_add='warning'
-            )
-            is_valid = False
-
-        # Form the alias condition by constructing the parts back
-        # from the "identified" parts, but for blocks, this time
-        # use their alias instead of the raw condition string.
-        # Whitespaces must be added a bit differently for each type.
-        alias_parts = []
-        for el in idfied:
-            if el[0] == 'andor':
-                alias_parts.append(f' {el[1]} ')
-            elif el[0] == 'not':
-                alias_parts.append(f'{el[1]} ')
-            elif el[0] in ('open_par', 'close_par'):
-                alias_parts.append(el[1])
-            elif el[0] == 'block':
-                alias_parts.append(el[1].alias)
-        self.alias_condition = ''.join(alias_parts)
-
-        # If any of the blocks is secondary,
-        # then the whole condition is considered secondary.
-        self.secondary = False
-        for bl in self.blocks.values():
-            if bl.secondary:
-                self.secondary = True
-                break
+        parsed = parse_condition(self.site, self.master_alias,
+                                 ' '.join(self.condition.split()))
+        self.blocks = OrderedDict((k, bl.copy()) for k, bl in parsed.blocks)
+        self.expr = parsed.expr
+        self.alias_condition = parsed.alias_condition
+        self.secondary = parsed.secondary
+        self.errors.extend(parsed.errors)
 
         # Finally, inform the object if the condition is valid
         # and further analysis is thus possible
-        self.blocks_made = is_valid
-        if not is_valid:
-            self.errors.add(
-                msg=('There were errors with this condition '
-                     'and it will not be analyzed'),
-                log_add='warning'
-            )
-        else:
+        self.blocks_made = parsed.is_valid
+        if self.blocks_made:
             log.debug(f'{str(self)} parsed successfully')
 
+    @property
+    def main_df(self):
+        """
+        Result intervals as a new pandas DataFrame,
+        see ``tsa.intervals.IntervalSeries.to_frame``.
+        """
+        return self.results.to_frame()
+
     def get_station_ids_in_blocks(self):
         """
         Return unique station ids contained by primary Blocks
@@ -314,67 +254,39 @@ class Condition:
                 stids.add(bl.station_id)
         return stids
 
-    def create_db_temptable(self, pg_conn=None):
+    def get_select_sql(self):
         """
-        Create temporary table corresponding to the condition.
-        If ``pg_conn`` is ``None``, no database queries are executed;
-        if ``verbose`` is ``True``, whole SQL query is logged.
-        If condition is secondary and referenced relations do not exist
-        in database, running the SQL query will fail.
+        Create SQL query of the Condition results
+        from the Block temp tables.
         """
-        log.info(f'Creating temp table {self.id_string}')
-
-        drop_sql = f"DROP TABLE IF EXISTS {self.id_string};\n"
-
-        # Block-related data structures in the db are defined as temp tables
-        # whose lifespan only covers the current transaction:
-        # this prevents namespace conflicts with, e.g., similar aliases shared by multiple sites
-        # and keeps the identifier reasonably short. Moreover, Block-related
-        # datasets are not needed between Conditions (-> db sessions) as such.
-        block_defs = []
-        # ALL blocks must qualify, otherwise analyzing the condition is rejected
-        try:
-            for bl in self.blocks.values():
-                s = f"CREATE TEMP TABLE {bl.alias} ON COMMIT DROP AS ({bl.get_sql_def()});"
-                block_defs.append(s)
-        except:
-            self.errors.add(
-                msg='Cannot build Block SQL definition, skipping temp table creation',
-                log_add='exception'
-            )
-            return
-
         # Temp table representing the Condition persists along with the connection / session,
         # and it is constructed as follows:
         # - Make the Block parts (dropped at the end of the transaction)
         # - Create the "most granular" validity ranges series from all the Block temp tables as "master_ranges"
         # - Left join the Block temp tables to master_ranges
         # If there is only one Block, master_ranges is not needed.
-        create_sql = "\n".join(block_defs)
-
         if len(self.blocks) == 1:
-            create_sql += (f"\nCREATE TEMP TABLE {self.id_string} AS ( \n"
-                           "SELECT \n"
-                           "lower(valid_r) AS vfrom, \n"
-                           "upper(valid_r) AS vuntil, \n"
-                           "upper(valid_r)-lower(valid_r) AS vdiff, \n"
-                           f"{self.blocks.keys()[0]}, \n"
-                           f"{self.blocks.keys()[0]} AS master \n"
-                           f"FROM {self.blocks.keys()[0]});")
+            alias = next(iter(self.blocks.keys()))
+            select_sql = ("SELECT \n"
+                          "lower(valid_r) AS vfrom, \n"
+                          "upper(valid_r) AS vuntil, \n"
+                          "upper(valid_r)-lower(valid_r) AS vdiff, \n"
+                          f"{alias}, \n"
+                          f"({self.alias_condition}) AS master \n"
+                          f"FROM {alias}")
         else:
             master_seq_els = []
             for bl in self.blocks.values():
                 s = f"SELECT unnest( array [lower(valid_r), upper(valid_r)] ) AS vt FROM {bl.alias}"
                 master_seq_els.append(s)
             master_seq_sql = "\nUNION \n".join(master_seq_els)
-            create_sql += (f"\nCREATE TEMP TABLE {self.id_string} AS ( \n"
-                           "WITH master_seq AS ( \n"
-                           f"{master_seq_sql} \n"
-                           "ORDER BY vt), \n")
-            create_sql += ("master_ranges_wlastnull AS ( \n"
+            select_sql = ("WITH master_seq AS ( \n"
+                          f"{master_seq_sql} \n"
+                          "ORDER BY vt), \n")
+            select_sql += ("master_ranges_wlastnull AS ( \n"
                            "SELECT vt AS vfrom, LEAD(vt, 1) OVER (ORDER BY vt) AS vuntil \n"
                            "FROM master_seq), \n")
-            create_sql += ("master_ranges AS ( \n"
+            select_sql += ("master_ranges AS ( \n"
                            "SELECT tstzrange(vfrom, vuntil) AS valid_r \n"
                            "FROM master_ranges_wlastnull \n"
                            "WHERE vuntil IS NOT NULL) \n")
@@ -383,15 +295,74 @@ class Condition:
                 s = f"LEFT JOIN {bl.alias} ON master_ranges.valid_r && {bl.alias}.valid_r"
                 block_join_els.append(s)
             block_join_sql = " \n".join(block_join_els)
-            create_sql += ("SELECT \n"
+            select_sql += ("SELECT \n"
                            "lower(master_ranges.valid_r) AS vfrom, \n"
                            "upper(master_ranges.valid_r) AS vuntil, \n"
                            "upper(master_ranges.valid_r)-lower(master_ranges.valid_r) AS vdiff, \n")
-            create_sql +=  ", \n".join([f"{bl.alias}" for bl in self.blocks.values()]) + ", \n"
-            create_sql += f"({self.alias_condition}) AS master \nFROM {block_join_sql});"
+            select_sql +=  ", \n".join([f"{bl.alias}" for bl in self.blocks.values()]) + ", \n"
+            select_sql += f"({self.alias_condition}) AS master \nFROM {block_join_sql}"
+        return select_sql
+
+    def get_result_columns(self):
+        """
+        Return the names of the value columns of the results:
+        the Block aliases and ``master``.
+        """
+        return [bl.alias for bl in self.blocks.values()] + ['master']
+
+    def get_fetch_sql(self):
+        """
+        Create SQL query of the results in the Condition temp table
+        in time order, as epoch microseconds and
+        ``tsa.intervals`` codes of the Block and master values,
+        see ``tsa.intervals.IntervalSeries.from_rows``.
+        """
+        values = ', '.join(f"COALESCE({c}::int, -1)" for c in self.get_result_columns())
+        return ("SELECT (EXTRACT(epoch FROM vfrom) * 1000000)::int8, "
+                "(EXTRACT(epoch FROM vuntil) * 1000000)::int8, "
+                f"{values} FROM {self.id_string}")
+
+    def create_db_temptable(self, pg_conn=None, prepared=False, slicer=None):
+        """
+        Create temporary table corresponding to the condition.
+        If ``prepared`` is ``True``, primary Blocks use the prepared
+        Block query, see ``tsa.db.prepare_block_query``,
+        and if ``slicer`` is also given, they are queried in time slices
+        on several connections, see ``tsa.slicing.BlockSlicer``.
+        If ``pg_conn`` is ``None``, no database queries are executed;
+        if ``verbose`` is ``True``, whole SQL query is logged.
+        If condition is secondary and referenced relations do not exist
+        in database, running the SQL query will fail.
+        """
+        log.info(f'Creating temp table {self.id_string}')
+
+        drop_sql = f"DROP TABLE IF EXISTS {self.id_string};\n"
+
+        # Block-related data structures in the db are defined as temp tables
+        # whose lifespan only covers the current transaction:
+        # this prevents namespace conflicts with, e.g., similar aliases shared by multiple sites
+        # and keeps the identifier reasonably short. Moreover, Block-related
+        # datasets are not needed between Conditions (-> db sessions) as such.
+        block_defs = []
+        block_queries = []
+        # ALL blocks must qualify, otherwise analyzing the condition is rejected
+        try:
+            for bl in self.blocks.values():
+                block_defs.append(bl.get_create_sql(prepared=prepared))
+                block_queries.append(bl.get_query_sql(prepared=prepared))
+        except:
+            self.errors.add(
+                msg='Cannot build Block SQL definition, skipping temp table creation',
+                log_add='exception'
+            )
+            return
+
+        select_sql = self.get_select_sql()
+        create_sql = f"CREATE TEMP TABLE {self.id_string} AS ( \n{select_sql});"
+        sliced = prepared and slicer is not None and len(slicer.slices()) > 1
 
         log.debug('\n' + drop_sql)
-        log.debug('\n' + create_sql)
+        log.debug('\n' + "\n".join(block_defs + [create_sql]))
 
         if pg_conn is None:
             self.errors.add(
@@ -403,8 +374,20 @@ class Condition:
                 with pg_conn.cursor() as cur:
                     cur.execute(drop_sql)
                     pg_conn.commit()
-                    cur.execute(create_sql)
-                    pg_conn.commit()
+                    # Blocks and the Condition are timed separately,
+                    # with the statements needed to explain them later
+                    for bl, block_def, block_query in zip(self.blocks.values(),
+                                                          block_defs,
+                                                          block_queries):
+                        if sliced and bl.get_execute_sql() is not None:
+                            with self.timings.time('block', block=bl.alias):
+                                create_ranges_table(cur, bl.alias, slicer.ranges(bl))
+                            continue
+                        with self.timings.time('block', block=bl.alias, sql=block_query):
+                            cur.execute(block_def)
+                    with self.timings.time('combine', sql=select_sql, setup=block_defs):
+                        cur.execute(create_sql)
+                        pg_conn.commit()
                     log.info(f'Temp table created for {str(self)}')
             except:
                 pg_conn.rollback()
@@ -413,55 +396,286 @@ class Condition:
                     log_add='exception'
                 )
 
+    def extend_db_temptable(self, pg_conn, since, keep_from=None, slicer=None):
+        """
+        Create temporary table corresponding to the condition
+        by extending the results ``.base_results`` of an earlier run
+        over a shorter period, instead of computing the whole period;
+        the results are identical.
+        Results before ``since`` are taken from ``.base_results``,
+        see ``CondCollection.stitch_points``.
+        Primary Blocks use the prepared Block query, starting from
+        the last observation not used for their ranges in ``.base_results``,
+        and their ranges are joined to the earlier ones,
+        see ``tsa.ranges.join_ranges``.
+        The ranges from ``since`` on are combined in the database.
+        The temp table has also earlier results that end after ``keep_from``,
+        all of them if ``None``, for secondary Conditions referring to this one.
+        If ``slicer`` is given, primary Blocks are queried in time slices,
+        see ``tsa.slicing.BlockSlicer``.
+        """
+        log.info(f'Extending temp table {self.id_string} from {since}')
+        select_sql = self.get_select_sql()
+        try:
+            with pg_conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {self.id_string};")
+                pg_conn.commit()
+                for bl in self.blocks.values():
+                    # Referred Condition temp tables have the results needed
+                    if bl.secondary:
+                        with self.timings.time('block', block=bl.alias, sql=bl.get_query_sql()):
+                            cur.execute(bl.get_create_sql())
+                        continue
+                    head = ranges_from_results(self.base_results, bl.alias)
+                    if slicer is not None and len(slicer.slices(since=head[-1][1])) > 1:
+                        with self.timings.time('block', block=bl.alias):
+                            tail = slicer.ranges(bl, since=head[-1][1])
+                    else:
+                        block_query = bl.get_execute_sql(since=head[-1][1])
+                        with self.timings.time('block', block=bl.alias, sql=block_query):
+                            cur.execute(block_query)
+                            tail = [(r.lower, r.upper, v) for r, v in cur.fetchall()]
+                        tail.sort(key=lambda r: r[0])
+                    ranges = [r for r in join_ranges(head, tail) if r[1] > since]
+                    create_ranges_table(cur, bl.alias, ranges)
+                with self.timings.time('combine'):
+                    cur.execute(f"CREATE TEMP TABLE {self.id_string} AS ( \n{select_sql});")
+                    # Ranges starting before "since" are partial,
+                    # so these rows are taken from the earlier results
+                    cur.execute(f"DELETE FROM {self.id_string} WHERE vfrom < %s;", (since,))
+                    base = self.base_results
+                    keep = base.vuntil <= to_epoch_us(since)
+                    if keep_from is not None:
+                        keep &= base.vuntil > to_epoch_us(keep_from)
+                    base = base.select(keep)
+                    columns = self.get_result_columns()
+                    cur.execute(f"INSERT INTO {self.id_string} "
+                                f"(vfrom, vuntil, vdiff, {', '.join(columns)}) "
+                                f"SELECT vfrom, vuntil, vuntil-vfrom, {', '.join(columns)} "
+                                "FROM unnest(%s::timestamptz[], %s::timestamptz[], "
+                                f"{', '.join(['%s::boolean[]'] * len(columns))}) "
+                                f"AS r(vfrom, vuntil, {', '.join(columns)});",
+                                [base.datetimes(base.vfrom), base.datetimes(base.vuntil)]
+                                + [base.column(c) for c in columns])
+                    pg_conn.commit()
+                self.stitch_at = since
+                log.info(f'Temp table extended for {str(self)}')
+        except:
+            pg_conn.rollback()
+            self.errors.add(
+                msg='Failed to extend temp table',
+                log_add='exception'
+            )
+
     def fetch_results_from_db(self, pg_conn):
         """
         Fetch result data from corresponding db view
-        to pandas DataFrame, and set summary attribute values
-        based on the DataFrame.
+        to ``.results``, and set summary attribute values
+        based on them.
+
+        :return: ``True`` if the results were fetched
         """
         if not self.is_valid():
-            return
-        sql = f"SELECT * FROM {self.id_string};"
+            return False
+        if self.stitch_at is None:
+            sql = f"{self.get_fetch_sql()} ORDER BY vfrom;"
+            params = None
+        else:
+            # Earlier results are taken from .base_results
+            sql = f"{self.get_fetch_sql()} WHERE vfrom >= %(since)s ORDER BY vfrom;"
+            params = {'since': self.stitch_at}
         try:
-            self.main_df = pandas.read_sql(sql, con=pg_conn)
+            with self.timings.time('fetch'):
+                with pg_conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
         except:
+            # Keep the session usable for the following queries
+            pg_conn.rollback()
             self.errors.add(
                 msg='Cannot not fetch results from db',
                 log_add='exception'
             )
-            return
-        df = self.main_df
-
-        self.data_from = df['vfrom'].min()
-        self.data_until = df['vuntil'].max()
+            return False
+        columns = self.get_result_columns()
+        results = IntervalSeries.from_rows(columns, rows)
+        if self.stitch_at is not None:
+            base = self.base_results
+            head = base.select(base.vuntil <= to_epoch_us(self.stitch_at))
+            results = IntervalSeries.concat([head, results])
+            self.base_results = None
+        self.set_results(results)
+        return True
+
+    def set_results(self, results):
+        """
+        Set ``tsa.intervals.IntervalSeries`` ``results`` as ``.results``
+        and summary attribute values based on them.
+        """
+        self.results = results
+        self.data_from = results.first()
+        self.data_until = results.last()
         if not (self.data_from is None or self.data_until is None):
             self.tottime = self.data_until - self.data_from
 
-        self.tottime_valid = df[df['master']==True]['vdiff'].sum() or timedelta(0)
-        self.tottime_notvalid = df[df['master']==False]['vdiff'].sum() or timedelta(0)
+        self.tottime_valid = results.duration('master', TRUE) if len(results) else timedelta(0)
+        self.tottime_notvalid = results.duration('master', FALSE) if len(results) else timedelta(0)
         self.tottime_nodata = self.tottime - self.tottime_valid - self.tottime_notvalid
         tts = self.tottime.total_seconds()
         self.percentage_valid = self.tottime_valid.total_seconds() / tts
         self.percentage_notvalid = self.tottime_notvalid.total_seconds() / tts
         self.percentage_nodata = self.tottime_nodata.total_seconds() / tts
 
+    def breakdown(self, period):
+        """
+        Return the valid, not valid and no data times by calendar ``period``,
+        a key of ``tsa.periods.PERIODS``, from ``.data_from`` to ``.data_until``,
+        so that they add up to ``.tottime_valid``, ``.tottime_notvalid``
+        and ``.tottime_nodata``. All the periods are computed
+        in one pass over ``.results``, see ``tsa.periods.period_bounds``.
+
+        :return: list of ``(period_from, period_until, valid, notvalid, nodata)``
+            tuples of Timestamps and timedeltas
+        """
+        if self.results is None or self.results.empty:
+            return []
+        bounds = period_bounds(self.data_from, self.data_until, period)
+        bounds_us = [to_epoch_us(t) for t in bounds]
+        valid = self.results.durations_between('master', TRUE, bounds_us)
+        notvalid = self.results.durations_between('master', FALSE, bounds_us)
+        rows = []
+        for i in range(len(bounds) - 1):
+            nodata = bounds_us[i+1] - bounds_us[i] - valid[i] - notvalid[i]
+            rows.append((bounds[i], bounds[i+1],
+                         timedelta(microseconds=int(valid[i])),
+                         timedelta(microseconds=int(notvalid[i])),
+                         timedelta(microseconds=int(nodata))))
+        return rows
+
+    def recombinable_aliases(self, condition):
+        """
+        Return the aliases that the primary Blocks of this Condition have
+        in ``condition``, an earlier condition string of the same site
+        and master alias, as a dict by alias of this Condition,
+        or ``None`` if some of them are not in ``condition``.
+        """
+        earlier = {bl.raw_logic: k for k, bl in
+                   parse_condition(self.site, self.master_alias, ' '.join(condition.split())).blocks}
+        aliases = {k: earlier.get(bl.raw_logic) for k, bl in self.blocks.items()
+                   if not bl.secondary}
+        if None in aliases.values():
+            return None
+        return aliases
+
+    def recombine(self, results, aliases, references):
+        """
+        Set the results by combining the Block ranges without the database,
+        when only the logic differs from earlier results,
+        see ``tsa.intervals.IntervalSeries.combine``.
+        Primary Blocks are taken from the columns of earlier ``results``
+        named by ``aliases``, see ``.recombinable_aliases()``,
+        and secondary Blocks from the results of the Conditions they refer to,
+        ``references`` as Condition key - IntervalSeries dict.
+        The results are identical to those combined in the database.
+        """
+        blocks = OrderedDict()
+        for k, bl in self.blocks.items():
+            if bl.secondary:
+                ref = references[bl.source_view]
+                blocks[k] = IntervalSeries(vfrom=ref.vfrom, vuntil=ref.vuntil,
+                                           values=OrderedDict([(k, ref.values['master'])]))
+            else:
+                blocks[k] = results.ranges(aliases[k]).rename({aliases[k]: k})
+        self.set_results(IntervalSeries.combine(self.expr, blocks))
+
+    def save_checkpoint(self, dirpath, definition):
+        """
+        Save the results as DataFrame and the errors to ``dirpath``
+        as ``[id_string].pkl`` and ``[id_string].json``
+        so that they can be restored by ``.load_checkpoint()``.
+        ``definition`` identifies what the results were computed of,
+        see ``CondCollection.definition``.
+        The json file is written last, so it only exists
+        if the checkpoint is complete.
+        """
+        base_path = os.path.join(dirpath, self.id_string)
+        self.main_df.to_pickle(f'{base_path}.pkl.tmp')
+        os.replace(f'{base_path}.pkl.tmp', f'{base_path}.pkl')
+        meta = OrderedDict([
+            ('definition', definition),
+            ('saved_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            ('errors', [OrderedDict([('msg', e.msg),
+                                     ('log_add', e.log_add),
+                                     ('exc_text', e.exc_text),
+                                     ('count', e.count)])
+                        for e in self.errors.errors])
+        ])
+        write_atomic(f'{base_path}.json', json.dumps(meta, indent=2))
+
+    def read_checkpoint(self, dirpath):
+        """
+        Return the contents of the json file saved to ``dirpath``
+        by ``.save_checkpoint()``, or ``None`` if there is none.
+        """
+        path = os.path.join(dirpath, f'{self.id_string}.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as fobj:
+            return json.load(fobj)
+
+    def load_base(self, dirpath):
+        """
+        Read results saved to ``dirpath`` by ``.save_checkpoint()``
+        into ``.base_results``, to be extended by ``.extend_db_temptable()``.
+        """
+        path = os.path.join(dirpath, f'{self.id_string}.pkl')
+        self.base_results = IntervalSeries.from_frame(pandas.read_pickle(path))
+        log.info(f'Results of {str(self)} to extend read from {path}')
+
+    def load_checkpoint(self, dirpath, definition):
+        """
+        Restore results and errors saved by ``.save_checkpoint()``
+        if they were computed of the same ``definition``.
+
+        :return: ``True`` if restored, ``False`` if there is
+            no matching checkpoint
+        """
+        base_path = os.path.join(dirpath, self.id_string)
+        meta = self.read_checkpoint(dirpath)
+        if meta is None:
+            return False
+        if meta['definition'] != definition:
+            log.info(f'Checkpoint of {str(self)} is of a different definition, not restored')
+            return False
+        self.set_results(IntervalSeries.from_frame(pandas.read_pickle(f'{base_path}.pkl')))
+        # Parsing errors are there already, since the Condition is parsed again
+        for e in meta['errors']:
+            if (self.errors.context, e['msg']) in self.errors.index:
+                continue
+            self.errors.add(msg=e['msg'],
+                            log_add=e['log_add'],
+                            exc_text=e['exc_text'],
+                            count=e['count'])
+        log.info(f'Results of {str(self)} restored from {base_path}.pkl')
+        return True
+
     def get_timelineplot(self):
         """
         Returns a Matplotlib figure object:
         a `broken_barh` plot of the validity of the condition
         and its blocks on a timeline.
         """
-        if self.main_df.empty:
-            raise Exception('main_df is empty, cannot make timeline plot')
+        if self.results.empty:
+            raise Exception('No results, cannot make timeline plot')
 
         def getfacecolor(val):
             """
             Return a color name
-            by boolean column value.
+            by ``tsa.intervals`` value code.
             """
-            if val == True:
+            if val == TRUE:
                 return '#f03b20'
-            elif val == False:
+            elif val == FALSE:
                 return '#2b83ba'
             return '#bababa'
 
@@ -473,13 +687,14 @@ class Condition:
         lbl_offset = 0.1
 
         # Make matplotlib-ready range list from the time columns
-        xr = zip([mdates.date2num(el) for el in self.main_df['vfrom']],
-                 [mdates.date2num(el) for el in self.main_df['vuntil']])
+        res = self.results
+        xr = zip(mdates.date2num(res.datetimes(res.vfrom)),
+                 mdates.date2num(res.datetimes(res.vuntil)))
         xr = [(a, b-a) for (a, b) in xr]
 
         # Make subplots for blocks;
         # for every block, there should be
-        # a corresponding boolean column in the result DataFrame!
+        # a corresponding column in the results!
         fig, ax = plt.subplots()
         yticks = []
         ylabels = []
@@ -488,7 +703,7 @@ class Condition:
             logic_lbl = bl.raw_logic
             ax.broken_barh(xranges=xr, yrange=(i, hgtval),
                            facecolors=list(map(getfacecolor,
-                                               self.main_df[bl.alias])),
+                                               res.values[bl.alias].tolist())),
                            alpha=alphaval)
             ax.annotate(s=logic_lbl,
                         xy=(xr[0][0], i + hgtval + lbl_offset))
@@ -500,7 +715,7 @@ class Condition:
         hgtval = 0.8
         ax.broken_barh(xranges=xr, yrange=(i, hgtval),
                        facecolors=list(map(getfacecolor,
-                                           self.main_df['master'])))
+                                           res.values['master'].tolist())))
         ax.annotate(s=self.alias_condition,
                     xy=(xr[0][0], i + hgtval + lbl_offset))
         yticks.append(i + (hgtval / 2))
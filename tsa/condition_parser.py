@@ -0,0 +1,400 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Tokenizer and parser for condition strings, called by Condition
+
+import logging
+import numpy
+from .intervals import TRUE
+from .intervals import FALSE
+from .intervals import NULL
+from .utils import with_errpointer
+
+log = logging.getLogger(__name__)
+
+KEYWORDS = ('and', 'or', 'not')
+
+class Token:
+    """
+    Lexical element of a condition string.
+
+    :param kind: ``open_par``, ``close_par``, ``and``, ``or``, ``not`` or ``logic``
+    :type kind: string
+    :param text: element as it will be used further; for ``logic`` tokens,
+        whitespaces are normalized and ``in`` tuples are included
+    :type text: string
+    :param pos: index of the element in the source string
+    :type pos: integer
+    """
+    __slots__ = ('kind', 'text', 'pos')
+
+    def __init__(self, kind, text, pos):
+        self.kind = kind
+        self.text = text
+        self.pos = pos
+
+    def __repr__(self):
+        return f'<Token {self.kind} "{self.text}" at {self.pos}>'
+
+class ParseError(Exception):
+    """
+    Syntax error in a condition string.
+    The string representation points out the erroneous position.
+    """
+    def __init__(self, msg, source, pos):
+        super().__init__(msg)
+        self.msg = msg
+        self.source = source
+        self.pos = pos
+
+    def __str__(self):
+        return f'{self.msg}:\n' + with_errpointer(self.source, self.pos)
+
+def tokenize(s):
+    """
+    Split condition string ``s`` into a list of :py:class:``Token`` objects
+    in a single pass.
+
+    Parentheses are always tokens of their own, except when they follow
+    an ``in`` operator: then the tuple up to the next ``)`` belongs
+    to the logic element. ``and``, ``or`` and ``not`` are recognized
+    as whole words only. Consecutive other words make up
+    one ``logic`` element, i.e. the raw logic of a Block.
+    """
+    tokens = []
+    words = []
+    logic_pos = None
+    i = 0
+    n = len(s)
+
+    def flush():
+        if words:
+            tokens.append(Token('logic', ' '.join(words), logic_pos))
+            words.clear()
+
+    while i < n:
+        c = s[i]
+        if c.isspace():
+            i += 1
+        elif c == '(' and words and words[-1] == 'in':
+            # Tuple after "in": Block will detect later
+            # if it is not correctly enclosed by ")".
+            j = s.find(')', i)
+            if j < 0:
+                words.append(s[i:].rstrip())
+                i = n
+            else:
+                words.append('(' + s[i+1:j].strip() + ')')
+                i = j + 1
+        elif c == '(':
+            flush()
+            tokens.append(Token('open_par', c, i))
+            i += 1
+        elif c == ')':
+            flush()
+            tokens.append(Token('close_par', c, i))
+            i += 1
+        else:
+            j = i
+            while j < n and not s[j].isspace() and s[j] not in '()':
+                j += 1
+            word = s[i:j]
+            if word in KEYWORDS:
+                flush()
+                tokens.append(Token(word, word, i))
+            else:
+                if not words:
+                    logic_pos = i
+                words.append(word)
+            i = j
+    flush()
+    return tokens
+
+class Node:
+    """
+    Base class of condition syntax tree nodes.
+    Nodes with lower ``precedence`` bind more loosely
+    and are parenthesized when nested in tighter ones.
+    The tree renders back to SQL with Block aliases by ``to_sql()``.
+    """
+    __slots__ = ()
+    precedence = 0
+
+    def to_sql(self):
+        raise NotImplementedError
+
+    def aliases(self):
+        """
+        Yield Block aliases of the leaves from left to right.
+        """
+        raise NotImplementedError
+
+    def evaluate(self, values):
+        """
+        Evaluate the node with Kleene three-valued logic
+        like PostgreSQL does: ``values`` maps Block aliases
+        to ``True``, ``False`` or ``None`` (unknown).
+        """
+        raise NotImplementedError
+
+    def evaluate_codes(self, values):
+        """
+        Evaluate the node like ``.evaluate()`` for many rows at once:
+        ``values`` maps Block aliases to int8 arrays of
+        ``tsa.intervals`` codes ``TRUE``, ``FALSE`` and ``NULL``,
+        and an array of the codes is returned.
+        """
+        raise NotImplementedError
+
+    def _wrap(self, node):
+        s = node.to_sql()
+        if node.precedence < self.precedence:
+            s = f'({s})'
+        return s
+
+    def __str__(self):
+        return self.to_sql()
+
+class Leaf(Node):
+    """
+    Reference to a Block by its alias.
+    """
+    __slots__ = ('alias', 'raw', 'pos')
+    precedence = 3
+
+    def __init__(self, alias, raw, pos):
+        self.alias = alias
+        self.raw = raw
+        self.pos = pos
+
+    def to_sql(self):
+        return self.alias
+
+    def aliases(self):
+        yield self.alias
+
+    def evaluate(self, values):
+        return values[self.alias]
+
+    def evaluate_codes(self, values):
+        return values[self.alias]
+
+    def __repr__(self):
+        return f'<Leaf {self.alias}>'
+
+class Not(Node):
+    __slots__ = ('operand', 'pos')
+    precedence = 2
+
+    def __init__(self, operand, pos):
+        self.operand = operand
+        self.pos = pos
+
+    def to_sql(self):
+        return 'not ' + self._wrap(self.operand)
+
+    def aliases(self):
+        yield from self.operand.aliases()
+
+    def evaluate(self, values):
+        v = self.operand.evaluate(values)
+        if v is None:
+            return None
+        return not v
+
+    def evaluate_codes(self, values):
+        v = self.operand.evaluate_codes(values)
+        return numpy.where(v == NULL, NULL, TRUE - v).astype(numpy.int8)
+
+    def __repr__(self):
+        return f'<Not {self.operand!r}>'
+
+class BoolOp(Node):
+    """
+    Base class of ``and`` and ``or`` nodes with two or more operands.
+    """
+    __slots__ = ('operands', 'pos')
+    keyword = None
+
+    def __init__(self, operands, pos):
+        # Nested nodes of the same type are flattened,
+        # since the operators are associative
+        flat = []
+        for op in operands:
+            if type(op) is type(self):
+                flat.extend(op.operands)
+            else:
+                flat.append(op)
+        self.operands = tuple(flat)
+        self.pos = pos
+
+    def _wrap(self, node):
+        # Nested and/or are always parenthesized
+        # so the precedence is explicit for the reader
+        s = node.to_sql()
+        if isinstance(node, BoolOp):
+            s = f'({s})'
+        return s
+
+    def to_sql(self):
+        return f' {self.keyword} '.join(self._wrap(op) for op in self.operands)
+
+    def aliases(self):
+        for op in self.operands:
+            yield from op.aliases()
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {list(self.operands)!r}>'
+
+class And(BoolOp):
+    __slots__ = ()
+    precedence = 1
+    keyword = 'and'
+
+    def evaluate(self, values):
+        result = True
+        for op in self.operands:
+            v = op.evaluate(values)
+            if v is False:
+                return False
+            if v is None:
+                result = None
+        return result
+
+    def evaluate_codes(self, values):
+        # FALSE if any operand is FALSE, else NULL if any is NULL
+        codes = [op.evaluate_codes(values) for op in self.operands]
+        any_false = numpy.logical_or.reduce([v == FALSE for v in codes])
+        any_null = numpy.logical_or.reduce([v == NULL for v in codes])
+        return numpy.select([any_false, any_null], [FALSE, NULL], TRUE).astype(numpy.int8)
+
+class Or(BoolOp):
+    __slots__ = ()
+    precedence = 0
+    keyword = 'or'
+
+    def evaluate(self, values):
+        result = False
+        for op in self.operands:
+            v = op.evaluate(values)
+            if v is True:
+                return True
+            if v is None:
+                result = None
+        return result
+
+    def evaluate_codes(self, values):
+        # TRUE if any operand is TRUE, else NULL if any is NULL
+        codes = [op.evaluate_codes(values) for op in self.operands]
+        any_true = numpy.logical_or.reduce([v == TRUE for v in codes])
+        any_null = numpy.logical_or.reduce([v == NULL for v in codes])
+        return numpy.select([any_true, any_null], [TRUE, NULL], FALSE).astype(numpy.int8)
+
+class _Parser:
+    """
+    Recursive-descent parser over a token list.
+    Operator precedence is the same as in PostgreSQL:
+    ``not`` binds tighter than ``and``, which binds tighter than ``or``.
+
+    Grammar::
+
+        or_expr   := and_expr ('or' and_expr)*
+        and_expr  := not_expr ('and' not_expr)*
+        not_expr  := 'not' primary | primary
+        primary   := '(' or_expr ')' | logic
+    """
+    def __init__(self, tokens, source, aliases):
+        self.tokens = tokens
+        self.source = source
+        self.aliases = aliases
+        self.i = 0
+
+    def peek(self):
+        if self.i < len(self.tokens):
+            return self.tokens[self.i]
+        return None
+
+    def error_at(self, tok):
+        """
+        Return ParseError describing why ``tok`` is not allowed
+        in the current position.
+        """
+        prev = self.tokens[self.i - 1] if self.i > 0 else None
+        if tok is None and prev is None:
+            return ParseError('Condition is empty', self.source, 0)
+        if tok is None:
+            return ParseError(f'"{prev.text}" cannot be last element in condition',
+                              self.source, prev.pos)
+        if prev is None:
+            return ParseError(f'"{tok.text}" cannot be first element in condition',
+                              self.source, tok.pos)
+        return ParseError(f'Illegal combination in condition: "{prev.text}" before "{tok.text}"',
+                          self.source, tok.pos)
+
+    def parse(self):
+        node = self.or_expr()
+        tok = self.peek()
+        if tok is not None:
+            if tok.kind == 'close_par':
+                raise ParseError('Unmatched ")" in condition', self.source, tok.pos)
+            raise self.error_at(tok)
+        return node
+
+    def or_expr(self):
+        first = self.and_expr()
+        operands = [first]
+        while self.peek() is not None and self.peek().kind == 'or':
+            self.i += 1
+            operands.append(self.and_expr())
+        if len(operands) == 1:
+            return first
+        return Or(operands, first.pos)
+
+    def and_expr(self):
+        first = self.not_expr()
+        operands = [first]
+        while self.peek() is not None and self.peek().kind == 'and':
+            self.i += 1
+            operands.append(self.not_expr())
+        if len(operands) == 1:
+            return first
+        return And(operands, first.pos)
+
+    def not_expr(self):
+        tok = self.peek()
+        if tok is not None and tok.kind == 'not':
+            self.i += 1
+            return Not(self.primary(), tok.pos)
+        return self.primary()
+
+    def primary(self):
+        tok = self.peek()
+        if tok is None or tok.kind not in ('open_par', 'logic'):
+            raise self.error_at(tok)
+        self.i += 1
+        if tok.kind == 'logic':
+            return Leaf(self.aliases.get(tok.text, tok.text), tok.text, tok.pos)
+        node = self.or_expr()
+        end = self.peek()
+        if end is None:
+            raise ParseError('Missing ")" for "(" in condition', self.source, tok.pos)
+        if end.kind != 'close_par':
+            raise self.error_at(end)
+        self.i += 1
+        return node
+
+def parse(tokens, source, aliases=None):
+    """
+    Build a syntax tree of :py:class:``Node`` objects from ``tokens``.
+
+    :param tokens: tokens made by :py:func:``tokenize``
+    :type tokens: list
+    :param source: original condition string, for error messages
+    :type source: string
+    :param aliases: raw logic - Block alias pairs for the leaves;
+        raw logic is used if not found
+    :type aliases: dict
+    :return: root node
+    :raises ParseError: on the first syntax error
+    """
+    return _Parser(tokens, source, aliases or {}).parse()
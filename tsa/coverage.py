@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Observation coverage by station, sensor and period, read from the daily summary table
+
+import logging
+import pandas
+from collections import OrderedDict
+from .availability import utc_date
+from .periods import PERIODS
+
+log = logging.getLogger(__name__)
+
+# Columns of the seobs_daily table, see database/06_seobs_daily.sql
+DAILY_COLUMNS = ('statid', 'seid', 'day', 'nobs', 'first_ts', 'last_ts',
+                 'min_seval', 'max_seval')
+
+# Columns of the coverage by period, see ``coverage``
+COVERAGE_COLUMNS = ('statid', 'seid', 'period_from', 'days', 'nobs', 'first_ts', 'last_ts',
+                    'min_seval', 'max_seval')
+
+def read_daily(pg_conn, time_from=None, time_until=None, station_ids=None, sensor_ids=None):
+    """
+    Return the rows of the daily summary table ``seobs_daily``
+    as a DataFrame of ``DAILY_COLUMNS``, ordered by station, sensor and day:
+    the number of observations, first and last observation time
+    and min and max value of each station, sensor and day (UTC)
+    with observations.
+    Only the days between timezone-aware datetimes ``time_from``
+    and ``time_until`` are read, if given, as whole days,
+    and only the stations and sensors of the given ids.
+
+    :raises psycopg2.Error: if the table does not exist
+    """
+    where = []
+    params = {}
+    if time_from is not None:
+        where.append("day >= %(day_from)s")
+        params['day_from'] = utc_date(time_from)
+    if time_until is not None:
+        where.append("day <= %(day_until)s")
+        params['day_until'] = utc_date(time_until)
+    if station_ids is not None:
+        where.append("statid = ANY(%(statids)s)")
+        params['statids'] = sorted(station_ids)
+    if sensor_ids is not None:
+        where.append("seid = ANY(%(seids)s)")
+        params['seids'] = sorted(sensor_ids)
+    sql = f"SELECT {', '.join(DAILY_COLUMNS)} FROM seobs_daily"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    sql += " ORDER BY statid, seid, day;"
+    with pg_conn.cursor() as cur:
+        log.debug(cur.mogrify(sql, params).decode())
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return pandas.DataFrame.from_records(rows, columns=DAILY_COLUMNS)
+
+def summarize(daily, period=None):
+    """
+    Return the daily rows ``daily`` (see ``read_daily``)
+    summarized by station, sensor and calendar period ``period``,
+    a key of ``tsa.periods.PERIODS``, or over all the days if ``None``,
+    as a DataFrame of ``COVERAGE_COLUMNS``:
+    ``period_from`` is the first day of the period, or of the days,
+    and ``days`` the number of days with observations.
+    """
+    df = daily.copy()
+    if period is None:
+        df['period_from'] = df.groupby(['statid', 'seid'])['day'].transform('min')
+    else:
+        days = pandas.DatetimeIndex(pandas.to_datetime(df['day']))
+        df['period_from'] = days.to_period(PERIODS[period]).start_time.date
+    res = df.groupby(['statid', 'seid', 'period_from'], as_index=False).agg(OrderedDict([
+        ('day', 'count'),
+        ('nobs', 'sum'),
+        ('first_ts', 'min'),
+        ('last_ts', 'max'),
+        ('min_seval', 'min'),
+        ('max_seval', 'max')]))
+    res = res.rename(columns={'day': 'days'})
+    return res[list(COVERAGE_COLUMNS)]
+
+def coverage(pg_conn, time_from=None, time_until=None, station_ids=None, sensor_ids=None,
+             period=None):
+    """
+    Return the coverage of the observations in the database
+    by station, sensor and ``period``, see ``read_daily`` and ``summarize``
+    for the arguments. Reads only the daily summary table,
+    so it is fast with any amount of observations.
+
+    :example::
+
+        >>> coverage(pg_conn, station_ids=[1104], sensor_ids=[181], period='month')
+           statid  seid period_from  days  nobs                  first_ts  ...
+        0    1104   181  2018-01-01    20  2658 2018-01-01 00:00:00+00:00  ...
+    """
+    daily = read_daily(pg_conn, time_from=time_from, time_until=time_until,
+                       station_ids=station_ids, sensor_ids=sensor_ids)
+    return summarize(daily, period=period)
@@ -0,0 +1,525 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Database connection parameters, connection pool and prepared queries
+
+import logging
+import math
+import os
+import psycopg2
+import psycopg2.pool
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_PG_HOST = 'localhost'
+DEFAULT_PG_PORT = 5432
+DEFAULT_PG_DBNAME = 'tsa'
+DEFAULT_PG_USER = 'postgres'
+DEFAULT_PG_PASSWORD = 'postgres'
+
+# Max number of connections a pool opens
+DEFAULT_POOL_SIZE = 4
+
+# Seconds before a database host marked down is checked again
+HOST_RETRY_SECONDS = 30.0
+
+# Connect timeout of the health check of a database host
+HOST_CHECK_TIMEOUT = 5
+
+# Name of the prepared statement for primary Block queries
+BLOCK_QUERY_NAME = 'tsa_block_ranges'
+
+# Block operators as the prepared statement parameters telling
+# whether a sensor value less than, equal to or greater than
+# the Block value makes the Block true;
+# "in" compares to the list of values only
+BLOCK_QUERY_FLAGS = {
+    '<': (True, False, False),
+    '=': (False, True, False),
+    '>': (False, False, True),
+    '<=': (True, True, False),
+    '>=': (False, True, True),
+    '<>': (True, False, True),
+    'in': (False, False, False)
+}
+
+# PREPARE statement of the Block query, see the file for details
+BLOCK_QUERY_PATH = os.path.join(os.path.dirname(__file__), 'sql', 'block_ranges.sql')
+with open(BLOCK_QUERY_PATH) as fobj:
+    BLOCK_QUERY_SQL = fobj.read()
+
+# Name of the prepared statement for primary Blocks of discrete sensors,
+# taking the same parameters as BLOCK_QUERY_NAME
+# but reading the runs of equal values from the seobs_runs table
+BLOCK_RUNS_QUERY_NAME = 'tsa_block_runs'
+
+# PREPARE statement of the runs query, see the file for details
+BLOCK_RUNS_QUERY_PATH = os.path.join(os.path.dirname(__file__), 'sql', 'block_runs.sql')
+with open(BLOCK_RUNS_QUERY_PATH) as fobj:
+    BLOCK_RUNS_QUERY_SQL = fobj.read()
+
+log = logging.getLogger(__name__)
+
+def parse_hosts(value, default_port=DEFAULT_PG_PORT):
+    """
+    Parse a comma-separated list of database hosts
+    like ``"db1:5432=2,db2=1,db3"`` into ``(host, port, weight)`` tuples.
+    Port and weight are optional; the weight defaults to 1.
+    A host can also be a Unix socket directory.
+    """
+    hosts = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        weight = 1.0
+        if '=' in item:
+            item, w = item.rsplit('=', 1)
+            try:
+                weight = float(w)
+            except ValueError:
+                raise ValueError(f'Invalid weight of database host {item}: {w}')
+            if not weight > 0:
+                raise ValueError(f'Weight of database host {item} must be positive')
+        host, port = item, default_port
+        head, sep, tail = item.rpartition(':')
+        if sep and tail.isdigit():
+            host, port = head, tail
+        hosts.append((host, str(port), weight))
+    if not hosts:
+        raise ValueError(f'No database hosts in {value}')
+    return hosts
+
+class DBParams:
+    """
+    Stores parameters for database connection.
+
+    ``PG_HOSTS`` can list several hosts serving the same database,
+    e.g. read replicas, with weights, see ``parse_hosts``;
+    ``.host`` and ``.port`` are then those of the first one.
+    By default, ``.hosts`` contains only ``PG_HOST`` and ``PG_PORT``.
+    """
+    def __init__(self):
+        self.dbname = os.getenv('PG_DBNAME', DEFAULT_PG_DBNAME)
+        self.user = os.getenv('PG_USER', DEFAULT_PG_USER)
+        self.password = os.getenv('PG_PASSWORD', DEFAULT_PG_PASSWORD)
+        self.host = os.getenv('PG_HOST', DEFAULT_PG_HOST)
+        self.port = os.getenv('PG_PORT', DEFAULT_PG_PORT)
+        if os.getenv('PG_HOSTS'):
+            self.hosts = parse_hosts(os.getenv('PG_HOSTS'), default_port=self.port)
+            self.host, self.port = self.hosts[0][:2]
+        else:
+            self.hosts = [(self.host, str(self.port), 1.0)]
+
+    def keys(self):
+        return ['dbname', 'user', 'password', 'host', 'port']
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def for_host(self, host, port):
+        """
+        Return the connection parameters of ``host`` and ``port``
+        as a dict.
+        """
+        params = {k: self[k] for k in self.keys()}
+        params['host'] = host
+        params['port'] = port
+        return params
+
+    def __str__(self):
+        s = 'DBParams\n'
+        for k in self.keys():
+            if k == 'password':
+                v = '(not shown)'
+            else:
+                v = self.__dict__[k]
+            s += f'{k:8}: {v}, '
+        return s
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections shared by an analysis run.
+    Connections are opened when first needed, up to ``maxconn``.
+
+    Session state is reset when a connection is returned to the pool:
+    temporary tables and views are dropped, but prepared statements
+    are kept so they need not be prepared again.
+
+    :example::
+
+        >>> pool = ConnectionPool(DBParams())
+        >>> with pool.connection() as pg_conn:
+        ...     list_db_sensors(pg_conn)
+
+    :param db_params: connection parameters, e.g. ``DBParams``
+    :param kwargs: additional arguments to ``psycopg2.connect``
+    """
+    def __init__(self, db_params, minconn=1, maxconn=DEFAULT_POOL_SIZE, **kwargs):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, **db_params, **kwargs
+        )
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the ``with`` block.
+        Like ``with psycopg2.connect(...)``, the transaction is committed
+        at the end of the block, or rolled back on exception.
+        """
+        pg_conn = self.pool.getconn()
+        try:
+            yield pg_conn
+            pg_conn.commit()
+        except:
+            if not pg_conn.closed:
+                pg_conn.rollback()
+            raise
+        finally:
+            self.release(pg_conn)
+
+    def release(self, pg_conn):
+        """
+        Reset session state of ``pg_conn`` and return it to the pool;
+        close it instead if it is not usable anymore.
+        """
+        try:
+            with pg_conn.cursor() as cur:
+                cur.execute('DISCARD TEMP;')
+            pg_conn.commit()
+            self.pool.putconn(pg_conn)
+        except psycopg2.Error:
+            log.warning('Could not reset db connection, closing it')
+            self.pool.putconn(pg_conn, close=True)
+
+    def close(self):
+        self.pool.closeall()
+
+class ReplicaPool:
+    """
+    Thread-safe connection pools to several database hosts
+    serving the same data, e.g. read replicas, listed in ``db_params.hosts``.
+    Used like ``ConnectionPool``: each connection is borrowed
+    from the available host with the fewest connections in use
+    relative to its weight, so concurrent sessions are spread
+    over the hosts by weight.
+
+    A host is marked down if a connection to it cannot be opened
+    or is lost while in use; connections are then borrowed from the other hosts.
+    After ``retry_seconds``, a host marked down is checked
+    with ``SELECT 1`` before it is used again.
+    The pool of a host marked down is closed, with its idle connections,
+    when its last connection in use is returned.
+
+    :param db_params: connection parameters, e.g. ``DBParams``
+    :param maxconn: max number of connections per host
+    :param retry_seconds: seconds before a host marked down is checked again
+    :param kwargs: additional arguments to ``psycopg2.connect``
+    """
+    def __init__(self, db_params, minconn=1, maxconn=DEFAULT_POOL_SIZE,
+                 retry_seconds=HOST_RETRY_SECONDS, **kwargs):
+        self.db_params = db_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.retry_seconds = retry_seconds
+        self.kwargs = kwargs
+        self.weights = OrderedDict(((h, p), w) for h, p, w in db_params.hosts)
+        # Host - ConnectionPool, opened when first needed
+        self.pools = {}
+        # Pools of hosts marked down, closed when no connection is in use
+        self.dropped = []
+        self.in_use = {k: 0 for k in self.weights.keys()}
+        # Host - time.monotonic() when it was marked down
+        self.down_since = {}
+        # id of borrowed connection - (host, ConnectionPool)
+        self.borrowed = {}
+        self._lock = threading.Lock()
+
+    def host_pool(self, host):
+        """
+        Return the ``ConnectionPool`` of ``host``, a ``(host, port)`` tuple,
+        opening it if needed.
+        """
+        with self._lock:
+            if host not in self.pools:
+                self.pools[host] = ConnectionPool(self.db_params.for_host(*host),
+                                                  minconn=self.minconn,
+                                                  maxconn=self.maxconn,
+                                                  **self.kwargs)
+                log.info(f'Database connection pool opened for host {host[0]}:{host[1]}')
+            return self.pools[host]
+
+    def mark_down(self, host, reason):
+        with self._lock:
+            if host not in self.down_since:
+                log.warning(f'Database host {host[0]}:{host[1]} marked down: {reason}')
+            self.down_since[host] = time.monotonic()
+            # Connections in use are returned to the dropped pool
+            pool = self.pools.pop(host, None)
+            if pool is not None:
+                self.dropped.append(pool)
+        self.close_dropped()
+
+    def close_dropped(self):
+        """
+        Close the dropped pools of hosts marked down
+        that have no connections in use anymore.
+        """
+        with self._lock:
+            in_use = set(id(pool) for _, pool in self.borrowed.values())
+            idle = [p for p in self.dropped if id(p) not in in_use]
+            self.dropped = [p for p in self.dropped if id(p) in in_use]
+        for pool in idle:
+            pool.close()
+
+    def check(self, host):
+        """
+        Check that ``host`` answers ``SELECT 1`` on a new connection,
+        and mark it up or down accordingly.
+
+        :return: ``True`` if the host is available
+        """
+        kwargs = dict(self.kwargs)
+        kwargs.setdefault('connect_timeout', HOST_CHECK_TIMEOUT)
+        try:
+            pg_conn = psycopg2.connect(**self.db_params.for_host(*host), **kwargs)
+            try:
+                with pg_conn.cursor() as cur:
+                    cur.execute('SELECT 1;')
+            finally:
+                pg_conn.close()
+        except psycopg2.Error as e:
+            self.mark_down(host, str(e).strip())
+            return False
+        with self._lock:
+            if self.down_since.pop(host, None) is not None:
+                log.info(f'Database host {host[0]}:{host[1]} is available again')
+        return True
+
+    def check_all(self):
+        """
+        Check all the hosts, see ``.check()``.
+
+        :return: list of available hosts
+        """
+        available = [h for h in self.weights.keys() if self.check(h)]
+        log.info(f'{len(available)}/{len(self.weights)} database hosts available')
+        return available
+
+    def candidates(self):
+        """
+        Return the hosts to borrow a connection from, in order of preference:
+        fewest connections in use relative to weight first.
+        Hosts marked down are checked again if ``retry_seconds`` have passed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            retry = [h for h, t in self.down_since.items() if now - t >= self.retry_seconds]
+        for h in retry:
+            self.check(h)
+        with self._lock:
+            hosts = [h for h in self.weights.keys() if h not in self.down_since]
+            return sorted(hosts, key=lambda h: (self.in_use[h] + 1) / self.weights[h])
+
+    def getconn(self, host=None):
+        """
+        Borrow a connection from ``host``, or from the preferred available host.
+        It must be returned with ``.release()``.
+
+        :return: ``(host, pg_conn)``
+        """
+        hosts = [host] if host is not None else self.candidates()
+        for h in hosts:
+            try:
+                pool = self.host_pool(h)
+                pg_conn = pool.pool.getconn()
+            except psycopg2.pool.PoolError:
+                log.debug(f'No free connections to database host {h[0]}:{h[1]}')
+                continue
+            except psycopg2.Error as e:
+                self.mark_down(h, str(e).strip())
+                continue
+            with self._lock:
+                self.in_use[h] += 1
+                self.borrowed[id(pg_conn)] = (h, pool)
+            return h, pg_conn
+        raise psycopg2.OperationalError(
+            f'No database host of {len(self.weights)} available with free connections'
+        )
+
+    def release(self, pg_conn):
+        """
+        Return ``pg_conn`` to the pool of its host,
+        marking the host down if the connection was lost.
+        """
+        with self._lock:
+            host, pool = self.borrowed.pop(id(pg_conn))
+            self.in_use[host] -= 1
+        if pg_conn.closed:
+            self.mark_down(host, 'connection lost')
+        try:
+            pool.release(pg_conn)
+        except psycopg2.Error:
+            if not pg_conn.closed:
+                pg_conn.close()
+        self.close_dropped()
+
+    def host_of(self, pg_conn):
+        """
+        Return the ``(host, port)`` tuple of borrowed connection ``pg_conn``.
+        """
+        with self._lock:
+            return self.borrowed[id(pg_conn)][0]
+
+    @contextmanager
+    def connection(self, host=None):
+        """
+        Borrow a connection for the ``with`` block,
+        like ``ConnectionPool.connection()``.
+        """
+        host, pg_conn = self.getconn(host)
+        try:
+            yield pg_conn
+            pg_conn.commit()
+        except:
+            if not pg_conn.closed:
+                pg_conn.rollback()
+            raise
+        finally:
+            self.release(pg_conn)
+
+    def close(self):
+        with self._lock:
+            pools = list(self.pools.values()) + self.dropped
+            self.pools = {}
+            self.dropped = []
+        for pool in pools:
+            pool.close()
+
+def prepare_statement(pg_conn, name, sql, fallback):
+    """
+    Prepare statement ``name`` by PREPARE statement ``sql``
+    in the session of ``pg_conn``, unless already prepared.
+    On PostgreSQL 12+, the session is set to always use the generic plan,
+    so that executions are not planned again.
+
+    :param fallback: what is used instead, for the log message
+    :return: ``True`` if the statement is available
+    """
+    with pg_conn.cursor() as cur:
+        try:
+            cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s;",
+                        (name,))
+            if cur.fetchone() is None:
+                log.debug('\n' + sql)
+                cur.execute(sql)
+                if pg_conn.server_version >= 120000:
+                    cur.execute("SET plan_cache_mode = force_generic_plan;")
+            pg_conn.commit()
+            return True
+        except psycopg2.Error:
+            pg_conn.rollback()
+            log.exception(f'Could not prepare {name}, using {fallback} instead')
+            return False
+
+def prepare_block_query(pg_conn):
+    """
+    Prepare the primary Block query ``BLOCK_QUERY_SQL``
+    in the session of ``pg_conn``, unless already prepared.
+    The ``obs_main`` view must exist.
+
+    :return: ``True`` if the statement is available
+    """
+    return prepare_statement(pg_conn, BLOCK_QUERY_NAME, BLOCK_QUERY_SQL, 'pack_ranges')
+
+def prepare_block_runs_query(pg_conn):
+    """
+    Prepare the query of primary Blocks of discrete sensors
+    ``BLOCK_RUNS_QUERY_SQL`` in the session of ``pg_conn``,
+    unless already prepared.
+    The ``obs_main`` view and the ``seobs_runs`` table must exist,
+    see ``database/04_discrete_runs.sql``.
+
+    :return: ``True`` if the statement is available
+    """
+    return prepare_statement(pg_conn, BLOCK_RUNS_QUERY_NAME, BLOCK_RUNS_QUERY_SQL,
+                             'the observations')
+
+def current_block_runs(pg_conn, pairs, time_from, time_until, maxminutes):
+    """
+    Return the station and sensor id ``pairs`` whose runs in ``seobs_runs``
+    can be used for the period between ``time_from`` and ``time_until``,
+    as a set: the runs are built with ``maxminutes``, and the one starting last
+    at or before the last observation of the period covers that observation,
+    which must not be after the last observation read by ``populate_seobs_runs()``.
+    The latter holds if there are runs after it,
+    or the run ends ``maxminutes`` after the observation, i.e. it is the last one.
+    Pairs without observations in the period can use the runs too.
+
+    :raises psycopg2.Error: if the table does not exist
+    """
+    sql = """
+    SELECT pairs.statid, pairs.seid
+    FROM unnest(%(statids)s::integer[], %(seids)s::integer[]) AS pairs(statid, seid)
+    LEFT JOIN LATERAL (
+        SELECT statobs.tfrom
+        FROM statobs
+        INNER JOIN seobs
+            ON statobs.id = seobs.obsid
+        WHERE statobs.statid = pairs.statid
+            AND seobs.seid = pairs.seid
+            AND statobs.tfrom BETWEEN %(time_from)s AND %(time_until)s
+        ORDER BY statobs.tfrom DESC
+        LIMIT 1) AS last_obs ON true
+    LEFT JOIN LATERAL (
+        SELECT vfrom, vuntil, maxminutes
+        FROM seobs_runs
+        WHERE statid = pairs.statid
+            AND seid = pairs.seid
+            AND vfrom <= last_obs.tfrom
+        ORDER BY vfrom DESC
+        LIMIT 1) AS last_run ON true
+    WHERE last_obs.tfrom IS NULL
+        OR (last_run.maxminutes = %(maxminutes)s
+            AND last_run.vuntil > last_obs.tfrom
+            AND (last_run.vuntil >= last_obs.tfrom + make_interval(mins := %(maxminutes)s)
+                OR EXISTS (
+                    SELECT 1 FROM seobs_runs
+                    WHERE statid = pairs.statid
+                        AND seid = pairs.seid
+                        AND vfrom > last_run.vfrom)));
+    """
+    pairs = sorted(pairs)
+    params = {'statids': [p[0] for p in pairs],
+              'seids': [p[1] for p in pairs],
+              'time_from': time_from,
+              'time_until': time_until,
+              'maxminutes': maxminutes}
+    with pg_conn.cursor() as cur:
+        cur.execute(sql, params)
+        return set(cur.fetchall())
+
+def block_query_values(operator, value_str):
+    """
+    Return the value(s) of a primary Block as list of number strings
+    for the prepared Block query, or ``None``
+    if they cannot be passed as numbers.
+    The strings are returned as given, so that PostgreSQL
+    rounds them the same way as the literals in ``pack_ranges``.
+    """
+    if operator == 'in':
+        value_str = value_str.strip()
+        if not (value_str.startswith('(') and value_str.endswith(')')):
+            return None
+        parts = value_str[1:-1].split(',')
+    else:
+        parts = [value_str]
+    parts = [v.strip() for v in parts]
+    try:
+        if not all(math.isfinite(float(v)) for v in parts):
+            return None
+    except ValueError:
+        return None
+    return parts
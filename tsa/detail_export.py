@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Columnar export of condition interval results, called by CondCollection
+
+import json
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+log = logging.getLogger(__name__)
+
+class DetailWriter:
+    """
+    Writes the result intervals of all conditions of a collection
+    into one Parquet file, one row group per condition,
+    as soon as each condition's results have been fetched.
+    Only the current condition is held in memory.
+
+    Columns of the file:
+
+    - ``condition``: condition identifier (``site_master_alias``)
+    - ``vfrom``, ``vuntil``: interval limits as UTC timestamps
+    - ``master``: condition value, null if no data
+    - ``blocks``: Block alias - value map, since Blocks differ by condition
+
+    Condition strings and Block raw logic are stored as JSON
+    in the file metadata under the key ``tsa_conditions``.
+    Requires ``pyarrow``, which is an optional dependency.
+
+    :param path: output file path; existing file is overwritten
+    :type path: string
+    :param conditions: conditions to be written, for the file metadata
+    :type conditions: iterable of Condition instances
+    """
+    def __init__(self, path, conditions):
+        if not HAS_PYARROW:
+            raise Exception('pyarrow is required for detail export')
+        self.path = path
+        self.n_conditions = 0
+        self.n_rows = 0
+        meta = {c.id_string: {'condition': c.condition,
+                              'blocks': {k: bl.raw_logic for k, bl in c.blocks.items()}}
+                for c in conditions}
+        self.schema = pyarrow.schema([
+            ('condition', pyarrow.string()),
+            ('vfrom', pyarrow.timestamp('us', tz='UTC')),
+            ('vuntil', pyarrow.timestamp('us', tz='UTC')),
+            ('master', pyarrow.bool_()),
+            ('blocks', pyarrow.map_(pyarrow.string(), pyarrow.bool_()))
+        ], metadata={'tsa_conditions': json.dumps(meta)})
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_condition(self, cnd):
+        """
+        Write result intervals of Condition ``cnd`` as a new row group.
+        Conditions without results are skipped.
+        """
+        res = cnd.results
+        if res is None or res.empty:
+            return
+        n = len(res)
+        aliases = [k for k in cnd.blocks.keys() if k in res.values]
+        block_values = zip(*[res.column(k) for k in aliases]) if aliases else [()] * n
+        table = pyarrow.Table.from_arrays([
+            pyarrow.array([cnd.id_string] * n, type=pyarrow.string()),
+            pyarrow.array(res.vfrom, type=pyarrow.timestamp('us', tz='UTC')),
+            pyarrow.array(res.vuntil, type=pyarrow.timestamp('us', tz='UTC')),
+            pyarrow.array(res.column('master'), type=pyarrow.bool_()),
+            pyarrow.array([list(zip(aliases, v)) for v in block_values],
+                          type=self.schema.field('blocks').type)
+        ], schema=self.schema)
+        self.writer.write_table(table)
+        self.n_conditions += 1
+        self.n_rows += n
+        log.debug(f'{n} rows of {str(cnd)} written to {self.path}')
+
+    def close(self):
+        self.writer.close()
+        log.info(f'{self.n_rows} rows of {self.n_conditions} conditions written to {self.path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
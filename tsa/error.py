@@ -2,27 +2,69 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import traceback
+from collections import OrderedDict
 from datetime import datetime
 
 log = logging.getLogger(__name__)
 
+# Order of log_add values from least to most severe
+SEVERITIES = ('', 'warning', 'error', 'exception', 'fatal')
+
 class TsaError:
     """
     Store non-fatal errors that can be saved to a log
     or printed after an analysis run, without interrupting the analysis.
+    ``log_add`` is the logging level the error was recorded with,
+    and ``exc_text`` the traceback text if it was an exception.
+
+    Errors with the same context and message are the same error:
+    ``count`` tells how many times it has occurred,
+    between ``timestamp`` (first time) and ``last_timestamp``.
     """
-    def __init__(self, msg, context, log_add=''):
+    def __init__(self, msg, context, log_add='', exc_text=None):
         self.msg = msg
         self.context = context
+        self.log_add = log_add
+        self.exc_text = exc_text
         self.timestamp = datetime.now()
-        self.n_more = 0
-        if log_add == '':
+        self.last_timestamp = self.timestamp
+        self.count = 1
+
+    @property
+    def key(self):
+        return (self.context, self.msg)
+
+    @property
+    def n_more(self):
+        return self.count - 1
+
+    def merge(self, log_add, count=1, exc_text=None):
+        """
+        Record another occurrence of the same error;
+        the most severe ``log_add`` is kept,
+        and ``exc_text`` if there was none yet.
+        """
+        if self.exc_text is None:
+            self.exc_text = exc_text
+        self.count += count
+        self.last_timestamp = datetime.now()
+        if SEVERITIES.index(log_add) > SEVERITIES.index(self.log_add):
+            self.log_add = log_add
+
+    def log(self):
+        """
+        Log the error according to ``log_add``.
+        """
+        if self.log_add == '':
             pass
-        elif log_add == 'warning':
+        elif self.log_add == 'warning':
             log.warning(self.with_context())
-        elif log_add == 'exception':
+        elif self.log_add == 'exception' and self.exc_text is not None:
+            log.error(self.with_context() + '\n' + self.exc_text)
+        elif self.log_add == 'exception':
             log.exception(self.with_context())
-        elif log_add == 'fatal':
+        elif self.log_add == 'fatal':
             log.fatal(self.with_context())
         else:
             log.error(self.with_context())
@@ -39,42 +81,93 @@ class TsaError:
     def __str__(self):
         s = f'{self.timestamp}; {self.context}: {self.msg}'
         if self.n_more > 0:
-            s += f' ({self.n_more} more similar errors)'
+            s += f' ({self.n_more} more similar errors, last at {self.last_timestamp})'
         return s
 
     def __repr__(self):
         return '<TsaError> ' + str(self)
 
     def __eq__(self, other):
-        return self.msg, self.context == other.msg, other.context
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
-    def __gt__(self, other):
-        return self.timestamp > other.timestamp
+    def __lt__(self, other):
+        return self.timestamp < other.timestamp
 
 class TsaErrCollection:
     """
     Container for errors of a tsa object.
     Provides methods for sorting and printing errors.
+    Errors are indexed by context and message,
+    so adding a duplicate only increases the count of the existing one.
 
     :example::
 
         >>> errs = TsaErrCollection('ANALYSIS / EXCEL FILE')
         >>> errs.add('Could not find Excel file, quitting', log_add='fatal')
     """
-    def __init__(self, context):
+    def __init__(self, context, silent=False):
         self.context = context
-        self.errors = list()
+        self.silent = silent
+        self.index = OrderedDict()
+
+    @property
+    def errors(self):
+        """
+        Unique errors in the order they were first added.
+        """
+        return list(self.index.values())
 
-    def add(self, msg, log_add=''):
+    def add(self, msg, log_add='', exc_text=None, count=1):
         """
         Add error while preventing duplicate errors;
-        for duplicates, only increase the first one's ``.n_more`` for printing.
+        for duplicates, only increase the first one's ``.count``.
+        A ``silent`` collection does not log the error
+        but stores the traceback of an exception for later use.
+
+        :raises ValueError: if ``log_add`` is not one of ``SEVERITIES``
         """
-        e = TsaError(msg, self.context, log_add)
-        if e in self.errors:
-            self.errors[self.errors.index(e)].n_more += 1
+        if log_add not in SEVERITIES:
+            raise ValueError(f'log_add must be one of {SEVERITIES}, got {log_add!r}')
+        if self.silent and log_add == 'exception' and exc_text is None:
+            exc_text = traceback.format_exc().rstrip()
+        e = self.index.get((self.context, msg))
+        if e is None:
+            e = TsaError(msg, self.context, log_add, exc_text)
+            e.count = count
+            self.index[e.key] = e
         else:
-            self.errors.append(e)
+            e.merge(log_add, count, exc_text)
+        if not self.silent:
+            e.log()
+
+    def extend(self, errors):
+        """
+        Add errors recorded in another collection,
+        in this collection's context.
+        """
+        for e in errors:
+            self.add(e.msg, e.log_add, e.exc_text, count=e.count)
+
+    def snapshot(self):
+        """
+        Return the counts of the errors, to be passed to ``.restore()``.
+        """
+        return OrderedDict((k, e.count) for k, e in self.index.items())
+
+    def restore(self, snapshot):
+        """
+        Forget the errors added after ``snapshot`` was taken,
+        e.g. by an attempt that is made again.
+        They remain in the log.
+        """
+        for k in list(self.index.keys()):
+            if k in snapshot:
+                self.index[k].count = snapshot[k]
+            else:
+                del self.index[k]
 
     def short_str(self):
         """
@@ -84,7 +177,7 @@ class TsaErrCollection:
         return '; '.join(errs)
 
     def __len__(self):
-        return len(self.errors)
+        return len(self.index)
 
     def __str__(self):
         return '\n'.join([str(e) for e in sorted(self.errors)])
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Readers for condition input files, called by AnalysisCollection
+
+import csv
+import logging
+import os
+import pandas
+import openpyxl as xl
+from .cond_collection import CondCollection
+from .cond_collection import TABLE_NAMES
+from collections import OrderedDict
+from functools import partial
+
+log = logging.getLogger(__name__)
+
+# Columns of the "table" layout;
+# ``sheet`` is optional and defaults to the file name
+TABLE_COLUMNS = ('sheet', 'start', 'end', 'site', 'master_alias', 'condition')
+
+def open_input(path):
+    """
+    Open condition input from ``path`` and return an OrderedDict
+    of sheet title - function pairs; calling the function
+    reads the sheet into a ``CondCollection``, so that errors
+    can be handled sheet by sheet.
+
+    Following inputs are supported:
+
+    - ``.xlsx`` workbook: one condition set per sheet,
+      see ``CondCollection.from_xlsx_sheet``.
+    - ``.csv`` file in the same layout as an Excel sheet
+      (as in ``example_data/``), titled by the file name.
+    - ``.csv`` or ``.parquet`` file in the "table" layout:
+      a header row with columns ``start``, ``end``, ``site``,
+      ``master_alias``, ``condition`` and optionally ``sheet``,
+      and one condition per row.
+    - Directory of ``.csv`` files in either of the layouts above,
+      read in file name order.
+    """
+    if os.path.isdir(path):
+        sheets = OrderedDict()
+        for fname in sorted(os.listdir(path)):
+            if fname.lower().endswith('.csv'):
+                sheets.update(open_input(os.path.join(path, fname)))
+        return sheets
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        wb = xl.load_workbook(filename=path, read_only=True)
+        return OrderedDict(
+            (title, partial(CondCollection.from_xlsx_sheet, ws=wb[title]))
+            for title in wb.sheetnames
+        )
+    if ext == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as fobj:
+            header = next(csv.reader(fobj), [])
+        header = [h.lower().strip() for h in header]
+        if 'condition' in header:
+            return read_table(pandas.read_csv(
+                path, dtype=str, keep_default_na=False, encoding='utf-8-sig'
+            ), default_title=file_title(path))
+        return OrderedDict([(file_title(path), partial(read_sheet_csv, path))])
+    if ext == '.parquet':
+        return read_table(pandas.read_parquet(path),
+                          default_title=file_title(path))
+    raise ValueError(f'Unsupported input file type "{ext}"')
+
+def file_title(path):
+    """
+    Return file name without directory and extension.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+def read_sheet_csv(path):
+    """
+    Read a CSV file in the Excel sheet layout into a ``CondCollection``:
+    start and end dates in cells A2 and B2,
+    condition rows from row 4 in columns A:C.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as fobj:
+        rows = list(csv.reader(fobj))
+    # Pad rows so that missing cells read as empty
+    rows = [(r + [''] * 3)[:3] for r in rows]
+    rows = [[v if v != '' else None for v in r] for r in rows]
+    dates = rows[1] if len(rows) > 1 else [None, None, None]
+    return CondCollection.from_rows(
+        title=file_title(path),
+        time_from=dates[0],
+        time_until=dates[1],
+        rows=enumerate(rows[3:], start=4)
+    )
+
+def read_table(df, default_title):
+    """
+    Split a DataFrame in the table layout into sheets.
+    Start and end dates must be the same on all rows of a sheet.
+    Row numbers refer to the file rows, header being the first one.
+    """
+    df.columns = [str(c).lower().strip() for c in df.columns]
+    missing = [c for c in TABLE_COLUMNS[1:] if c not in df.columns]
+    if missing:
+        raise ValueError(f'Missing columns in input table: {", ".join(missing)}')
+    if 'sheet' not in df.columns:
+        df['sheet'] = default_title
+    df['sheet'] = [cell_value(v) or default_title for v in df['sheet']]
+    df.index = range(2, len(df) + 2)
+
+    sheets = OrderedDict()
+    for title, grp in df.groupby('sheet', sort=False):
+        sheets[str(title)] = partial(table_to_collection, str(title), grp)
+    return sheets
+
+def cell_value(v):
+    """
+    Return ``None`` for missing values and empty strings,
+    otherwise the value as it is.
+    """
+    if v is None or v == '' or (not isinstance(v, str) and pandas.isna(v)):
+        return None
+    return v
+
+def table_to_collection(title, grp):
+    """
+    Read the rows of one sheet in the table layout into a ``CondCollection``.
+    """
+    dates = []
+    for col in ('start', 'end'):
+        values = set(cell_value(v) for v in grp[col]) - {None}
+        if len(values) > 1:
+            raise ValueError(f'Sheet <{title}> has {len(values)} different values in column "{col}"')
+        dates.append(values.pop() if values else None)
+    cells = zip(grp['site'], grp['master_alias'], grp['condition'])
+    rows = zip(grp.index, (tuple(cell_value(v) for v in c) for c in cells))
+    return CondCollection.from_rows(
+        title=title,
+        time_from=dates[0],
+        time_until=dates[1],
+        rows=rows,
+        names=TABLE_NAMES
+    )
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compact result intervals of a Condition, used instead of pandas DataFrames
+
+import numpy
+import pandas
+from collections import OrderedDict
+from datetime import timedelta
+
+# Codes of the three-valued Block and master values
+TRUE = 1
+FALSE = 0
+NULL = -1
+
+def to_epoch_us(t):
+    """
+    Return timezone-aware datetime ``t`` as microseconds since the epoch.
+    """
+    return pandas.Timestamp(t).value // 1000
+
+def to_codes(values):
+    """
+    Return boolean ``values`` with NULLs as an int8 array of
+    ``TRUE``, ``FALSE`` and ``NULL``.
+    """
+    return numpy.array([NULL if v is None or pandas.isna(v) else (TRUE if v else FALSE)
+                        for v in values], dtype=numpy.int8)
+
+class IntervalSeries:
+    """
+    Result intervals of a Condition: for each row, the start ``vfrom``
+    and end ``vuntil`` as int64 microseconds since the epoch (UTC),
+    and the value of each Block and ``master`` as int8 code
+    ``TRUE``, ``FALSE`` or ``NULL``, in ``values`` by column name.
+    Takes a fraction of the memory of the same DataFrame of Timestamps,
+    Timedeltas and object booleans; ``.to_frame()`` makes one when needed.
+
+    Rows are in time order, see ``Condition.get_fetch_sql``.
+
+    :param vfrom: int64 array
+    :param vuntil: int64 array
+    :param values: column name - int8 array, as OrderedDict
+    """
+    __slots__ = ('vfrom', 'vuntil', 'values')
+
+    def __init__(self, vfrom=None, vuntil=None, values=None):
+        self.vfrom = numpy.zeros(0, dtype=numpy.int64) if vfrom is None else vfrom
+        self.vuntil = numpy.zeros(0, dtype=numpy.int64) if vuntil is None else vuntil
+        self.values = OrderedDict() if values is None else values
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """
+        Make an instance of database rows like
+        ``(vfrom, vuntil, value, ...)`` of integers,
+        ``columns`` being the names of the values.
+        """
+        arr = numpy.array(rows, dtype=numpy.int64).reshape(len(rows), len(columns) + 2)
+        return cls(vfrom=arr[:, 0].copy(),
+                   vuntil=arr[:, 1].copy(),
+                   values=OrderedDict((c, arr[:, i+2].astype(numpy.int8))
+                                      for i, c in enumerate(columns)))
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Make an instance of a DataFrame like the one ``.to_frame()`` returns,
+        e.g. read from a checkpoint.
+        """
+        if df is None or 'vfrom' not in df.columns:
+            return cls()
+        df = df.sort_values('vfrom')
+
+        def epoch(col):
+            ts = pandas.to_datetime(df[col], utc=True)
+            return ts.values.astype('datetime64[us]').astype(numpy.int64)
+
+        return cls(vfrom=epoch('vfrom'),
+                   vuntil=epoch('vuntil'),
+                   values=OrderedDict((c, to_codes(df[c])) for c in df.columns
+                                      if c not in ('vfrom', 'vuntil', 'vdiff')))
+
+    @classmethod
+    def concat(cls, parts):
+        """
+        Join the rows of instances with the same columns.
+        """
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(vfrom=numpy.concatenate([p.vfrom for p in parts]),
+                   vuntil=numpy.concatenate([p.vuntil for p in parts]),
+                   values=OrderedDict((c, numpy.concatenate([p.values[c] for p in parts]))
+                                      for c in parts[0].columns))
+
+    @property
+    def columns(self):
+        return list(self.values.keys())
+
+    @property
+    def empty(self):
+        return len(self.vfrom) == 0
+
+    @classmethod
+    def combine(cls, expr, blocks):
+        """
+        Make the results of a Condition of the ranges of its Blocks
+        without the database, like ``Condition.get_select_sql``:
+        the rows are split at every bound of the Block ranges,
+        the value of a Block is that of its range covering the row
+        or ``NULL`` if there is none, and ``master`` is evaluated of
+        the Block values by syntax tree ``expr`` with the three-valued
+        logic of PostgreSQL, see ``tsa.condition_parser.Node.evaluate_codes``.
+        A single Block makes the rows as such.
+
+        :param expr: ``tsa.condition_parser.Node``
+        :param blocks: Block alias - instance with column of the alias,
+            as OrderedDict; ranges of a Block must not overlap
+        """
+        blocks = OrderedDict((k, b.select(numpy.argsort(b.vfrom, kind='stable')))
+                             for k, b in blocks.items())
+        if len(blocks) == 1:
+            k, b = next(iter(blocks.items()))
+            res = cls(vfrom=b.vfrom, vuntil=b.vuntil,
+                      values=OrderedDict([(k, b.values[k])]))
+        else:
+            bounds = numpy.unique(numpy.concatenate(
+                [b.vfrom for b in blocks.values()] + [b.vuntil for b in blocks.values()]))
+            res = cls(vfrom=bounds[:-1], vuntil=bounds[1:])
+            for k, b in blocks.items():
+                if b.empty:
+                    res.values[k] = numpy.full(len(res), NULL, dtype=numpy.int8)
+                    continue
+                # Last range starting at or before each row
+                i = numpy.searchsorted(b.vfrom, res.vfrom, side='right') - 1
+                covered = (i >= 0) & (b.vuntil[i.clip(0)] > res.vfrom)
+                res.values[k] = numpy.where(covered, b.values[k][i.clip(0)], NULL).astype(numpy.int8)
+        res.values['master'] = expr.evaluate_codes(res.values)
+        return res
+
+    def select(self, mask):
+        """
+        Return the rows of boolean array ``mask``,
+        or of an array of row numbers in their order.
+        """
+        return IntervalSeries(vfrom=self.vfrom[mask],
+                              vuntil=self.vuntil[mask],
+                              values=OrderedDict((c, v[mask]) for c, v in self.values.items()))
+
+    def ranges(self, name):
+        """
+        Return the ranges of the Block of column ``name``
+        as an instance with that column only:
+        consecutive rows with the same value make up one range,
+        and rows where the value is ``NULL`` are not covered,
+        see ``tsa.ranges.ranges_from_results``.
+        """
+        keep = self.values[name] != NULL
+        res = self.select(keep)
+        if res.empty:
+            return IntervalSeries(values=OrderedDict([(name, res.values[name])]))
+        res = res.select(numpy.argsort(res.vfrom, kind='stable'))
+        values = res.values[name]
+        new_range = numpy.ones(len(res), dtype=bool)
+        new_range[1:] = (res.vfrom[1:] != res.vuntil[:-1]) | (values[1:] != values[:-1])
+        start_pos = numpy.flatnonzero(new_range)
+        end_pos = numpy.append(start_pos[1:], len(res)) - 1
+        return IntervalSeries(vfrom=res.vfrom[start_pos],
+                              vuntil=res.vuntil[end_pos],
+                              values=OrderedDict([(name, values[start_pos])]))
+
+    def rename(self, columns):
+        """
+        Return the rows with the value columns renamed
+        by the old - new name pairs of dict ``columns``.
+        """
+        return IntervalSeries(vfrom=self.vfrom, vuntil=self.vuntil,
+                              values=OrderedDict((columns.get(c, c), v)
+                                                 for c, v in self.values.items()))
+
+    def datetimes(self, arr):
+        """
+        Return the epoch times ``arr``, e.g. ``.vfrom``,
+        as a list of timezone-aware datetimes.
+        """
+        return pandas.to_datetime(arr, unit='us', utc=True).to_pydatetime().tolist()
+
+    def column(self, name):
+        """
+        Return the values of column ``name`` as a list of ``True``, ``False`` or ``None``.
+        """
+        return [None if v == NULL else bool(v) for v in self.values[name].tolist()]
+
+    def rows(self, name):
+        """
+        Return the rows as ``(vfrom, vuntil, value)`` tuples of column ``name``.
+        """
+        return list(zip(self.datetimes(self.vfrom),
+                        self.datetimes(self.vuntil),
+                        self.column(name)))
+
+    def duration(self, name, code):
+        """
+        Return the total length of the rows
+        where column ``name`` has value ``code``.
+        """
+        mask = self.values[name] == code
+        return timedelta(microseconds=int((self.vuntil[mask] - self.vfrom[mask]).sum()))
+
+    def durations_between(self, name, code, bounds):
+        """
+        Return the total length of the rows where column ``name``
+        has value ``code`` within each period between consecutive
+        ``bounds``, given as sorted epoch microseconds,
+        as int64 microseconds array of ``len(bounds) - 1`` items.
+        Rows are split at the bounds, and all the periods
+        are computed in one pass over the rows.
+        """
+        mask = self.values[name] == code
+        vfrom = self.vfrom[mask]
+        lengths = self.vuntil[mask] - vfrom
+        order = numpy.argsort(vfrom, kind='stable')
+        vfrom = vfrom[order]
+        lengths = lengths[order]
+        bounds = numpy.asarray(bounds, dtype=numpy.int64)
+        if len(vfrom) == 0:
+            return numpy.zeros(max(len(bounds) - 1, 0), dtype=numpy.int64)
+        # Total length before each bound: complete rows before the row
+        # starting last at or before the bound, and the part of that row
+        before = numpy.concatenate([[0], numpy.cumsum(lengths)])
+        i = numpy.searchsorted(vfrom, bounds, side='right') - 1
+        part = numpy.clip(bounds - vfrom[i.clip(0)], 0, lengths[i.clip(0)])
+        cumulative = numpy.where(i >= 0, before[i.clip(0)] + part, 0)
+        return numpy.diff(cumulative)
+
+    def first(self):
+        """
+        Return the earliest start as a Timestamp, or ``None`` if empty.
+        """
+        if self.empty:
+            return None
+        return pandas.Timestamp(int(self.vfrom.min()), unit='us', tz='UTC')
+
+    def last(self):
+        """
+        Return the latest end as a Timestamp, or ``None`` if empty.
+        """
+        if self.empty:
+            return None
+        return pandas.Timestamp(int(self.vuntil.max()), unit='us', tz='UTC')
+
+    def to_frame(self):
+        """
+        Return the rows as a DataFrame of ``vfrom``, ``vuntil``, ``vdiff``
+        and the value columns, like the Condition table in the database:
+        booleans with NULLs as objects.
+        """
+        df = pandas.DataFrame(OrderedDict([
+            ('vfrom', pandas.to_datetime(self.vfrom, unit='us', utc=True)),
+            ('vuntil', pandas.to_datetime(self.vuntil, unit='us', utc=True)),
+            ('vdiff', pandas.to_timedelta(self.vuntil - self.vfrom, unit='us'))
+        ]))
+        for c, v in self.values.items():
+            if (v == NULL).any():
+                df[c] = pandas.Series(self.column(c), dtype=object)
+            else:
+                df[c] = v == TRUE
+        return df
+
+    def __len__(self):
+        return len(self.vfrom)
+
+    def __getstate__(self):
+        return (self.vfrom, self.vuntil, self.values)
+
+    def __setstate__(self, state):
+        self.vfrom, self.vuntil, self.values = state
+
+    def __repr__(self):
+        return f'<IntervalSeries> of {len(self)} rows, columns {", ".join(self.columns)}'
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Station and sensor metadata snapshot, used for the ids of Blocks
+
+import json
+import logging
+import os
+import psycopg2
+import threading
+from .utils import list_db_sensors
+from .utils import write_atomic
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+
+log = logging.getLogger(__name__)
+
+# Format version of the snapshot file; files of other versions are not read
+METADATA_VERSION = 1
+# Snapshot shipped with the package; read only, used until a snapshot is saved
+SEED_METADATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata.json')
+# Snapshot file saved by runs using the database, unless TSA_METADATA_PATH is set
+DEFAULT_METADATA_PATH = os.path.join('results', 'metadata.json')
+# Age after which runs using the database read the metadata again,
+# unless TSA_METADATA_TTL_HOURS is set
+DEFAULT_METADATA_TTL_HOURS = 24.0
+
+# Snapshots read by path, with the modification time of the file
+_cache = {}
+_cache_lock = threading.Lock()
+
+class MetadataSnapshot:
+    """
+    Station ids, sensor name - id pairs and the ids of discrete-valued
+    sensors as they were in the ``stations`` and ``sensors`` tables
+    at ``generated_at``.
+    Saved as a JSON file, so that dry validation can use up-to-date ids
+    without the database and full runs need not query them every time.
+
+    :param station_ids: station ids
+    :type station_ids: iterable of integers
+    :param sensors: sensor name - id pairs
+    :type sensors: dict
+    :param discrete_sensors: ids of the sensors marked ``discrete``,
+        whose runs of equal values are stored in ``seobs_runs``
+    :type discrete_sensors: iterable of integers
+    :param generated_at: time of reading the metadata
+    :type generated_at: datetime
+    :param source: where the metadata was read from
+    :type source: string
+    """
+    def __init__(self, station_ids, sensors, discrete_sensors=(), generated_at=None, source=None):
+        self.station_ids = set(station_ids)
+        self.sensors = dict(sensors)
+        self.discrete_sensors = set(discrete_sensors)
+        self.generated_at = generated_at or datetime.now().replace(microsecond=0)
+        self.source = source
+
+    @classmethod
+    def from_db(cls, pg_conn):
+        """
+        Read the metadata from the database.
+        Without the ``discrete`` column of ``sensors``
+        (see ``database/04_discrete_runs.sql``), no sensor is discrete.
+        """
+        with pg_conn.cursor() as cur:
+            cur.execute("SELECT id FROM stations;")
+            station_ids = [r[0] for r in cur.fetchall()]
+        sensors = list_db_sensors(pg_conn)
+        discrete_sensors = []
+        with pg_conn.cursor() as cur:
+            try:
+                cur.execute("SELECT id FROM sensors WHERE discrete;")
+                discrete_sensors = [r[0] for r in cur.fetchall()]
+                pg_conn.commit()
+            except psycopg2.Error:
+                pg_conn.rollback()
+                log.info('No discrete sensors in database')
+        params = pg_conn.get_dsn_parameters()
+        return cls(station_ids=station_ids,
+                   sensors=sensors,
+                   discrete_sensors=discrete_sensors,
+                   source=f"database {params.get('dbname')} at {params.get('host')}")
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read a snapshot saved by ``.write()``.
+        Snapshots without discrete sensors have none.
+
+        :raises ValueError: if the file is of another format version
+        """
+        with open(path) as fobj:
+            data = json.load(fobj)
+        if data.get('version') != METADATA_VERSION:
+            raise ValueError(f'{path} is of metadata version {data.get("version")}, '
+                             f'expected {METADATA_VERSION}')
+        return cls(station_ids=data['stations'],
+                   sensors=data['sensors'],
+                   discrete_sensors=data.get('discrete_sensors', []),
+                   generated_at=datetime.fromisoformat(data['generated_at']),
+                   source=data.get('source'))
+
+    def write(self, path):
+        data = OrderedDict([
+            ('version', METADATA_VERSION),
+            ('generated_at', self.generated_at.isoformat(timespec='seconds')),
+            ('source', self.source),
+            ('stations', sorted(self.station_ids)),
+            ('sensors', OrderedDict(sorted(self.sensors.items(), key=lambda kv: kv[1]))),
+            ('discrete_sensors', sorted(self.discrete_sensors))
+        ])
+        write_atomic(path, json.dumps(data, indent=2) + '\n')
+
+    def age(self):
+        return datetime.now() - self.generated_at
+
+    def __repr__(self):
+        return (f'<MetadataSnapshot of {len(self.station_ids)} stations '
+                f'and {len(self.sensors)} sensors at {self.generated_at.isoformat(timespec="seconds")}>')
+
+def metadata_path():
+    """
+    Return the path where snapshots read from the database are saved.
+    """
+    return os.environ.get('TSA_METADATA_PATH', DEFAULT_METADATA_PATH)
+
+def readable_metadata_path(path=None):
+    """
+    Return the snapshot file to read: ``path``, by default ``metadata_path()``,
+    or the packaged ``SEED_METADATA_PATH`` if no snapshot has been saved there.
+    """
+    path = path or metadata_path()
+    if os.path.exists(path):
+        return path
+    return SEED_METADATA_PATH
+
+def metadata_ttl():
+    """
+    Return the age after which the snapshot is read from the database again.
+    """
+    return timedelta(hours=float(os.environ.get('TSA_METADATA_TTL_HOURS',
+                                                DEFAULT_METADATA_TTL_HOURS)))
+
+def load_metadata(path=None):
+    """
+    Return the ``MetadataSnapshot`` saved to ``path``, by default ``metadata_path()``,
+    or the packaged one if none is saved there, see ``readable_metadata_path()``.
+    The file is read again only when its modification time changes,
+    so the same snapshot is shared by the runs of a process.
+    """
+    path = readable_metadata_path(path)
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        snapshot = MetadataSnapshot.read(path)
+        _cache[path] = (mtime, snapshot)
+    log.info(f'Read {repr(snapshot)} from {path}')
+    return snapshot
+
+def current_metadata(pg_conn, path=None, ttl=None, refresh=False):
+    """
+    Return the ``MetadataSnapshot`` for a run using the database:
+    the one saved to ``path`` (by default ``metadata_path()``),
+    or the packaged one if none is saved there, if it is younger than ``ttl``
+    (by default ``metadata_ttl()``), otherwise, or if ``refresh`` is ``True``,
+    one read from the database through ``pg_conn`` and saved to ``path``.
+    The packaged snapshot is never overwritten.
+    A snapshot that cannot be saved is still used.
+    """
+    path = path or metadata_path()
+    ttl = metadata_ttl() if ttl is None else ttl
+    read_path = readable_metadata_path(path)
+    if not refresh:
+        try:
+            snapshot = load_metadata(read_path)
+            if snapshot.age() < ttl:
+                return snapshot
+            log.info(f'Metadata snapshot {read_path} is older than {ttl}, '
+                     'reading metadata from database')
+        except:
+            log.warning(f'Cannot read metadata snapshot {read_path}, reading metadata from database',
+                        exc_info=True)
+    snapshot = MetadataSnapshot.from_db(pg_conn)
+    try:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        snapshot.write(path)
+        with _cache_lock:
+            _cache[path] = (os.path.getmtime(path), snapshot)
+        log.info(f'Saved {repr(snapshot)} to {path}')
+    except:
+        log.exception(f'Cannot save metadata snapshot to {path}')
+    return snapshot
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Live status and metrics files of an analysis run, used by AnalysisCollection
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from .utils import trunc_str
+from .utils import write_atomic
+from collections import OrderedDict
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# Stages of tsa.profiling timings that are spent in the database
+DB_STAGES = ('obs_view', 'block', 'combine', 'fetch', 'explain')
+
+# Max length of the current statement in the status file
+MAX_STATEMENT_LEN = 500
+
+class RunMonitor:
+    """
+    Writes the progress of an ``AnalysisCollection`` run
+    to a JSON status file and a Prometheus textfile
+    (for the node_exporter textfile collector),
+    every ``interval`` seconds in a background thread
+    and whenever a collection starts or ends.
+    Since the files are rewritten also while a database statement
+    is running, a stalled run shows as a growing statement age,
+    not as a missing update.
+
+    Progress is counted in steps: each Condition takes two,
+    its temp table and its result fetch; Powerpoint reports
+    made in worker processes are not included.
+    The current statement is read from ``pg_stat_activity``
+    of the collection's database session, using a connection
+    of the analysis' connection pool.
+    Files are replaced atomically, so readers never see partial contents.
+
+    :param anls: AnalysisCollection to follow
+    :param status_path: path of the JSON status file
+    :param metrics_path: path of the Prometheus textfile,
+        should end with ``.prom``; ``None`` to not write one
+    :param interval: seconds between updates
+    """
+    def __init__(self, anls, status_path, metrics_path=None, interval=10.0):
+        self.anls = anls
+        self.status_path = status_path
+        self.metrics_path = metrics_path
+        self.interval = interval
+
+        self.started_at = None
+        self.finished = False
+        self.current = None
+        self.backend_pid = None
+        self.backend_pool = None
+        self.collections_done = []
+
+        self._lock = threading.Lock()
+        # Order of the status snapshots, so that a slow update
+        # does not overwrite the status written by a later one
+        self._seq = itertools.count()
+        self._written_seq = -1
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Write the first status and start updating it in the background.
+        """
+        self.started_at = datetime.now()
+        self.update()
+        # Run in the context of the caller, see tsa.service.JobLogFilter
+        self._thread = threading.Thread(target=contextvars.copy_context().run,
+                                        args=(self._run,),
+                                        name='tsa-monitor',
+                                        daemon=True)
+        self._thread.start()
+        log.info(f'Run status is written to {self.status_path} every {self.interval} s')
+
+    def stop(self):
+        """
+        Stop the background updates and write the final status.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.current = None
+        self.backend_pid = None
+        self.finished = True
+        self.update()
+
+    def collection_started(self, key, pg_conn, db_pool=None):
+        """
+        Follow the collection ``key`` of the AnalysisCollection,
+        analyzed in the session of ``pg_conn``
+        (``None`` if it is not using the database).
+        ``db_pool`` is used to read the current statement,
+        if the session is not on the host of the analysis' pool.
+        Of collections analyzed concurrently, the one started last is followed.
+        """
+        with self._lock:
+            self.current = key
+            self.backend_pid = None if pg_conn is None else pg_conn.get_backend_pid()
+            self.backend_pool = db_pool
+        self.update()
+
+    def collection_finished(self, key):
+        with self._lock:
+            self.collections_done.append(key)
+            if self.current == key:
+                self.current = None
+                self.backend_pid = None
+                self.backend_pool = None
+        self.update()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.update()
+
+    def current_statement(self, pid, pool):
+        """
+        Return state, query and age in seconds of the statement
+        running in session ``pid``, read using a connection of ``pool``,
+        or ``None``.
+        """
+        if pid is None or pool is None:
+            return None
+        sql = ("SELECT state, query, "
+               "EXTRACT(epoch FROM clock_timestamp() - query_start)::float8 "
+               "FROM pg_stat_activity WHERE pid = %s;")
+        with pool.connection() as pg_conn:
+            with pg_conn.cursor() as cur:
+                cur.execute(sql, (pid,))
+                row = cur.fetchone()
+        if row is None or row[0] != 'active':
+            return None
+        return OrderedDict([('state', row[0]),
+                            ('query', trunc_str(row[1], n=MAX_STATEMENT_LEN)),
+                            ('age_seconds', round(row[2], 3))])
+
+    def status(self):
+        """
+        Return the current status as a dict.
+        """
+        return self._status()[1]
+
+    def _status(self):
+        """
+        Return the order number of a status snapshot and the status.
+        The current statement is read without holding the lock,
+        so that starting and finishing collections never wait for it.
+        """
+        with self._lock:
+            seq = next(self._seq)
+            current = self.current
+            pid = self.backend_pid
+            pool = self.backend_pool or self.anls.db_pool
+            collections_done = list(self.collections_done)
+        now = datetime.now()
+        elapsed = (now - self.started_at).total_seconds() if self.started_at else 0.0
+        n_collections = len(self.anls.collections)
+        n_conditions = 0
+        n_conditions_done = 0
+        steps = 0
+        steps_done = 0
+        db_seconds = 0.0
+        n_errors = len(self.anls.errors)
+        for key, coll in self.anls.collections.items():
+            n = len(coll.conditions)
+            n_conditions += n
+            steps += 2*n
+            if key in collections_done:
+                n_conditions_done += n
+                steps_done += 2*n
+            else:
+                n_conditions_done += coll.n_fetched
+                steps_done += coll.n_temptables_done + coll.n_fetched
+            db_seconds += sum(v for k, v in coll.timings.by_stage().items() if k in DB_STAGES)
+            n_errors += len(coll.errors)
+            for cond in coll.conditions.values():
+                db_seconds += sum(v for k, v in cond.timings.by_stage().items() if k in DB_STAGES)
+                n_errors += len(cond.errors) + sum(len(bl.errors) for bl in cond.blocks.values())
+
+        # ETA assumes the remaining steps take as long as the ones so far
+        throughput = steps_done / 2 / elapsed * 60 if elapsed > 0 else 0.0
+        if self.finished:
+            eta_seconds = 0.0
+        elif steps_done > 0:
+            eta_seconds = (steps - steps_done) * elapsed / steps_done
+        else:
+            eta_seconds = None
+
+        try:
+            statement = self.current_statement(pid, pool)
+        except:
+            log.warning('Could not read current statement for run status', exc_info=True)
+            statement = None
+
+        return seq, OrderedDict([
+            ('name', self.anls.name),
+            ('pid', os.getpid()),
+            ('started_at', self.started_at.isoformat(timespec='seconds') if self.started_at else None),
+            ('updated_at', now.isoformat(timespec='seconds')),
+            ('elapsed_seconds', round(elapsed, 3)),
+            ('finished', self.finished),
+            ('collections', OrderedDict([('total', n_collections),
+                                         ('done', len(collections_done)),
+                                         ('current', current)])),
+            ('conditions', OrderedDict([('total', n_conditions),
+                                        ('done', n_conditions_done)])),
+            ('steps', OrderedDict([('total', steps),
+                                   ('done', steps_done)])),
+            ('conditions_per_minute', round(throughput, 3)),
+            ('eta_seconds', None if eta_seconds is None else round(eta_seconds, 1)),
+            ('db_seconds', round(db_seconds, 3)),
+            ('errors', n_errors),
+            ('current_statement', statement)
+        ])
+
+    def update(self):
+        """
+        Write the status file and the metrics file.
+        Errors are logged but not raised: monitoring must not
+        interrupt the analysis.
+        """
+        try:
+            seq, st = self._status()
+            with self._lock:
+                if seq < self._written_seq:
+                    return
+                self._written_seq = seq
+                write_atomic(self.status_path, json.dumps(st, indent=2) + '\n')
+                if self.metrics_path is not None:
+                    write_atomic(self.metrics_path, to_prometheus(st))
+        except:
+            log.warning('Could not write run status', exc_info=True)
+
+def to_prometheus(st):
+    """
+    Return run status dict ``st`` as Prometheus text exposition format.
+    All metrics are labelled by the run name.
+    """
+    name = st['name'].replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    label = f'{{run="{name}"}}'
+    statement = st['current_statement']
+    metrics = [
+        ('tsa_run_start_timestamp_seconds', 'gauge', 'Start time of the run',
+         datetime.fromisoformat(st['started_at']).timestamp() if st['started_at'] else None),
+        ('tsa_run_last_update_timestamp_seconds', 'gauge', 'Time of this status update',
+         time.time()),
+        ('tsa_run_finished', 'gauge', 'Whether the run has ended',
+         int(st['finished'])),
+        ('tsa_collections', 'gauge', 'Collections in the run',
+         st['collections']['total']),
+        ('tsa_collections_done', 'gauge', 'Collections analyzed',
+         st['collections']['done']),
+        ('tsa_conditions', 'gauge', 'Conditions in the run',
+         st['conditions']['total']),
+        ('tsa_conditions_done', 'gauge', 'Conditions with results fetched',
+         st['conditions']['done']),
+        ('tsa_conditions_per_minute', 'gauge', 'Mean throughput of the run',
+         st['conditions_per_minute']),
+        ('tsa_eta_seconds', 'gauge', 'Estimated time until the analyses are done',
+         st['eta_seconds']),
+        ('tsa_db_seconds_total', 'counter', 'Time spent in database statements',
+         st['db_seconds']),
+        ('tsa_errors', 'gauge', 'Errors recorded so far',
+         st['errors']),
+        ('tsa_current_statement_age_seconds', 'gauge',
+         'Age of the running database statement, 0 if none',
+         statement['age_seconds'] if statement else 0),
+    ]
+    lines = []
+    for metric, mtype, mhelp, value in metrics:
+        if value is None:
+            continue
+        lines.append(f'# HELP {metric} {mhelp}')
+        lines.append(f'# TYPE {metric} {mtype}')
+        lines.append(f'{metric}{label} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Calendar periods for the validity breakdown of Conditions, called by Condition and CondCollection
+
+import pandas
+from collections import OrderedDict
+
+# Period lengths and the corresponding pandas period frequencies;
+# weeks start on Monday
+PERIODS = OrderedDict([
+    ('day', 'D'),
+    ('week', 'W-SUN'),
+    ('month', 'M')
+])
+
+# Columns of the breakdown worksheet, see ``CondCollection.breakdown_rows``
+BREAKDOWN_COLUMNS = ('site', 'master_alias', 'period', 'period_from', 'period_until',
+                     'valid', 'notvalid', 'nodata',
+                     'valid_hours', 'notvalid_hours', 'nodata_hours')
+
+# Max number of periods shown on a slide; longer breakdowns are only in the worksheet
+SLIDE_MAX_PERIODS = 13
+
+def period_bounds(time_from, time_until, period):
+    """
+    Return the starts of the calendar periods of length ``period``,
+    a key of ``PERIODS``, between timezone-aware Timestamps
+    ``time_from`` and ``time_until``,
+    preceded by ``time_from`` and followed by ``time_until``,
+    as a list of UTC Timestamps: the first and the last period
+    are cut to the given times. Periods are in UTC.
+    """
+    naive_from = time_from.tz_convert('UTC').tz_localize(None)
+    naive_until = time_until.tz_convert('UTC').tz_localize(None)
+    starts = pandas.period_range(start=naive_from, end=naive_until,
+                                 freq=PERIODS[period]).start_time
+    inner = [t.tz_localize('UTC') for t in starts if naive_from < t < naive_until]
+    return [time_from.tz_convert('UTC')] + inner + [time_until.tz_convert('UTC')]
+
+def period_label(t, period):
+    """
+    Return the name of the ``period`` containing Timestamp ``t``
+    for reports, e.g. ``03/2018`` for a month.
+    """
+    if period == 'day':
+        return t.strftime('%d.%m.%Y')
+    if period == 'week':
+        year, week, _ = t.isocalendar()
+        return f'vk {week}/{year}'
+    return t.strftime('%m/%Y')
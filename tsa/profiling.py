@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Stage timings and query plans of tsa objects
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Stages timed for each Condition:
+# Block temp tables, the Condition temp table combining them,
+# fetching results, timeline plot and the rest of the report slide
+CONDITION_STAGES = ('block', 'combine', 'fetch', 'plot', 'slide')
+
+class TsaTiming:
+    """
+    Time spent in one stage of processing a tsa object.
+    If the stage ran a database statement, ``sql`` is the statement
+    and ``setup`` the statements it depends on in the same transaction,
+    so that its query plan can be captured afterwards with ``.explain()``.
+    """
+    def __init__(self, stage, context, seconds, block=None, sql=None, setup=None):
+        self.stage = stage
+        self.context = context
+        self.seconds = seconds
+        self.block = block
+        self.sql = sql
+        self.setup = setup or []
+        self.plan = None
+
+    @property
+    def is_statement(self):
+        return self.sql is not None
+
+    def explain(self, pg_conn):
+        """
+        Run the setup statements and the statement again
+        with ``EXPLAIN (ANALYZE, BUFFERS)``, and store the plan
+        in ``.plan``. The transaction is rolled back afterwards,
+        so temp tables created meanwhile are dropped.
+        Note that the plan of a ``pack_ranges`` call
+        only shows the function scan, not the query inside.
+        """
+        with pg_conn.cursor() as cur:
+            try:
+                for sql in self.setup:
+                    cur.execute(sql)
+                cur.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {self.sql}')
+                plan = cur.fetchone()[0]
+            finally:
+                pg_conn.rollback()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        self.plan = plan
+
+    def to_dict(self, plan=False):
+        """
+        Return the timing as a dict for JSON output;
+        the query plan is included if ``plan`` is ``True``.
+        """
+        d = OrderedDict(stage=self.stage, seconds=round(self.seconds, 6))
+        if self.block is not None:
+            d['block'] = self.block
+        if self.sql is not None:
+            d['sql'] = self.sql
+        if plan:
+            d['plan'] = self.plan
+        return d
+
+    def __str__(self):
+        s = f'{self.context}'
+        if self.block is not None:
+            s += f' / {self.block}'
+        return s + f' {self.stage}: {self.seconds:.3f} s'
+
+    def __repr__(self):
+        return '<TsaTiming> ' + str(self)
+
+class TsaTimings:
+    """
+    Container for stage timings of a tsa object,
+    the counterpart of ``TsaErrCollection`` for performance.
+
+    :example::
+
+        >>> timings = TsaTimings('s1122_a')
+        >>> with timings.time('fetch'):
+        ...     df = pandas.read_sql(sql, con=pg_conn)
+        >>> timings.seconds('fetch')
+        0.153
+    """
+    def __init__(self, context):
+        self.context = context
+        self.timings = []
+
+    @contextmanager
+    def time(self, stage, block=None, sql=None, setup=None):
+        """
+        Time the ``with`` block as ``stage``;
+        the time is recorded also if the block raises an exception.
+        See ``TsaTiming`` for the other parameters.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append(TsaTiming(stage=stage,
+                                          context=self.context,
+                                          seconds=time.perf_counter() - start,
+                                          block=block,
+                                          sql=sql,
+                                          setup=setup))
+
+    def extend(self, timings):
+        """
+        Add timings recorded in another collection,
+        in this collection's context.
+        """
+        for t in timings:
+            t.context = self.context
+            self.timings.append(t)
+
+    def statements(self):
+        """
+        Timings of database statements.
+        """
+        return [t for t in self.timings if t.is_statement]
+
+    def seconds(self, stage=None):
+        """
+        Total seconds of ``stage``, or of all stages if ``None``.
+        """
+        return sum(t.seconds for t in self.timings
+                   if stage is None or t.stage == stage)
+
+    def by_stage(self):
+        """
+        Return stage - total seconds pairs in the order
+        the stages were first recorded.
+        """
+        d = OrderedDict()
+        for t in self.timings:
+            d[t.stage] = d.get(t.stage, 0.0) + t.seconds
+        return d
+
+    def __len__(self):
+        return len(self.timings)
+
+    def __str__(self):
+        return '\n'.join(str(t) for t in self.timings)
+
+    def __repr__(self):
+        return f'<TsaTimings> with {len(self)} timings'
+
+def slowest(timings, n):
+    """
+    Return the ``n`` slowest of ``timings``, slowest first.
+    """
+    return sorted(timings, key=lambda t: t.seconds, reverse=True)[:n]
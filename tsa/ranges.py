@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Block ranges as lists, for joining results computed in parts
+
+def ranges_from_results(results, column):
+    """
+    Return the ranges of Block ``column`` in Condition results ``results``,
+    a ``tsa.intervals.IntervalSeries``,
+    as list of ``(lower, upper, value)`` tuples in time order.
+
+    Consecutive result rows with the same value make up one range:
+    ranges of a Block never touch each other with the same value,
+    since a new range starts only when the value changes.
+    Rows where ``column`` is NULL are not covered by the Block,
+    which assumes that no range has a NULL value;
+    this holds for primary Blocks since ``seobs.seval`` is ``NOT NULL``.
+    """
+    rng = results.ranges(column)
+    return list(zip(results.datetimes(rng.vfrom),
+                    results.datetimes(rng.vuntil),
+                    [bool(v) for v in rng.values[column].tolist()]))
+
+def join_ranges(head, tail):
+    """
+    Join Block ranges ``tail`` to the end of ``head``.
+
+    ``tail`` must be computed from the observations starting with
+    the one that followed the last observation in ``head``'s ranges:
+    the last observation of a series does not make a range of its own,
+    since the time until the next one is not known, but it still can
+    continue the last range.
+    Thus if the first range of ``tail`` has the same value as the last one
+    of ``head``, they are the same range; the upper bound is that of ``tail``
+    since the max validity of an observation is applied to each one.
+    Querying ``tail`` from the upper bound of the last range of ``head``
+    starts it with the right observation.
+    """
+    if head and tail and head[-1][2] == tail[0][2]:
+        return head[:-1] + [(head[-1][0], tail[0][1], head[-1][2])] + tail[1:]
+    return head + tail
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# PowerPoint report template and deck rendering, called by CondCollection
+
+import logging
+import os
+import pptx
+from .error import TsaErrCollection
+from .profiling import TsaTimings
+from io import BytesIO
+
+log = logging.getLogger(__name__)
+
+# Placeholder indices of the default layout of the report template
+PLACEHOLDERS = dict(
+    HEADER_IDX = 17,     # Slide header placeholder
+    TITLE_IDX = 0,       # Condition title placeholder
+    BODY_IDX = 13,       # Condition string placeholder
+    TIMERANGE_IDX = 15,  # Placeholder for condition start/end time text
+    VALIDTABLE_IDX = 18, # Validity time/percentage table placeholder
+    ERRORS_IDX = 19,     # Placeholder for errors and warnings
+    MAINPLOT_IDX = 11,   # Main timeline plot placeholder
+    FOOTER_IDX = 16,     # Slide footer placeholder
+)
+MAINPLOT_H_PX = 3840     # Main timeline plot height in pixels
+
+class ReportTemplate:
+    """
+    PowerPoint file that includes the master layout
+    for the TSA report and nothing else.
+    The file is read and its default layout validated only once;
+    new presentations are then opened from the bytes in memory.
+    Instances are small and can be passed to worker processes.
+
+    :param path: filepath or file-like object of the template
+    :raises Exception: if the layout misses any of ``PLACEHOLDERS``
+    """
+    def __init__(self, path):
+        if hasattr(path, 'read'):
+            self.name = getattr(path, 'name', '<file object>')
+            self.data = path.read()
+        else:
+            self.name = path
+            with open(path, 'rb') as fobj:
+                self.data = fobj.read()
+
+        pres = self.new_presentation()
+        layout = pres.slide_layouts[0]
+        # Ensure placeholder indices exist as they should
+        indices_in_pres = [ph.placeholder_format.idx for ph in layout.placeholders]
+        for k, v in PLACEHOLDERS.items():
+            if v not in indices_in_pres:
+                raise Exception(f'{k} {v} not in default layout placeholders of {self.name}')
+
+        # Plot pixel size follows the proportions of the plot placeholder
+        plot_ph = [ph for ph in layout.placeholders
+                   if ph.placeholder_format.idx == PLACEHOLDERS['MAINPLOT_IDX']][0]
+        self.plot_size_px = (MAINPLOT_H_PX, plot_ph.height / plot_ph.width * MAINPLOT_H_PX)
+        log.debug(f'Report template {self.name} validated')
+
+    def new_presentation(self):
+        """
+        Return a new ``pptx`` presentation object based on the template.
+        """
+        return pptx.Presentation(BytesIO(self.data))
+
+    def __str__(self):
+        return f'<ReportTemplate {self.name}>'
+
+def render_deck(coll, template, out_path, png_dir=None):
+    """
+    Save ``coll.to_pptx()`` to ``out_path``.
+    Meant to be run in a worker process: errors and timings recorded meanwhile
+    are not logged here but returned, so they can be merged
+    into the original collection by ``CondCollection.merge_report``.
+
+    :param coll: CondCollection, or a part of one, with results fetched
+    :param template: ReportTemplate instance
+    :return: tuple of collection errors, collection timings
+        and dict of condition ``(errors, timings)`` by id
+    """
+    coll.errors = TsaErrCollection(coll.errors.context, silent=True)
+    coll.timings = TsaTimings(coll.timings.context)
+    for c in coll.conditions.values():
+        c.errors = TsaErrCollection(c.errors.context, silent=True)
+        c.timings = TsaTimings(c.timings.context)
+    pres = coll.to_pptx(pptx_template=template, png_dir=png_dir)
+    with coll.timings.time('save_pptx'):
+        pres.save(out_path)
+    return (coll.errors.errors,
+            coll.timings.timings,
+            {k: (c.errors.errors, c.timings.timings) for k, c in coll.conditions.items()})
+
+def deck_paths(out_path, n_slides, max_slides=None):
+    """
+    Return paths of the decks to make of ``n_slides`` slides:
+    ``out_path`` itself if all the slides fit in one deck,
+    otherwise numbered paths ``[out_path]_1.pptx``, ``[out_path]_2.pptx`` ...
+    with at most ``max_slides`` slides each.
+
+    :raises ValueError: if ``max_slides`` is less than 1
+    """
+    if max_slides is not None and max_slides < 1:
+        raise ValueError(f'max_slides must be at least 1, got {max_slides}')
+    if max_slides is None or n_slides <= max_slides:
+        return [out_path]
+    base = os.path.splitext(out_path)[0]
+    n_decks = -(-n_slides // max_slides)
+    return [f'{base}_{i+1}.pptx' for i in range(n_decks)]
@@ -0,0 +1,601 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Long-running analysis service: HTTP job queue with warm state
+
+import asyncio
+import contextvars
+import io
+import itertools
+import json
+import logging
+import os
+import re
+from .analysis_collection import AnalysisCollection
+from .analysis_collection import PPTX_TEMPLATE_PATH
+from .db import DBParams
+from .db import ConnectionPool
+from .db import ReplicaPool
+from .db import DEFAULT_POOL_SIZE
+from .metadata import current_metadata
+from .metadata import load_metadata
+from .metadata import metadata_ttl
+from .monitor import RunMonitor
+from .report import ReportTemplate
+from .utils import to_filename
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+# Max size of a request body, i.e. an uploaded input file
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+# Finished jobs are forgotten, oldest first, above this number
+MAX_FINISHED_JOBS = 500
+
+# Job names are used in file names under results/
+JOB_NAME_PATTERN = re.compile(r'[\w.-]+')
+
+# Directory of the input files given by path, unless set otherwise
+DEFAULT_INPUT_DIR = 'input'
+
+# Id of the job whose log records are written in the current context,
+# see JobLogFilter
+current_job_id = contextvars.ContextVar('tsa_job_id', default=None)
+
+# Input file types accepted as upload
+UPLOAD_SUFFIXES = ('.xlsx', '.csv', '.parquet')
+
+# Job options and their types, given as JSON or query parameters
+JOB_OPTIONS = OrderedDict([
+    ('dryvalidate', bool),
+    ('details', bool),
+    ('breakdown', str),
+    ('max_slides', int),
+    ('explain_slowest', int),
+    ('resume', bool),
+    ('extend', str)
+])
+
+# Least allowed values of numeric job options
+OPTION_MINIMUMS = {
+    'max_slides': 1,
+    'explain_slowest': 0
+}
+
+# Same format as in tsabatch.py
+LOG_FORMAT = '%(asctime)s; %(levelname)-8s; %(module)-20s; line %(lineno)-3d; %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+class RequestError(Exception):
+    """
+    Error in a request, returned to the client with HTTP ``status``.
+    """
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+
+def option_value(key, value):
+    """
+    Convert job option ``value`` to its type in ``JOB_OPTIONS``;
+    query parameter strings like ``1``, ``true`` and ``yes`` are true.
+    """
+    if key not in JOB_OPTIONS:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f'Unknown option {key}')
+    if value is None:
+        return None
+    tp = JOB_OPTIONS[key]
+    if tp is bool and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    try:
+        value = tp(value)
+    except (TypeError, ValueError):
+        raise RequestError(HTTPStatus.BAD_REQUEST, f'Invalid value of {key}: {value}')
+    if key in OPTION_MINIMUMS and value < OPTION_MINIMUMS[key]:
+        raise RequestError(HTTPStatus.BAD_REQUEST,
+                           f'{key} must be at least {OPTION_MINIMUMS[key]}')
+    return value
+
+def check_name(name, key='name'):
+    """
+    Return job ``name`` if it is valid as part of file names,
+    ``key`` being the name of the parameter for the error message.
+    """
+    if not name or not JOB_NAME_PATTERN.fullmatch(name):
+        raise RequestError(HTTPStatus.BAD_REQUEST,
+                           f'{key} must consist of letters, digits, "_", "." and "-"')
+    return name
+
+def check_input_path(path, input_dir):
+    """
+    Return input file or directory ``path``
+    if it is within ``input_dir``, also after resolving symbolic links.
+    """
+    if not path:
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'No input given')
+    real_dir = os.path.realpath(input_dir)
+    if os.path.commonpath([os.path.realpath(path), real_dir]) != real_dir:
+        raise RequestError(HTTPStatus.FORBIDDEN, f'Input must be in directory {input_dir}')
+    return path
+
+def save_upload(path, body):
+    """
+    Write uploaded input file contents ``body`` to ``path``.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fobj:
+        fobj.write(body)
+
+class JobLogFilter(logging.Filter):
+    """
+    Passes the log records made in the context of one job only,
+    so that concurrent jobs get their own log files.
+    The job is set in ``current_job_id`` by ``AnalysisService.run_job``,
+    and the worker threads of the job run in copies of its context,
+    see ``tsa.utils.ContextThreadPoolExecutor``.
+    """
+    def __init__(self, job_id):
+        super().__init__()
+        self.job_id = job_id
+
+    def filter(self, record):
+        return current_job_id.get() == self.job_id
+
+class AnalysisJob:
+    """
+    An analysis of an input file submitted to ``AnalysisService``,
+    run like ``tsabatch.py`` with the options in ``JOB_OPTIONS``.
+
+    :param job_id: id of the job in the service
+    :param name: base name of the output files under ``results/``
+    :param input_path: input file or directory
+    :param options: dict of options
+    """
+    def __init__(self, job_id, name, input_path, options):
+        self.id = job_id
+        self.name = name
+        self.input_path = input_path
+        self.options = options
+        self.status = 'queued'
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.files = []
+        self.has_errors = None
+        self.errors = None
+        self.message = None
+
+    def option(self, key):
+        return self.options.get(key, None)
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def log_path(self):
+        return os.path.join('results', f'{self.name}.log')
+
+    @property
+    def status_path(self):
+        return os.path.join('results', f'{self.name}_status.json')
+
+    def progress(self):
+        """
+        Return the latest run status written by the job's
+        ``tsa.monitor.RunMonitor``, or ``None``.
+        """
+        if self.status != 'running' or not os.path.exists(self.status_path):
+            return None
+        try:
+            with open(self.status_path) as fobj:
+                return json.load(fobj)
+        except:
+            return None
+
+    def to_dict(self, full=True):
+        """
+        Return the job as JSON serializable dict;
+        without ``full``, the error tree and progress are left out.
+        """
+        d = OrderedDict([
+            ('id', self.id),
+            ('name', self.name),
+            ('input', self.input_path),
+            ('options', self.options),
+            ('status', self.status),
+            ('submitted_at', self.submitted_at.isoformat()),
+            ('started_at', self.started_at and self.started_at.isoformat()),
+            ('finished_at', self.finished_at and self.finished_at.isoformat()),
+            ('has_errors', self.has_errors),
+            ('message', self.message),
+            ('files', self.files)
+        ])
+        if full:
+            d['progress'] = self.progress()
+            d['errors'] = self.errors
+        return d
+
+class AnalysisService:
+    """
+    Runs analysis jobs submitted over HTTP, keeping the state
+    that ``tsabatch.py`` would set up for each run:
+    the database connection pool (whose sessions keep the prepared
+    Block query), the sensor name-id pairs of the database,
+    the report template and the Powerpoint worker processes,
+    as well as the caches of the process such as parsed conditions.
+
+    Jobs wait in a queue of at most ``queue_size`` jobs
+    and ``concurrency`` of them are run at a time, each in its own thread.
+    The HTTP API, all responses being JSON:
+
+    - ``POST /jobs``: submit a job. Either a JSON body with ``input``
+      (path of an input file or directory on the server within ``input_dir``,
+      see ``tsabatch.py -i``),
+      ``name`` (base name of the output files) and options of ``JOB_OPTIONS``,
+      or the input file itself as body with ``name``, ``filename`` and options
+      as query parameters. Returns the job with status ``202``,
+      ``503`` if the queue is full and ``409`` if a job of the same name is active.
+    - ``GET /jobs``: list the jobs without error trees.
+    - ``GET /jobs/{id}``: status of the job, its latest run status while running
+      and, once finished, the result files and the error tree
+      like in ``results/[name]_ERRORS.json``.
+    - ``GET /status``: queue length, running jobs and metadata age.
+    - ``POST /metadata/refresh``: read the station and sensor metadata again.
+
+    :param concurrency: number of jobs run at a time
+    :param queue_size: max number of jobs waiting
+    :param report_workers: number of processes making Powerpoint reports;
+        at least one, since plotting is not thread-safe
+    :param block_workers: see ``AnalysisCollection.run_analyses``
+    :param slice_days: see ``AnalysisCollection.run_analyses``
+    :param async_workers: see ``AnalysisCollection.run_analyses``
+    :param collection_workers: see ``AnalysisCollection.run_analyses``
+    :param snapshot_workers: see ``AnalysisCollection.run_analyses``
+    :param status_interval: seconds between run status updates of a job,
+        ``0`` for no status files
+    :param input_dir: directory of the input files given by path
+    """
+    def __init__(self, concurrency=1, queue_size=20, report_workers=None,
+                 block_workers=0, slice_days=None, async_workers=0, collection_workers=None,
+                 snapshot_workers=0, status_interval=10.0, input_dir=DEFAULT_INPUT_DIR):
+        self.concurrency = concurrency
+        self.input_dir = input_dir
+        self.queue_size = queue_size
+        self.report_workers = report_workers
+        self.block_workers = block_workers
+        self.slice_days = slice_days
+        self.async_workers = async_workers
+        self.collection_workers = collection_workers
+        self.snapshot_workers = snapshot_workers
+        self.status_interval = status_interval
+
+        self.db_pool = None
+        self.metadata = None
+        self.metadata_loaded_at = None
+        self.template = None
+        self.report_executor = None
+        self.job_executor = None
+        self.queue = None
+        self.jobs = OrderedDict()
+        # Names of the jobs whose input file is being saved
+        self.uploading = set()
+        self.job_ids = itertools.count(1)
+        self.started_at = None
+
+    def open(self):
+        """
+        Set up the warm state: connection pool, metadata,
+        report template and worker processes.
+        """
+        os.makedirs('results', exist_ok=True)
+        # Each running job needs a session per collection worker, a monitor connection
+        # and one for each Block and snapshot worker; the metadata is read with one more
+        db_params = DBParams()
+        if self.collection_workers is None:
+            self.collection_workers = len(db_params.hosts)
+        pool_size = max(DEFAULT_POOL_SIZE,
+                        self.concurrency * (self.collection_workers + self.block_workers
+                                            + self.snapshot_workers + 1) + 1)
+        if len(db_params.hosts) > 1:
+            self.db_pool = ReplicaPool(db_params, connect_timeout=5, maxconn=pool_size)
+            if not self.db_pool.check_all():
+                raise Exception('No database host is available')
+        else:
+            self.db_pool = ConnectionPool(db_params, connect_timeout=5, maxconn=pool_size)
+        log.info(f'Database connection pool opened with max {pool_size} connections per host')
+        self.refresh_metadata(refresh=False)
+        self.template = ReportTemplate(PPTX_TEMPLATE_PATH)
+        self.report_executor = ProcessPoolExecutor(max_workers=self.report_workers)
+        self.job_executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                               thread_name_prefix='tsa-job')
+
+    def close(self):
+        """
+        Wait for running jobs and release the warm state.
+        """
+        if self.job_executor is not None:
+            self.job_executor.shutdown()
+        if self.report_executor is not None:
+            self.report_executor.shutdown()
+        if self.db_pool is not None:
+            self.db_pool.close()
+            self.db_pool = None
+        log.info('Analysis service closed')
+
+    def refresh_metadata(self, refresh=True):
+        """
+        Read the station and sensor metadata from the database
+        and save it as the metadata snapshot, or if ``refresh`` is ``False``,
+        use the snapshot unless it is outdated, see ``tsa.metadata.current_metadata``.
+        """
+        with self.db_pool.connection() as pg_conn:
+            self.metadata = current_metadata(pg_conn, refresh=refresh)
+        self.metadata_loaded_at = datetime.now()
+        log.info(f'Using {repr(self.metadata)}')
+
+    def status(self):
+        return OrderedDict([
+            ('started_at', self.started_at and self.started_at.isoformat()),
+            ('concurrency', self.concurrency),
+            ('queue_size', self.queue_size),
+            ('queued', sum(j.status == 'queued' for j in self.jobs.values())),
+            ('running', [j.id for j in self.jobs.values() if j.status == 'running']),
+            ('n_sensors', len(self.metadata.sensors) if self.metadata else 0),
+            ('metadata_generated_at', self.metadata and self.metadata.generated_at.isoformat()),
+            ('metadata_loaded_at', self.metadata_loaded_at and self.metadata_loaded_at.isoformat())
+        ])
+
+    def run_job(self, job):
+        """
+        Run ``job`` in the calling thread, like ``tsabatch.py``
+        but with the warm state of the service.
+        Its log records are written to ``results/[name].log``.
+        """
+        handler = logging.FileHandler(filename=job.log_path,
+                                      mode='a' if job.option('resume') else 'w')
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+        handler.addFilter(JobLogFilter(job.id))
+        job_token = current_job_id.set(job.id)
+        logging.getLogger().addHandler(handler)
+        job.status = 'running'
+        job.started_at = datetime.now()
+        anls = None
+        try:
+            log.info(f'START OF JOB {job.id} with input={job.input_path} name={job.name} '
+                     f'options={dict(job.options)}')
+            anls = AnalysisCollection(input_path=job.input_path, name=job.name,
+                                      db_pool=self.db_pool)
+            anls.add_collections()
+            if job.option('dryvalidate'):
+                metadata = load_metadata()
+                anls.set_sensor_ids(pairs=metadata.sensors)
+                anls.validate_statids_with_set(station_ids=metadata.station_ids)
+            else:
+                if self.metadata.age() >= metadata_ttl():
+                    self.refresh_metadata(refresh=False)
+                anls.set_sensor_ids(pairs=self.metadata.sensors,
+                                    discrete=self.metadata.discrete_sensors)
+                if self.status_interval > 0:
+                    monitor = RunMonitor(anls,
+                                         status_path=job.status_path,
+                                         metrics_path=os.path.join('results', f'{job.name}.prom'),
+                                         interval=self.status_interval)
+                else:
+                    monitor = None
+                anls.run_analyses(details=bool(job.option('details')),
+                                  max_slides=job.option('max_slides'),
+                                  explain_slowest=job.option('explain_slowest') or 0,
+                                  monitor=monitor,
+                                  resume=bool(job.option('resume')),
+                                  extend_from=job.option('extend'),
+                                  block_workers=self.block_workers,
+                                  slice_days=self.slice_days,
+                                  async_workers=self.async_workers,
+                                  collection_workers=self.collection_workers,
+                                  snapshot_workers=self.snapshot_workers,
+                                  breakdown=job.option('breakdown'),
+                                  template=self.template,
+                                  report_executor=self.report_executor)
+                for line in anls.profile_summary():
+                    log.info(line)
+            job.status = 'done'
+        except:
+            log.exception(f'Job {job.id} failed')
+            job.status = 'failed'
+            job.message = 'Analysis failed, see the log file'
+        finally:
+            if anls is not None:
+                try:
+                    self.finish_job(job, anls)
+                except:
+                    log.exception(f'Cannot collect the results of job {job.id}')
+                    job.status = 'failed'
+                    job.message = 'Results could not be collected, see the log file'
+            job.finished_at = datetime.now()
+            log.info(f'END OF JOB {job.id}: {job.status}')
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+            current_job_id.reset(job_token)
+
+    def finish_job(self, job, anls):
+        """
+        Collect the error tree and result files of ``job``.
+        """
+        buf = io.StringIO()
+        job.has_errors = anls.collect_errors(buf)
+        job.errors = json.loads(buf.getvalue())
+        files = anls.output_files(max_slides=job.option('max_slides'))
+        if job.has_errors:
+            errs_dest = os.path.join('results', f'{job.name}_ERRORS.json')
+            with open(errs_dest, 'w') as fobj:
+                fobj.write(buf.getvalue())
+            files.append(errs_dest)
+            log.error(f'There were errors in the analysis collection, see {errs_dest}')
+        job.files = files + [job.log_path]
+
+    def check_submit(self, name):
+        """
+        Check that a job called ``name`` can be queued now.
+        """
+        check_name(name)
+        if name in self.uploading or any(j.name == name and j.active for j in self.jobs.values()):
+            raise RequestError(HTTPStatus.CONFLICT, f'Job {name} is already queued or running')
+        if self.queue.full():
+            raise RequestError(HTTPStatus.SERVICE_UNAVAILABLE,
+                               f'Queue is full ({self.queue_size} jobs), try again later')
+
+    def submit(self, name, input_path, options):
+        """
+        Add a job to the queue and return it.
+        """
+        self.check_submit(name)
+        if not input_path or not os.path.exists(input_path):
+            raise RequestError(HTTPStatus.BAD_REQUEST, f'Input {input_path} does not exist')
+        job = AnalysisJob(str(next(self.job_ids)), name, input_path, options)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        finished = [k for k, j in self.jobs.items() if not j.active]
+        for k in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[k]
+        log.info(f'Job {job.id} <{name}> queued')
+        return job
+
+    async def submit_request(self, query, headers, body):
+        """
+        Make a job of a ``POST /jobs`` request, see the class docs.
+        Uploaded input files are saved to ``results/uploads/[name]/``
+        in a thread, so that the event loop keeps serving meanwhile.
+        """
+        params = dict(query)
+        is_json = headers.get('content-type', '').startswith('application/json')
+        if is_json:
+            try:
+                params.update(json.loads(body.decode('utf-8')))
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, 'Body is not valid JSON')
+        input_path = params.pop('input', None)
+        name = params.pop('name', None)
+        filename = params.pop('filename', 'input.xlsx')
+        options = OrderedDict((k, option_value(k, v)) for k, v in params.items())
+        if options.get('extend') is not None:
+            check_name(options['extend'], key='extend')
+        if is_json:
+            check_input_path(input_path, self.input_dir)
+        else:
+            if os.path.splitext(filename)[1].lower() not in UPLOAD_SUFFIXES:
+                raise RequestError(HTTPStatus.BAD_REQUEST,
+                                   f'Uploaded file must be one of {", ".join(UPLOAD_SUFFIXES)}')
+            if not body:
+                raise RequestError(HTTPStatus.BAD_REQUEST, 'No input file in request body')
+            # The input of an active job of the same name must not be overwritten
+            self.check_submit(name)
+            # The file name is kept since it is the sheet title of a csv file
+            input_path = os.path.join('results', 'uploads', name,
+                                      to_filename(os.path.basename(filename)))
+            self.uploading.add(name)
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, save_upload,
+                                                               input_path, body)
+            finally:
+                self.uploading.discard(name)
+        return self.submit(name, input_path, options)
+
+    async def route(self, method, target, headers, body):
+        """
+        Handle a request and return HTTP status and JSON serializable response.
+        """
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        query = parse_qsl(url.query)
+        if path == '/jobs' and method == 'POST':
+            job = await self.submit_request(query, headers, body)
+            return HTTPStatus.ACCEPTED, job.to_dict()
+        if path == '/jobs' and method == 'GET':
+            return HTTPStatus.OK, [j.to_dict(full=False) for j in self.jobs.values()]
+        if path.startswith('/jobs/') and method == 'GET':
+            job = self.jobs.get(path[len('/jobs/'):])
+            if job is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f'No job {path[len("/jobs/"):]}')
+            return HTTPStatus.OK, job.to_dict()
+        if path == '/status' and method == 'GET':
+            return HTTPStatus.OK, self.status()
+        raise RequestError(HTTPStatus.NOT_FOUND, f'No such resource: {method} {url.path}')
+
+    async def handle(self, reader, writer):
+        """
+        Serve one HTTP/1.1 request of a connection and close it.
+        """
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1')
+                    if line in ('\r\n', '\n', ''):
+                        break
+                    k, _, v = line.partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, 'Malformed request')
+            if length > MAX_BODY_BYTES:
+                raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                   f'Request body is larger than {MAX_BODY_BYTES} bytes')
+            body = await reader.readexactly(length) if length else b''
+            if method == 'POST' and urlsplit(target).path.rstrip('/') == '/metadata/refresh':
+                await asyncio.get_event_loop().run_in_executor(None, self.refresh_metadata)
+                status, response = HTTPStatus.OK, self.status()
+            else:
+                status, response = await self.route(method, target, headers, body)
+        except RequestError as e:
+            status, response = e.status, {'error': str(e)}
+        except asyncio.IncompleteReadError:
+            status, response = HTTPStatus.BAD_REQUEST, {'error': 'Incomplete request body'}
+        except:
+            log.exception('Could not handle request')
+            status, response = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal error'}
+        data = json.dumps(response, indent=2).encode('utf-8')
+        writer.write((f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                      'Content-Type: application/json\r\n'
+                      f'Content-Length: {len(data)}\r\n'
+                      'Connection: close\r\n\r\n').encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def worker(self):
+        """
+        Run the queued jobs one at a time in the job threads.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                await loop.run_in_executor(self.job_executor, self.run_job, job)
+            finally:
+                self.queue.task_done()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        """
+        Accept requests at ``host``:``port`` until cancelled.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        workers = [asyncio.ensure_future(self.worker()) for _ in range(self.concurrency)]
+        server = await asyncio.start_server(self.handle, host, port)
+        self.started_at = datetime.now()
+        log.info(f'Analysis service listening on http://{host}:{port}/ '
+                 f'running {self.concurrency} jobs at a time')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for w in workers:
+                w.cancel()
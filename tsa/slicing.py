@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Evaluating primary Block queries in time slices on several connections
+
+import logging
+import psycopg2
+from .db import prepare_block_query
+from .db import prepare_block_runs_query
+from .ranges import join_ranges
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+log = logging.getLogger(__name__)
+
+# Default length of time slices: the default chunk interval of TimescaleDB hypertables
+DEFAULT_SLICE_INTERVAL = timedelta(days=7)
+
+# Time slices are aligned to multiples of the interval from this time,
+# like TimescaleDB aligns the chunks of a hypertable
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def hypertable_interval(pg_conn, table='statobs'):
+    """
+    Return the time chunk interval of hypertable ``table``
+    as timedelta, or ``None`` if it is not a hypertable
+    or TimescaleDB is not installed.
+    """
+    sql = ("SELECT d.interval_length "
+           "FROM _timescaledb_catalog.dimension AS d "
+           "INNER JOIN _timescaledb_catalog.hypertable AS h "
+           "ON d.hypertable_id = h.id "
+           "WHERE h.table_name = %s AND d.interval_length IS NOT NULL;")
+    with pg_conn.cursor() as cur:
+        try:
+            cur.execute(sql, (table,))
+            row = cur.fetchone()
+            pg_conn.commit()
+        except psycopg2.Error:
+            pg_conn.rollback()
+            return None
+    if row is None:
+        return None
+    return timedelta(microseconds=row[0])
+
+def slice_bounds(time_from, time_until, interval):
+    """
+    Return the multiples of ``interval`` from ``EPOCH``
+    between ``time_from`` and ``time_until``, as UTC datetimes.
+    Naive times are taken as UTC: the bounds only need to be near
+    the hypertable chunk boundaries, not exactly at them.
+    """
+    def utc(t):
+        if t.tzinfo is None:
+            return t.replace(tzinfo=timezone.utc)
+        return t
+    n = (utc(time_from) - EPOCH) // interval + 1
+    bounds = []
+    while EPOCH + n*interval < utc(time_until):
+        bounds.append(EPOCH + n*interval)
+        n += 1
+    return bounds
+
+class BlockSlicer:
+    """
+    Evaluates primary Block queries of a CondCollection in time slices,
+    each on its own connection borrowed from ``pool``, concurrently in
+    the threads of ``executor``, and joins the ranges of the slices,
+    see ``tsa.ranges.join_ranges``.
+    Each slice reads also the first observation of the next one,
+    so runs crossing a slice boundary are merged and the max validity
+    of an observation is applied at the boundaries like in a single query.
+
+    The connections need the same ``obs_main`` view as the collection's
+    own session: ``obs_view_sql`` creates it, see
+    ``CondCollection.obs_view_sql``. Note that concurrent connections
+    may see different data if observations are inserted meanwhile.
+
+    :param pool: ``tsa.db.ConnectionPool`` with a connection for each thread
+        in addition to the collection's session
+    :param executor: ``concurrent.futures.ThreadPoolExecutor``
+    :param obs_view_sql: SQL creating the ``obs_main`` view
+    :param time_from: start of the analysis period
+    :param time_until: end of the analysis period
+    :param interval: length of the slices, aligned like hypertable chunks
+    """
+    def __init__(self, pool, executor, obs_view_sql, time_from, time_until,
+                 interval=DEFAULT_SLICE_INTERVAL):
+        self.pool = pool
+        self.executor = executor
+        self.obs_view_sql = obs_view_sql
+        self.bounds = slice_bounds(time_from, time_until, interval)
+
+    def slices(self, since=None):
+        """
+        Return ``(since, until)`` pairs of the slices of the period
+        from ``since`` on; ``None`` stands for the start or end of the period.
+        """
+        bounds = [b for b in self.bounds if since is None or b > since]
+        return list(zip([since] + bounds, bounds + [None]))
+
+    def ranges(self, block, since=None):
+        """
+        Return the ranges of primary Block ``block`` as list
+        of ``(lower, upper, value)`` tuples, using the observations
+        from ``since`` on if given.
+        """
+        futures = [self.executor.submit(self.query, block.get_execute_sql(since=s, until=u),
+                                        block.discrete)
+                   for s, u in self.slices(since)]
+        ranges = []
+        for future in futures:
+            ranges = join_ranges(ranges, future.result())
+        return ranges
+
+    def query(self, sql, discrete=False):
+        """
+        Run Block query ``sql`` on a connection of the pool
+        and return its ranges in time order.
+        If ``discrete`` is ``True``, ``sql`` reads the runs of equal values.
+        """
+        with self.pool.connection() as pg_conn:
+            with pg_conn.cursor() as cur:
+                cur.execute(self.obs_view_sql)
+            pg_conn.commit()
+            if not prepare_block_query(pg_conn):
+                raise Exception('Cannot prepare Block query for time slices')
+            if discrete and not prepare_block_runs_query(pg_conn):
+                raise Exception('Cannot prepare Block runs query for time slices')
+            with pg_conn.cursor() as cur:
+                log.debug(sql)
+                cur.execute(sql)
+                rows = cur.fetchall()
+        return sorted(((r.lower, r.upper, v) for r, v in rows), key=lambda r: r[0])
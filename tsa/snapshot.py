@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Parallel Condition evaluation on an exported database snapshot, called by CondCollection
+
+import logging
+import uuid
+from .db import prepare_block_query
+from .db import prepare_block_runs_query
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+log = logging.getLogger(__name__)
+
+class SnapshotEvaluator:
+    """
+    Creates the Condition tables of a ``CondCollection`` and fetches
+    their results in parallel, in the threads of ``executor``,
+    each on its own connection borrowed from ``pool``,
+    so that all the observations are read from the same snapshot.
+
+    The collection's session exports its snapshot with ``pg_export_snapshot()``
+    and keeps its transaction open while the workers import it
+    (``SET TRANSACTION SNAPSHOT``) to query the primary Blocks.
+    Results shared between the workers go to ``UNLOGGED`` tables
+    in a schema of the run, dropped at the end, instead of session temp tables:
+    the ranges of the primary Blocks, and the Condition tables
+    that secondary Blocks refer to.
+    Once its Blocks and the Conditions it refers to are done,
+    each Condition is combined from the tables of the run schema
+    in a transaction of its own, since rows written after the snapshot
+    are not visible in it. The observations are thus read only on the snapshot,
+    and the results are the same as in the collection's own session,
+    also if observations are inserted meanwhile.
+
+    Like in the collection's session, a secondary Condition can refer to
+    primary ones and to secondary ones before it, and errors are recorded
+    to the Conditions the same way, see ``Condition.create_db_temptable``.
+    The database user needs the ``CREATE`` privilege on the database.
+
+    :param pool: ``tsa.db.ConnectionPool`` with a connection for each thread
+        in addition to the collection's session
+    :param executor: ``concurrent.futures.ThreadPoolExecutor``
+    """
+    def __init__(self, pool, executor):
+        self.pool = pool
+        self.executor = executor
+
+    def run(self, coll, keys, pg_conn):
+        """
+        Analyze the Conditions ``keys`` of CondCollection ``coll``,
+        and the ones they refer to, setting the results of ``keys``
+        like ``Condition.fetch_results_from_db``.
+        ``pg_conn`` is the collection's session.
+
+        :return: dict of Condition key - ``True`` if the results were fetched
+        """
+        required = coll.required_conditions(keys)
+        order = [k for k, c in coll.conditions.items()
+                 if c.is_valid() and k in required and not c.secondary]
+        order += [k for k, c in coll.conditions.items()
+                  if c.is_valid() and k in required and c.secondary]
+        schema = f'tsa_run_{uuid.uuid4().hex[:12]}'
+        with pg_conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {schema};")
+        pg_conn.commit()
+        log.info(f'Run schema {schema} created for {str(coll)}')
+        try:
+            return self.run_conditions(coll, order, set(keys), pg_conn, schema)
+        finally:
+            pg_conn.rollback()
+            with pg_conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA {schema} CASCADE;")
+            pg_conn.commit()
+            log.debug(f'Run schema {schema} dropped')
+
+    def run_conditions(self, coll, order, fetch_keys, pg_conn, schema):
+        with pg_conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot();")
+            snapshot_id = cur.fetchone()[0]
+        log.info(f'Querying Blocks of {len(order)} conditions on snapshot {snapshot_id}')
+        block_futures = {}
+        for i, k in enumerate(order):
+            future = self.executor.submit(self.create_blocks, coll, k, i, snapshot_id, schema)
+            block_futures[future] = k
+
+        coll.n_temptables_done = 0
+        blocks_ok = {}
+        done = set()
+        fetched = {}
+        running = {}
+        waiting = list(order)
+        while waiting or running or block_futures:
+            for k in list(waiting):
+                if k not in blocks_ok:
+                    continue
+                earlier = order[:order.index(k)]
+                if not all(r in done for r in coll.references(k) if r in earlier):
+                    continue
+                future = self.executor.submit(self.combine, coll, k, order.index(k),
+                                              blocks_ok[k], earlier, k in fetch_keys, schema)
+                running[future] = k
+                waiting.remove(k)
+            finished, _ = wait(list(block_futures) + list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in block_futures:
+                    blocks_ok[block_futures.pop(future)] = future.result()
+                    # All the workers have imported the snapshot
+                    if not block_futures:
+                        pg_conn.rollback()
+                else:
+                    k = running.pop(future)
+                    fetched[k] = future.result()
+                    done.add(k)
+                    coll.n_temptables_done += 1
+        coll.n_temptables_done = len(coll.conditions)
+        return {k: fetched.get(k, False) for k in fetch_keys}
+
+    def block_table(self, schema, i, bl):
+        return f'{schema}.c{i}_{bl.order_nr}'
+
+    def create_blocks(self, coll, key, i, snapshot_id, schema):
+        """
+        Create the tables of the primary Blocks of Condition ``key``
+        in ``schema``, reading the observations on snapshot ``snapshot_id``.
+
+        :return: ``True`` if the tables were created
+        """
+        cnd = coll.conditions[key]
+        try:
+            with self.pool.connection() as pg_conn:
+                with pg_conn.cursor() as cur:
+                    cur.execute(coll.obs_view_sql())
+                pg_conn.commit()
+                prepared = prepare_block_query(pg_conn)
+                if prepared and any(bl.discrete for bl in cnd.blocks.values()):
+                    prepared = prepare_block_runs_query(pg_conn)
+                with pg_conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+                    cur.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot_id,))
+                    for bl in cnd.blocks.values():
+                        if bl.secondary:
+                            continue
+                        table = self.block_table(schema, i, bl)
+                        execute_sql = bl.get_execute_sql() if prepared else None
+                        if execute_sql is not None:
+                            sql = (f"CREATE UNLOGGED TABLE {table} (valid_r, {bl.alias}) "
+                                   f"AS {execute_sql};")
+                        else:
+                            sql = f"CREATE UNLOGGED TABLE {table} AS ({bl.get_sql_def()});"
+                        log.debug(sql)
+                        with cnd.timings.time('block', block=bl.alias):
+                            cur.execute(sql)
+        except:
+            cnd.errors.add(
+                msg='Failed to create temp table',
+                log_add='exception'
+            )
+            return False
+        return True
+
+    def combine(self, coll, key, i, blocks_ok, earlier, fetch, schema):
+        """
+        Create the table of Condition ``key`` in ``schema``
+        from its Block tables and the tables of the Conditions ``earlier``
+        it refers to, and fetch its results if ``fetch`` is ``True``.
+
+        :return: ``True`` if the results were fetched
+        """
+        cnd = coll.conditions[key]
+        log.info(f'Creating temp table {cnd.id_string}')
+        if blocks_ok:
+            try:
+                with self.pool.connection() as pg_conn:
+                    with pg_conn.cursor() as cur:
+                        self.set_search_path(cur, schema)
+                        for bl in cnd.blocks.values():
+                            if not bl.secondary:
+                                cur.execute(f"CREATE TEMP TABLE {bl.alias} ON COMMIT DROP AS "
+                                            f"SELECT * FROM {self.block_table(schema, i, bl)};")
+                                continue
+                            if bl.source_view in coll.conditions and bl.source_view not in earlier:
+                                raise Exception(f'No results of Condition {bl.source_view} '
+                                                f'for Block {bl.alias}')
+                            with cnd.timings.time('block', block=bl.alias):
+                                cur.execute(bl.get_create_sql())
+                        with cnd.timings.time('combine'):
+                            cur.execute(f"CREATE UNLOGGED TABLE {schema}.{cnd.id_string} "
+                                        f"AS ( \n{cnd.get_select_sql()});")
+                log.info(f'Temp table created for {str(cnd)}')
+            except:
+                cnd.errors.add(
+                    msg='Failed to create temp table',
+                    log_add='exception'
+                )
+        if not fetch:
+            return False
+        # Fails like in the collection's session if the table was not created
+        with self.pool.connection() as pg_conn:
+            with pg_conn.cursor() as cur:
+                self.set_search_path(cur, schema)
+            return cnd.fetch_results_from_db(pg_conn)
+
+    def set_search_path(self, cur, schema):
+        """
+        Make the tables of ``schema`` visible by name
+        for the rest of the transaction of ``cur``.
+        """
+        cur.execute("SELECT set_config('search_path', %s || ', ' || current_setting('search_path'), true);",
+                    (schema,))
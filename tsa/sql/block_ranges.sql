@@ -0,0 +1,80 @@
+-- Prepared statement for primary Block queries, used by tsa.db.
+-- Parameterized form of the pack_ranges function in
+-- database/01_init_db.sql, reading from the obs_main temp view:
+-- $1 station id, $2 sensor id, $3 max validity of an observation,
+-- $4 value to compare to, $5 values of an "in" list (empty array otherwise),
+-- $6, $7, $8 whether a sensor value less than, equal to or greater than
+-- $4 makes the Block true, i.e. the operator as flags,
+-- see tsa.db.BLOCK_QUERY_FLAGS,
+-- $9 time of the first observation to use ('-infinity' for all),
+-- $10 end of the observations to use ('infinity' for all):
+-- observations before it and the first one from it on are used,
+-- so that the last one before it gets its validity from the next one.
+-- Since the first observation always starts a range,
+-- the ranges of consecutive time slices can be joined,
+-- see tsa.ranges.join_ranges.
+-- Expressing the operator this way avoids evaluating it on every row.
+-- Values are compared the same way as the literals in pack_ranges
+-- so that the results are identical: as double precision,
+-- except for "in" lists of several values that PostgreSQL resolves to real;
+-- "in" with a single value is passed as "=".
+-- Changes here must be made to pack_ranges too, and vice versa.
+--
+-- Example usage:
+--
+-- Operator ">=" and value 0.5:
+-- EXECUTE tsa_block_ranges(1104, 181, '30 minutes', 0.5, '{}', false, true, true, '-infinity', 'infinity');
+-- Operator "in" and values (1, 2):
+-- EXECUTE tsa_block_ranges(1104, 181, '30 minutes', NULL, '{1, 2}', false, false, false, '-infinity', 'infinity');
+
+PREPARE tsa_block_ranges (integer, integer, interval, float8, real[], boolean, boolean, boolean, timestamptz, timestamptz) AS
+WITH
+	ordered AS (
+		SELECT
+			tfrom,
+			lead(tfrom) OVER w AS tuntil,
+			COALESCE(istrue::int, -1) AS istrue,
+			lag(COALESCE(istrue::int, -1)) OVER w AS previous
+		FROM (
+			SELECT
+				tfrom,
+				((seval < $4 AND $6)
+					OR (seval = $4 AND $7)
+					OR (seval > $4 AND $8)
+					OR seval = ANY($5)) AS istrue
+			FROM obs_main
+			WHERE
+				statid = $1
+				AND seid = $2
+				AND tfrom >= $9
+				AND tfrom <= COALESCE(
+					(SELECT min(tfrom) FROM obs_main
+					 WHERE statid = $1 AND seid = $2 AND tfrom >= $10),
+					'infinity')
+			) AS obs
+		WINDOW w AS (ORDER BY tfrom)),
+	islands AS (
+		SELECT
+			tfrom,
+			tuntil,
+			istrue,
+			count(*) FILTER (WHERE istrue IS DISTINCT FROM previous)
+				OVER (ORDER BY tfrom ROWS UNBOUNDED PRECEDING) AS island
+		FROM ordered
+		WHERE tuntil IS NOT NULL)
+SELECT
+	tstzrange(min(tfrom),
+	max(CASE WHEN (tuntil-tfrom) > $3 THEN
+			tfrom + $3
+		ELSE
+			tuntil
+		END)) AS valid_r,
+	(CASE WHEN istrue = 1 THEN
+		true
+	WHEN istrue = 0 THEN
+		false
+	ELSE
+		NULL
+	END) AS istrue
+FROM islands
+GROUP BY island, istrue;
@@ -0,0 +1,98 @@
+-- Prepared statement for primary Blocks of discrete sensors, used by tsa.db.
+-- Returns the same ranges as tsa_block_ranges (block_ranges.sql),
+-- with the same parameters, but reads the runs of equal values
+-- from the seobs_runs table (database/04_discrete_runs.sql)
+-- instead of every observation: the Block value is evaluated
+-- once per run, and consecutive runs with the same value are merged.
+-- Runs must be built with max validity $3 of an observation
+-- and up to the last observation of the time span;
+-- CondCollection.check_block_runs uses tsa_block_ranges for Blocks whose runs are not.
+-- Only the observations at the ends of the time span come from obs_main:
+-- the first one, from which the first run is used,
+-- and the last two, since the last observation has no range
+-- and the one before it gets its validity from the last one.
+-- The bounds are read as scalar subqueries so that they are looked up once,
+-- and with LIMIT rather than min() and max() so that the lookups
+-- stop at the first matching observation.
+-- Changes here must be made to block_ranges.sql too, and vice versa.
+--
+-- Example usage:
+--
+-- Operator "=" and value 3:
+-- EXECUTE tsa_block_runs(1104, 27, '30 minutes', 3, '{}', false, true, false, '-infinity', 'infinity');
+
+PREPARE tsa_block_runs (integer, integer, interval, float8, real[], boolean, boolean, boolean, timestamptz, timestamptz) AS
+WITH
+	first_last AS (
+		SELECT
+			(SELECT tfrom FROM obs_main
+			 WHERE statid = $1 AND seid = $2 AND tfrom >= $9
+			 ORDER BY tfrom LIMIT 1) AS first_obs,
+			(SELECT tfrom FROM obs_main
+			 WHERE statid = $1 AND seid = $2 AND tfrom >= $9
+				AND tfrom <= COALESCE(
+					(SELECT tfrom FROM obs_main
+					 WHERE statid = $1 AND seid = $2 AND tfrom >= $10
+					 ORDER BY tfrom LIMIT 1),
+					'infinity')
+			 ORDER BY tfrom DESC LIMIT 1) AS last_obs),
+	bounds AS (
+		SELECT
+			first_obs,
+			last_obs,
+			(SELECT tfrom FROM obs_main
+			 WHERE statid = $1 AND seid = $2 AND tfrom >= first_obs AND tfrom < last_obs
+			 ORDER BY tfrom DESC LIMIT 1) AS previous_obs,
+			(SELECT max(vfrom) FROM seobs_runs
+			 WHERE statid = $1 AND seid = $2 AND vfrom <= first_obs) AS first_run,
+			(SELECT max(vfrom) FROM seobs_runs
+			 WHERE statid = $1 AND seid = $2 AND vfrom <= last_obs) AS last_run
+		FROM first_last
+		WHERE first_obs < last_obs),
+	ordered AS (
+		SELECT
+			vfrom,
+			vuntil,
+			COALESCE(istrue::int, -1) AS istrue,
+			lag(COALESCE(istrue::int, -1)) OVER w AS previous
+		FROM (
+			SELECT
+				greatest(vfrom, (SELECT first_obs FROM bounds)) AS vfrom,
+				-- The run of the last observation ends at the validity
+				-- of the observation before it
+				(CASE WHEN vfrom = (SELECT last_run FROM bounds) THEN
+					(SELECT least(last_obs, previous_obs + $3) FROM bounds)
+				ELSE
+					vuntil
+				END) AS vuntil,
+				((seval < $4 AND $6)
+					OR (seval = $4 AND $7)
+					OR (seval > $4 AND $8)
+					OR seval = ANY($5)) AS istrue
+			FROM seobs_runs
+			WHERE
+				statid = $1
+				AND seid = $2
+				AND vfrom >= (SELECT first_run FROM bounds)
+				AND vfrom < (SELECT last_obs FROM bounds)
+			) AS runs
+		WINDOW w AS (ORDER BY vfrom)),
+	islands AS (
+		SELECT
+			vfrom,
+			vuntil,
+			istrue,
+			count(*) FILTER (WHERE istrue IS DISTINCT FROM previous)
+				OVER (ORDER BY vfrom ROWS UNBOUNDED PRECEDING) AS island
+		FROM ordered)
+SELECT
+	tstzrange(min(vfrom), max(vuntil)) AS valid_r,
+	(CASE WHEN istrue = 1 THEN
+		true
+	WHEN istrue = 0 THEN
+		false
+	ELSE
+		NULL
+	END) AS istrue
+FROM islands
+GROUP BY island, istrue;
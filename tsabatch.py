@@ -9,23 +9,35 @@ wait / confirmation steps!
 import os
 import re
 import sys
-import json
 import argparse
-import psycopg2
 import logging
 from tsa.analysis_collection import AnalysisCollection
 from tsa.analysis_collection import PPTX_TEMPLATE_PATH
-from tsa.utils import list_local_statids
-from tsa.utils import list_local_sensors
-from tsa.utils import list_db_sensors
+from tsa.db import DEFAULT_POOL_SIZE
+from tsa.monitor import RunMonitor
+from tsa.metadata import current_metadata
+from tsa.metadata import load_metadata
+
+def positive_int(value):
+    """
+    Return command line argument ``value`` as integer of at least 1.
+    """
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}')
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+    return n
 
 def main():
     # ---- COMMAND LINE ARGUMENTS ----
     parser = argparse.ArgumentParser(description='Run TSA analyses as batch job.')
     parser.add_argument('-i', '--input',
                         type=str,
-                        help='Input Excel path relative to script directory',
-                        metavar='INPUT_XLSX_PATH',
+                        help=('Input Excel, CSV or Parquet file, or directory of CSV files, '
+                              'relative to script directory'),
+                        metavar='INPUT_PATH',
                         required=True)
     parser.add_argument('-n', '--name',
                         type=str,
@@ -34,7 +46,93 @@ def main():
                         required=True)
     parser.add_argument('--dryvalidate',
                         action='store_true',
-                        help='Only validate input Excel with hard-coded ids and names')
+                        help=('Only validate input Excel with the station ids and sensor names '
+                              'of the metadata snapshot, without database'))
+    parser.add_argument('--details',
+                        action='store_true',
+                        help=('Save result intervals of each sheet as Parquet file '
+                              'under results/ (requires pyarrow)'))
+    parser.add_argument('--breakdown',
+                        choices=['day', 'week', 'month'],
+                        default=None,
+                        help=('Report the validity of each condition also by day, week or month '
+                              'in an extra worksheet and on the slides'))
+    parser.add_argument('--report-workers',
+                        type=int,
+                        default=None,
+                        help=('Number of processes making Powerpoint reports '
+                              '(default: number of CPUs, 0: no separate processes)'),
+                        metavar='N')
+    parser.add_argument('--max-slides',
+                        type=positive_int,
+                        default=None,
+                        help='Split Powerpoint reports into files of at most N slides',
+                        metavar='N')
+    parser.add_argument('--explain-slowest',
+                        type=int,
+                        default=0,
+                        help=('Capture query plans of the N slowest database statements '
+                              'into the timing profile (runs them again)'),
+                        metavar='N')
+    parser.add_argument('--status-interval',
+                        type=float,
+                        default=10.0,
+                        help=('Seconds between updates of the run status file '
+                              'results/OUTPUT_BASENAME_status.json and metrics file '
+                              'results/OUTPUT_BASENAME.prom (default: 10, 0: no status files)'),
+                        metavar='SECONDS')
+    parser.add_argument('--metrics-dir',
+                        type=str,
+                        default='results',
+                        help=('Directory of the Prometheus metrics file, '
+                              'e.g. that of the node_exporter textfile collector'),
+                        metavar='DIR')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help=('Continue an interrupted run of the same name: '
+                              'reuse results saved under results/OUTPUT_BASENAME_checkpoints/ '
+                              'and analyze only the rest'))
+    parser.add_argument('--refresh-metadata',
+                        action='store_true',
+                        help=('Read the station and sensor metadata from the database '
+                              'and save it as the metadata snapshot, even if it is not outdated'))
+    parser.add_argument('--extend',
+                        type=str,
+                        default=None,
+                        help=('Extend the results of an earlier run over a shorter period '
+                              'starting at the same date, analyzing only the rest of the period'),
+                        metavar='EARLIER_BASENAME')
+    parser.add_argument('--block-workers',
+                        type=int,
+                        default=0,
+                        help=('Query primary Blocks in time slices using N database connections '
+                              'concurrently (default: 0, each Block in one query)'),
+                        metavar='N')
+    parser.add_argument('--slice-days',
+                        type=float,
+                        default=None,
+                        help=('Length of the time slices with --block-workers '
+                              '(default: chunk interval of the observation hypertable, or 7)'),
+                        metavar='DAYS')
+    parser.add_argument('--async-workers',
+                        type=int,
+                        default=0,
+                        help=('Analyze the conditions of a sheet with up to N concurrent queries '
+                              'on connections of their own (requires asyncpg; default: 0, '
+                              'one by one)'),
+                        metavar='N')
+    parser.add_argument('--snapshot-workers',
+                        type=int,
+                        default=0,
+                        help=('Analyze the conditions of a sheet in parallel using N database '
+                              'connections reading the same snapshot (default: 0, one by one)'),
+                        metavar='N')
+    parser.add_argument('--collection-workers',
+                        type=int,
+                        default=None,
+                        help=('Analyze up to N sheets concurrently in the database, '
+                              'each in its own session (default: number of hosts in PG_HOSTS, or 1)'),
+                        metavar='N')
     parser.add_argument('--log',
                         default='info',
                         const='info',
@@ -44,7 +142,7 @@ def main():
                               '`debug` will log e.g. SQL CREATE statements.'))
     args = parser.parse_args()
     if args.name is None:
-        # Use input excel name but replace file ending
+        # Use input file name but replace file ending
         args.name = re.sub("\.[^.]*$", "_OUT", args.input)
 
     # This directory, relative to the script dir,
@@ -58,10 +156,11 @@ def main():
                  'info': logging.INFO,
                  'debug': logging.DEBUG}
     log.setLevel(loglevels[args.log])
-    # Note that old logs by same name are overwritten!
+    # Note that old logs by same name are overwritten,
+    # unless resuming an earlier run!
     log_dest = os.path.join('results', f'{args.name}.log')
     fh = logging.FileHandler(filename=log_dest,
-                             mode='w')
+                             mode='a' if args.resume else 'w')
     ch = logging.StreamHandler()
     fh.setFormatter(
         logging.Formatter(
@@ -75,11 +174,20 @@ def main():
 
     log.info((f'START OF TSABATCH with input={args.input} name={args.name} '
               f'dryvalidate={args.dryvalidate}, '
+              f'details={args.details}, '
+              f'breakdown={args.breakdown}, '
+              f'resume={args.resume}, '
+              f'refresh_metadata={args.refresh_metadata}, '
+              f'extend={args.extend}, '
+              f'block_workers={args.block_workers}, '
+              f'async_workers={args.async_workers}, '
+              f'collection_workers={args.collection_workers}, '
+              f'snapshot_workers={args.snapshot_workers}, '
               f'log={args.log}, '
               f'logs are saved to {log_dest}'))
 
     # ---- APP LOGIC ----
-    anls = AnalysisCollection(input_xlsx=args.input, name=args.name)
+    anls = AnalysisCollection(input_path=args.input, name=args.name)
     log.info(f'Created {str(anls)}')
 
     # Add all sheets for analysis ("info" is omitted by default).
@@ -88,15 +196,13 @@ def main():
 
     if args.dryvalidate:
         log.info('Starting dry validation without database')
-        anls.set_sensor_ids(pairs=list_local_sensors())
-        anls.validate_statids_with_set(station_ids=list_local_statids())
-        haserrs, errors = anls.collect_errors()
-        if haserrs:
+        metadata = load_metadata()
+        anls.set_sensor_ids(pairs=metadata.sensors)
+        anls.validate_statids_with_set(station_ids=metadata.station_ids)
+        if anls.has_errors():
             errs_dest = os.path.join('results', f'{args.name}_ERRORS.json')
             with open(errs_dest, 'w') as fobj:
-                fobj.write(
-                    json.dumps(errors, indent=4)
-                )
+                anls.collect_errors(fobj)
             log.error('Dry validation exited with errors')
             raise Exception(
                 ('Dry validation exited with errors. '
@@ -108,14 +214,20 @@ def main():
 
     # ---- DB interaction begins here ----
 
-    # Sensor ids; global for all collections
+    # Sensor ids; global for all collections.
+    # They are read from the database only if the metadata snapshot is outdated.
+    # The same connection pool is used for the analyses later.
     try:
-        with psycopg2.connect(**anls.db_params, connect_timeout=5) as pg_conn:
-            db_sensors = list_db_sensors(pg_conn)
-        anls.set_sensor_ids(pairs=db_sensors)
-        log.info('Sensor ids from database set successfully')
+        # Block workers need their own connections besides the analysis sessions and the monitor
+        collection_workers = args.collection_workers or len(anls.db_params.hosts)
+        pool_size = max(DEFAULT_POOL_SIZE,
+                        collection_workers + args.block_workers + args.snapshot_workers + 1)
+        with anls.open_db_pool(connect_timeout=5, maxconn=pool_size).connection() as pg_conn:
+            metadata = current_metadata(pg_conn, refresh=args.refresh_metadata)
+        anls.set_sensor_ids(pairs=metadata.sensors, discrete=metadata.discrete_sensors)
+        log.info(f'Sensor ids of {repr(metadata)} set successfully')
     except:
-        log.exception('Could not set sensor ids from database for Blocks, quitting')
+        log.exception('Could not set sensor ids for Blocks, quitting')
         raise
 
     # Analysis will need the pptx template for results;
@@ -130,22 +242,40 @@ def main():
     # requesting station ids is bound to the same database connection
     # in which the time-limited observation view is created
     # and analyses are run.
-    # Thus we proceed by analyzing one collection at a time.
+    # CondCollections depend on their own db sessions and do not affect each other,
+    # so --collection-workers of them can be analyzed concurrently,
+    # e.g. on the database hosts of PG_HOSTS.
     # See .run_analyses() in analysis_collection.py.
-    # IDEA: If the database instance can use enough resources,
-    #       this step could be parallelized, using multiple db connections,
-    #       since CondCollections depend on their own db sessions
-    #       and do not affect each other.
 
-    anls.run_analyses()
+    if args.status_interval > 0:
+        monitor = RunMonitor(anls,
+                             status_path=os.path.join('results', f'{args.name}_status.json'),
+                             metrics_path=os.path.join(args.metrics_dir, f'{args.name}.prom'),
+                             interval=args.status_interval)
+    else:
+        monitor = None
+    anls.run_analyses(details=args.details,
+                      report_workers=args.report_workers,
+                      max_slides=args.max_slides,
+                      explain_slowest=args.explain_slowest,
+                      monitor=monitor,
+                      resume=args.resume,
+                      extend_from=args.extend,
+                      block_workers=args.block_workers,
+                      slice_days=args.slice_days,
+                      async_workers=args.async_workers,
+                      collection_workers=args.collection_workers,
+                      snapshot_workers=args.snapshot_workers,
+                      breakdown=args.breakdown)
+    anls.close_db_pool()
 
-    haserrs, errors = anls.collect_errors()
-    if haserrs:
+    for line in anls.profile_summary():
+        log.info(line)
+
+    if anls.has_errors():
         errs_dest = os.path.join('results', f'{args.name}_ERRORS.json')
         with open(errs_dest, 'w') as fobj:
-            fobj.write(
-                json.dumps(errors, indent=4)
-            )
+            anls.collect_errors(fobj)
         log.error(('There were errors in the analysis collection, '
                    f'see {log_dest} and {errs_dest}.'))
     else:
@@ -0,0 +1,148 @@
+#!env/bin/python
+
+"""
+Script for running TSA analyses as a long-running local service.
+Jobs are submitted over HTTP and run like tsabatch.py,
+but the database connections, metadata and report template
+are set up only once, see tsa/service.py.
+"""
+import os
+import asyncio
+import argparse
+import logging
+from tsa.service import AnalysisService
+from tsa.service import LOG_FORMAT
+from tsa.service import LOG_DATEFMT
+
+def main():
+    # ---- COMMAND LINE ARGUMENTS ----
+    parser = argparse.ArgumentParser(description='Run TSA analyses as a local HTTP service.')
+    parser.add_argument('--host',
+                        type=str,
+                        default='127.0.0.1',
+                        help='Address to listen to (default: 127.0.0.1)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8080,
+                        help='Port to listen to (default: 8080)')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=1,
+                        help='Number of jobs run at a time (default: 1)',
+                        metavar='N')
+    parser.add_argument('--input-dir',
+                        type=str,
+                        default='input',
+                        help=('Directory of the input files that jobs may give by path; '
+                              'uploaded files are always accepted (default: input)'),
+                        metavar='DIR')
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=20,
+                        help='Max number of jobs waiting to run (default: 20)',
+                        metavar='N')
+    parser.add_argument('--report-workers',
+                        type=int,
+                        default=None,
+                        help='Number of processes making Powerpoint reports (default: number of CPUs)',
+                        metavar='N')
+    parser.add_argument('--block-workers',
+                        type=int,
+                        default=0,
+                        help=('Query primary Blocks in time slices using N database connections '
+                              'per job (default: 0, each Block in one query)'),
+                        metavar='N')
+    parser.add_argument('--slice-days',
+                        type=float,
+                        default=None,
+                        help=('Length of the time slices with --block-workers '
+                              '(default: chunk interval of the observation hypertable, or 7)'),
+                        metavar='DAYS')
+    parser.add_argument('--async-workers',
+                        type=int,
+                        default=0,
+                        help=('Analyze the conditions of a sheet with up to N concurrent queries '
+                              'per job (requires asyncpg; default: 0, one by one)'),
+                        metavar='N')
+    parser.add_argument('--snapshot-workers',
+                        type=int,
+                        default=0,
+                        help=('Analyze the conditions of a sheet in parallel using N database '
+                              'connections per job reading the same snapshot (default: 0, one by one)'),
+                        metavar='N')
+    parser.add_argument('--collection-workers',
+                        type=int,
+                        default=None,
+                        help=('Analyze up to N sheets of a job concurrently in the database '
+                              '(default: number of hosts in PG_HOSTS, or 1)'),
+                        metavar='N')
+    parser.add_argument('--status-interval',
+                        type=float,
+                        default=10.0,
+                        help=('Seconds between updates of the run status of a job '
+                              '(default: 10, 0: no status files)'),
+                        metavar='SECONDS')
+    parser.add_argument('--log',
+                        default='info',
+                        const='info',
+                        nargs='?',
+                        choices=['error', 'warning', 'info', 'debug'],
+                        help='Logging level (default: `info`)')
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.queue_size < 1:
+        parser.error('--concurrency and --queue-size must be at least 1')
+    # Plotting is not thread-safe, so concurrent jobs make their reports in processes
+    if args.report_workers is not None and args.report_workers < 1:
+        parser.error('--report-workers must be at least 1')
+
+    os.makedirs('results', exist_ok=True)
+
+    # ---- LOGGING ----
+    # Log records of each job are also written to results/[job name].log
+    log = logging.getLogger()
+    loglevels = {'error': logging.ERROR,
+                 'warning': logging.WARNING,
+                 'info': logging.INFO,
+                 'debug': logging.DEBUG}
+    log.setLevel(loglevels[args.log])
+    log_dest = os.path.join('results', 'tsaservice.log')
+    fh = logging.FileHandler(filename=log_dest, mode='a')
+    ch = logging.StreamHandler()
+    fh.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    ch.setFormatter(logging.Formatter('%(levelname)-8s; %(message)s'))
+    log.addHandler(fh)
+    log.addHandler(ch)
+
+    log.info((f'START OF TSASERVICE on {args.host}:{args.port} '
+              f'concurrency={args.concurrency}, '
+              f'queue_size={args.queue_size}, '
+              f'block_workers={args.block_workers}, '
+              f'log={args.log}, '
+              f'logs are saved to {log_dest}'))
+
+    service = AnalysisService(concurrency=args.concurrency,
+                              queue_size=args.queue_size,
+                              report_workers=args.report_workers,
+                              block_workers=args.block_workers,
+                              slice_days=args.slice_days,
+                              async_workers=args.async_workers,
+                              collection_workers=args.collection_workers,
+                              snapshot_workers=args.snapshot_workers,
+                              status_interval=args.status_interval,
+                              input_dir=args.input_dir)
+    try:
+        service.open()
+    except:
+        log.exception('Could not set up the analysis service, quitting')
+        raise
+    try:
+        asyncio.run(service.serve(host=args.host, port=args.port))
+    except KeyboardInterrupt:
+        log.info('Interrupted, waiting for running jobs to finish')
+    finally:
+        service.close()
+
+    log.info('END OF TSASERVICE')
+
+if __name__ == '__main__':
+    main()